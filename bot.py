@@ -9,7 +9,9 @@ import platform
 from dotenv import load_dotenv
 from src.common.logger import get_module_logger, LogConfig, CONFIRM_STYLE_CONFIG
 from src.common.crash_logger import install_crash_handler
-from src.main import MainSystem
+
+# src.main和插件模块在用到时再导入：图片处理进程池以forkserver/spawn方式启动工作进程时会重新导入本文件，
+# 而导入插件模块会连接数据库、启动心跳线程
 
 logger = get_module_logger("main_bot")
 confirm_logger_config = LogConfig(
@@ -103,8 +105,12 @@ def scan_provider(env_config: dict):
 
 
 async def graceful_shutdown():
+    from src.plugins.person_info.person_info import person_info_manager
+
     try:
         logger.info("正在优雅关闭麦麦...")
+        # 写回还在缓存中的个人信息修改
+        await person_info_manager.flush()
         tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
         for task in tasks:
             task.cancel()
@@ -211,6 +217,8 @@ def raw_main():
     env_config = {key: os.getenv(key) for key in os.environ}
     scan_provider(env_config)
 
+    from src.main import MainSystem
+
     # 返回MainSystem实例
     return MainSystem()
 
@@ -0,0 +1,24 @@
+"""基准测试脚本共用的工具"""
+
+import importlib.util
+import os
+import sys
+from types import ModuleType
+
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def load_module(name: str, relative_path: str) -> ModuleType:
+    """按文件路径加载被测模块
+
+    通过包导入src.plugins下的模块会先执行src/plugins/__init__.py，加载整个机器人（聊天流、表情包、数据库）。
+    被测模块只依赖标准库或src.common时，直接按文件加载，不需要机器人的运行环境。
+    """
+    if ROOT_PATH not in sys.path:
+        sys.path.append(ROOT_PATH)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT_PATH, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    # dataclass等需要从sys.modules中找到模块
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
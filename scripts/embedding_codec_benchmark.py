@@ -0,0 +1,101 @@
+"""嵌入向量存储格式的基准测试
+
+对每种存储格式（array/float16/int8）测量：
+    - 每条记录的BSON大小
+    - 加载时间：BSON解码全部记录并还原为float32矩阵的耗时
+    - recall@k：用还原后的向量检索，与原始向量精确检索的前k个结果的重合比例
+
+用法: python scripts/embedding_codec_benchmark.py [knowledges|emoji]
+不指定集合时生成有聚类结构的合成向量；指定集合时读取数据库中已有的嵌入向量。
+最后200条向量作为查询，其余作为被检索的向量。
+"""
+
+import os
+import sys
+import time
+from typing import List
+
+import bson
+import numpy as np
+
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_path)
+
+from src.common.embedding_codec import (  # noqa E402
+    FORMAT_ARRAY,
+    FORMAT_FLOAT16,
+    FORMAT_INT8,
+    decode_embedding,
+    encode_embedding,
+)
+
+QUERY_COUNT = 200
+TOP_K = (1, 5, 10)
+
+
+def make_vectors(count: int = 20000, dim: int = 1024, clusters: int = 200) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.8 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors * 0.03  # 与常见embedding模型输出的数值范围相近
+
+
+def load_vectors(collection: str) -> np.ndarray:
+    from src.common.database import db
+
+    vectors = [decode_embedding(doc["embedding"]) for doc in db[collection].find({}, {"embedding": 1})]
+    dims = {v.size for v in vectors if v is not None}
+    if len(dims) != 1:
+        raise ValueError(f"{collection} 中的嵌入向量维度不一致或为空: {dims}")
+    return np.stack([v for v in vectors if v is not None])
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+
+def recall(exact: np.ndarray, approx: np.ndarray) -> float:
+    hits = sum(len(set(e.tolist()) & set(a.tolist())) for e, a in zip(exact, approx))
+    return hits / exact.size
+
+
+def main():
+    vectors = load_vectors(sys.argv[1]) if len(sys.argv) > 1 else make_vectors()
+    if len(vectors) <= QUERY_COUNT + max(TOP_K):
+        print(f"向量太少（{len(vectors)} 条），无法测试")
+        return
+    corpus, queries = vectors[:-QUERY_COUNT], normalize(vectors[-QUERY_COUNT:])
+    exact_corpus = normalize(corpus)
+    exact = {k: top_k(exact_corpus, queries, k) for k in TOP_K}
+    print(f"{len(corpus)} 条 {corpus.shape[1]} 维向量，{QUERY_COUNT} 条查询")
+    print(f"{'格式':<8}{'记录大小':>10}{'加载耗时':>12}  " + "  ".join(f"recall@{k:<3}" for k in TOP_K))
+
+    baseline = None
+    # 第一个格式作为对比的基准
+    for fmt in (FORMAT_ARRAY, FORMAT_FLOAT16, FORMAT_INT8):
+        documents: List[bytes] = [bson.encode({"embedding": encode_embedding(v, fmt)}) for v in corpus]
+        size = sum(len(d) for d in documents) / len(documents)
+
+        start = time.perf_counter()
+        decoded = np.stack([decode_embedding(bson.decode(d)["embedding"]) for d in documents])
+        elapsed = time.perf_counter() - start
+
+        decoded = normalize(decoded)
+        recalls = "  ".join(f"{recall(exact[k], top_k(decoded, queries, k)):<10.4f}" for k in TOP_K)
+        if baseline is None:
+            baseline = (size, elapsed)
+            ratio = ""
+        else:
+            ratio = f"  (体积 1/{baseline[0] / size:.1f}，加载 1/{baseline[1] / elapsed:.1f})"
+        print(f"{fmt:<8}{size / 1024:>8.2f}KB{elapsed * 1000:>10.1f}ms  {recalls}{ratio}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""图片处理工作池的基准测试
+
+对一批GIF、PNG、JPEG样本分别测量：
+    - legacy: 原先的做法，在事件循环中同步解码动图的全部帧后再抽帧、同步压缩
+    - inline: 新的处理函数（只处理被抽中的帧、JPEG按比例解码），仍在事件循环中同步执行
+    - worker: 新的处理函数交给ImageWorker进程池执行
+除了总耗时，还用一个每5ms唤醒一次的心跳任务记录事件循环的最大卡顿时间。
+
+用法: python scripts/image_worker_benchmark.py [样本目录]
+不指定目录时生成合成样本；指定目录时读取其中的gif/png/jpg/jpeg文件（例如data/emoji）。
+"""
+
+import asyncio
+import io
+import os
+import sys
+import time
+from typing import List, Tuple
+
+from PIL import Image
+
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_path)
+
+from src.common.image_worker import ImageWorker, compress_image, sample_frame_indices, sample_gif_frames, sniff_format  # noqa E402
+
+HEARTBEAT_INTERVAL = 0.005
+
+
+def make_samples() -> List[Tuple[str, bytes]]:
+    """生成合成样本：多帧动图、带透明通道的大PNG、大JPEG"""
+    samples = []
+    for frames, size in ((30, (240, 240)), (120, (320, 320)), (300, (480, 270))):
+        images = []
+        for i in range(frames):
+            img = Image.new("RGB", size, ((i * 7) % 256, (i * 13) % 256, (i * 29) % 256))
+            img.paste((255 - (i * 7) % 256, 128, 64), (i % size[0], i % size[1], i % size[0] + 40, i % size[1] + 40))
+            images.append(img.convert("P", palette=Image.Palette.ADAPTIVE))
+        buffer = io.BytesIO()
+        images[0].save(buffer, format="GIF", save_all=True, append_images=images[1:], duration=50, loop=0)
+        samples.append((f"gif_{frames}x{size[0]}x{size[1]}", buffer.getvalue()))
+
+    for name, mode, image_format, size in (
+        ("png_rgba_2048", "RGBA", "PNG", (2048, 2048)),
+        ("jpeg_4000", "RGB", "JPEG", (4000, 3000)),
+    ):
+        img = Image.effect_noise(size, 64).convert(mode)
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format, quality=95)
+        samples.append((name, buffer.getvalue()))
+    return samples
+
+
+def load_samples(directory: str) -> List[Tuple[str, bytes]]:
+    samples = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.lower().endswith((".gif", ".png", ".jpg", ".jpeg")):
+            with open(os.path.join(directory, filename), "rb") as f:
+                samples.append((filename, f.read()))
+    return samples
+
+
+def legacy_transform_gif(data: bytes) -> bytes:
+    """原先的transform_gif：解码并复制全部帧，再抽取其中15帧"""
+    gif = Image.open(io.BytesIO(data))
+    frames = []
+    try:
+        while True:
+            gif.seek(len(frames))
+            frames.append(gif.convert("RGB").copy())
+    except EOFError:
+        pass
+    selected = [frames[i] for i in sample_frame_indices(len(frames), 15)]
+    width, height = selected[0].size
+    target_width = int((200 / height) * width)
+    combined = Image.new("RGB", (target_width * len(selected), 200))
+    for idx, frame in enumerate(selected):
+        combined.paste(frame.resize((target_width, 200), Image.Resampling.LANCZOS), (idx * target_width, 0))
+    buffer = io.BytesIO()
+    combined.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def legacy_compress(data: bytes) -> bytes:
+    """原先的静态图压缩：完整解码后缩放"""
+    img = Image.open(io.BytesIO(data))
+    scale = min(1.0, (0.8 * 1024 * 1024 / len(data)) ** 0.5)
+    resized = img.resize((int(img.width * scale), int(img.height * scale)), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    if img.format == "PNG" and img.mode in ("RGBA", "LA"):
+        resized.save(buffer, format="PNG", optimize=True)
+    else:
+        resized.save(buffer, format="JPEG", quality=95, optimize=True)
+    return buffer.getvalue()
+
+
+async def measure(name: str, process) -> None:
+    """运行process()，同时记录事件循环心跳的最大延迟"""
+    max_lag = 0.0
+    running = True
+
+    async def heartbeat():
+        nonlocal max_lag
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            max_lag = max(max_lag, time.perf_counter() - start - HEARTBEAT_INTERVAL)
+
+    task = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await process()
+    elapsed = time.perf_counter() - start
+    running = False
+    await task
+    print(f"  {name:<8} 耗时 {elapsed * 1000:9.1f} ms   事件循环最大卡顿 {max_lag * 1000:8.1f} ms")
+
+
+async def main():
+    samples = load_samples(sys.argv[1]) if len(sys.argv) > 1 else make_samples()
+    worker = ImageWorker()
+    # 预先启动工作进程，不把进程创建时间算进结果
+    await asyncio.gather(*(worker.detect_format(b"warmup") for _ in range(worker.max_workers)))
+
+    for label, data in samples:
+        image_format = sniff_format(data)
+        print(f"{label} ({image_format}, {len(data) / 1024:.0f}KB):")
+        if image_format == "gif":
+            legacy, new, queued = legacy_transform_gif, sample_gif_frames, worker.sample_gif_frames
+        else:
+            legacy = legacy_compress
+
+            def new(data):
+                return compress_image(data, threshold=0)
+
+            def queued(data):
+                return worker.compress(data, threshold=0)
+
+        async def run_legacy(legacy=legacy, data=data):
+            legacy(data)
+
+        async def run_inline(new=new, data=data):
+            new(data)
+
+        async def run_worker(queued=queued, data=data):
+            await queued(data)
+
+        await measure("legacy", run_legacy)
+        await measure("inline", run_inline)
+        await measure("worker", run_worker)
+
+    # 并发处理整个样本集：同步执行时只能串行，工作池可以并行
+    async def all_legacy():
+        for _, data in samples:
+            legacy_transform_gif(data) if sniff_format(data) == "gif" else legacy_compress(data)
+
+    async def all_worker():
+        await asyncio.gather(
+            *(
+                worker.sample_gif_frames(data) if sniff_format(data) == "gif" else worker.compress(data, threshold=0)
+                for _, data in samples
+            )
+        )
+
+    print(f"全部{len(samples)}个样本:")
+    await measure("legacy", all_legacy)
+    await measure("worker", all_worker)
+    worker.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
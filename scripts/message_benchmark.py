@@ -0,0 +1,265 @@
+"""入站消息解析的微基准测试
+
+对比每10000条消息的解析耗时、to_dict往返耗时和内存占用：
+    - legacy: 原先不带__slots__的dataclass，消息段立即解析，to_dict使用asdict
+    - eager: 带__slots__的MessageBase，消息段立即解析
+    - lazy: LazyMessage，只解析message_info，消息段保持原始字典
+
+用法: python scripts/message_benchmark.py [消息条数]
+"""
+
+import gc
+import random
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+from benchmark_utils import load_module
+
+message_base = load_module("message_base", "src/plugins/message/message_base.py")
+LazyMessage = message_base.LazyMessage
+MessageBase = message_base.MessageBase
+
+
+# ---- 基线：改动前的消息结构（无__slots__，asdict序列化），解析逻辑与原实现一致 ----
+@dataclass
+class LegacySeg:
+    type: str
+    data: Union[str, List["LegacySeg"]]
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LegacySeg":
+        type = data.get("type")
+        data = data.get("data")
+        if type == "seglist":
+            data = [LegacySeg.from_dict(seg) for seg in data]
+        return cls(type=type, data=data)
+
+    def to_dict(self) -> Dict:
+        if self.type == "seglist":
+            return {"type": self.type, "data": [seg.to_dict() for seg in self.data]}
+        return {"type": self.type, "data": self.data}
+
+
+@dataclass
+class LegacyUserInfo:
+    platform: Optional[str] = None
+    user_id: Optional[int] = None
+    user_nickname: Optional[str] = None
+    user_cardname: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LegacyUserInfo":
+        return cls(
+            platform=data.get("platform"),
+            user_id=data.get("user_id"),
+            user_nickname=data.get("user_nickname", None),
+            user_cardname=data.get("user_cardname", None),
+        )
+
+
+@dataclass
+class LegacyGroupInfo:
+    platform: Optional[str] = None
+    group_id: Optional[int] = None
+    group_name: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LegacyGroupInfo":
+        if data.get("group_id") is None:
+            return None
+        return cls(
+            platform=data.get("platform"), group_id=data.get("group_id"), group_name=data.get("group_name", None)
+        )
+
+
+@dataclass
+class LegacyFormatInfo:
+    content_format: Optional[str] = None
+    accept_format: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LegacyFormatInfo":
+        return cls(content_format=data.get("content_format"), accept_format=data.get("accept_format"))
+
+
+@dataclass
+class LegacyTemplateInfo:
+    template_items: Optional[Dict] = None
+    template_name: Optional[str] = None
+    template_default: bool = True
+
+    def to_dict(self) -> Dict:
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LegacyTemplateInfo":
+        return cls(
+            template_items=data.get("template_items"),
+            template_name=data.get("template_name"),
+            template_default=data.get("template_default", True),
+        )
+
+
+@dataclass
+class LegacyMessageInfo:
+    platform: Optional[str] = None
+    message_id: Union[str, int, None] = None
+    time: Optional[float] = None
+    group_info: Optional[LegacyGroupInfo] = None
+    user_info: Optional[LegacyUserInfo] = None
+    format_info: Optional[LegacyFormatInfo] = None
+    template_info: Optional[LegacyTemplateInfo] = None
+    additional_config: Optional[dict] = None
+
+    def to_dict(self) -> Dict:
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LegacyMessageInfo":
+        return cls(
+            platform=data.get("platform"),
+            message_id=data.get("message_id"),
+            time=data.get("time"),
+            additional_config=data.get("additional_config", None),
+            group_info=LegacyGroupInfo.from_dict(data.get("group_info", {})),
+            user_info=LegacyUserInfo.from_dict(data.get("user_info", {})),
+            format_info=LegacyFormatInfo.from_dict(data.get("format_info", {})),
+            template_info=LegacyTemplateInfo.from_dict(data.get("template_info", {})),
+        )
+
+
+@dataclass
+class LegacyMessage:
+    message_info: LegacyMessageInfo
+    message_segment: LegacySeg
+    raw_message: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LegacyMessage":
+        return cls(
+            LegacyMessageInfo.from_dict(data.get("message_info", {})),
+            LegacySeg.from_dict(data.get("message_segment", {})),
+            data.get("raw_message"),
+        )
+
+    def to_dict(self) -> Dict:
+        result = {"message_info": self.message_info.to_dict(), "message_segment": self.message_segment.to_dict()}
+        if self.raw_message is not None:
+            result["raw_message"] = self.raw_message
+        return result
+
+
+def make_messages(count: int) -> List[Dict]:
+    """生成测试消息：纯文本、带@和回复的消息段列表、图片各占一部分"""
+    messages = []
+    image = "iVBORw0KGgo" * 200
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            segment = {"type": "text", "data": f"第{i}条消息，今天天气不错"}
+        elif kind == 1:
+            segment = {
+                "type": "seglist",
+                "data": [
+                    {"type": "reply", "data": str(i - 1)},
+                    {"type": "at", "data": "10001"},
+                    {"type": "text", "data": "你说得对"},
+                    {"type": "emoji", "data": image},
+                ],
+            }
+        else:
+            segment = {"type": "image", "data": image}
+        messages.append(
+            {
+                "message_info": {
+                    "platform": "qq",
+                    "message_id": i,
+                    "time": 1700000000 + i,
+                    "group_info": {"platform": "qq", "group_id": 100 + i % 50, "group_name": "测试群"},
+                    "user_info": {
+                        "platform": "qq",
+                        "user_id": random.randint(10000, 99999),
+                        "user_nickname": "测试用户",
+                        "user_cardname": "群名片",
+                    },
+                },
+                "message_segment": segment,
+                "raw_message": f"raw{i}",
+            }
+        )
+    return messages
+
+
+def best_of(func, repeat: int = 5) -> float:
+    """多次运行取最短耗时，计时期间关闭GC以减少抖动"""
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return best
+
+
+def measure_dump(parse, messages: List[Dict]) -> float:
+    """解析后的消息转回字典的耗时"""
+    parsed = [parse(m) for m in messages]
+    return best_of(lambda: [message.to_dict() for message in parsed])
+
+
+def measure_memory(parse, messages: List[Dict]) -> Tuple[int, int]:
+    """解析全部消息后常驻和峰值的内存占用（字节）"""
+    gc.collect()
+    tracemalloc.start()
+    parsed = [parse(m) for m in messages]  # noqa: F841 持有解析结果直到统计完内存
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return retained, peak
+
+
+def run(name: str, parse, messages: List[Dict]) -> None:
+    parse_time = best_of(lambda: [parse(m) for m in messages])
+    dump_time = measure_dump(parse, messages)
+    retained, peak = measure_memory(parse, messages)
+
+    print(
+        f"{name:<16} 解析 {parse_time * 1000:8.1f} ms   to_dict {dump_time * 1000:8.1f} ms   "
+        f"常驻 {retained / 1024:8.1f} KiB   峰值 {peak / 1024:8.1f} KiB"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    random.seed(0)
+    messages = make_messages(count)
+    print(f"{count}条消息：")
+    run("legacy", LegacyMessage.from_dict, messages)
+    run("eager(slots)", MessageBase.from_dict, messages)
+    run("lazy(slots)", LazyMessage.from_dict, messages)
+
+    def lazy_then_segment(data):
+        message = LazyMessage.from_dict(data)
+        message.message_segment  # noqa: B018 访问消息段触发解析
+        return message
+
+    run("lazy+访问消息段", lazy_then_segment, messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import struct
+from typing import List, Optional, Union
+
+import numpy as np
+from pymongo import UpdateOne
+
+from src.common.logger import get_module_logger
+
+logger = get_module_logger("embedding_codec")
+
+# 嵌入向量在数据库中的存储格式，可以用环境变量EMBEDDING_STORAGE_FORMAT选择
+FORMAT_FLOAT16 = "float16"  # 每维2字节，召回率与原始向量几乎相同
+FORMAT_INT8 = "int8"  # 每维1字节加一个float32缩放系数，体积最小，召回率略有下降
+FORMAT_ARRAY = "array"  # 原先的double数组，每维约9字节（BSON）
+STORAGE_FORMATS = (FORMAT_FLOAT16, FORMAT_INT8, FORMAT_ARRAY)
+DEFAULT_STORAGE_FORMAT = FORMAT_FLOAT16
+
+# 二进制格式的第一个字节标明编码方式
+_TAG_FLOAT16 = 1
+_TAG_INT8 = 2
+_FLOAT16_MAX = float(np.finfo(np.float16).max)
+
+
+def storage_format() -> str:
+    """当前配置的存储格式，配置无效时使用默认格式"""
+    value = os.getenv("EMBEDDING_STORAGE_FORMAT", DEFAULT_STORAGE_FORMAT).lower()
+    if value not in STORAGE_FORMATS:
+        logger.warning(f"未知的嵌入向量存储格式 {value}，使用 {DEFAULT_STORAGE_FORMAT}")
+        return DEFAULT_STORAGE_FORMAT
+    return value
+
+
+def encode_embedding(vector, fmt: Optional[str] = None) -> Union[bytes, List[float]]:
+    """把嵌入向量编码为存入数据库的格式
+
+    二进制格式以bytes存入MongoDB（BSON Binary），读出时仍是bytes，由decode_embedding还原。
+
+    Args:
+        vector: 嵌入向量（列表或numpy数组）
+        fmt: 存储格式，为None时使用storage_format()
+    """
+    fmt = fmt or storage_format()
+    array = np.asarray(vector, dtype=np.float32).ravel()
+    if fmt == FORMAT_ARRAY:
+        return array.tolist()
+    if fmt == FORMAT_INT8:
+        peak = float(np.max(np.abs(array))) if array.size else 0.0
+        scale = peak / 127 if peak > 0 else 1.0
+        quantized = np.clip(np.rint(array / scale), -127, 127).astype(np.int8)
+        return bytes([_TAG_INT8]) + struct.pack("<f", scale) + quantized.tobytes()
+    return bytes([_TAG_FLOAT16]) + np.clip(array, -_FLOAT16_MAX, _FLOAT16_MAX).astype("<f2").tobytes()
+
+
+def decode_embedding(value) -> Optional[np.ndarray]:
+    """把数据库中的嵌入向量还原为float32数组，兼容原先的double数组，无法解析时返回None"""
+    if value is None:
+        return None
+    if not isinstance(value, (bytes, bytearray, memoryview)):
+        return np.asarray(value, dtype=np.float32).ravel()
+
+    data = bytes(value)
+    if not data:
+        return None
+    tag, body = data[0], data[1:]
+    if tag == _TAG_FLOAT16 and len(body) % 2 == 0:
+        return np.frombuffer(body, dtype="<f2").astype(np.float32)
+    if tag == _TAG_INT8 and len(body) >= 4:
+        (scale,) = struct.unpack("<f", body[:4])
+        return np.frombuffer(body[4:], dtype=np.int8).astype(np.float32) * np.float32(scale)
+    logger.warning(f"无法解析的嵌入向量数据（类型标记 {tag}，{len(body)} 字节）")
+    return None
+
+
+def compact_embeddings(collection, fmt: Optional[str] = None, batch_size: int = 512) -> int:
+    """把集合中仍以double数组存储的嵌入向量改写为当前的二进制存储格式，返回改写的记录数"""
+    fmt = fmt or storage_format()
+    if fmt == FORMAT_ARRAY:
+        return 0
+    converted = 0
+    operations = []
+    for doc in collection.find({"embedding": {"$type": "array"}}, {"embedding": 1}):
+        embedding = encode_embedding(doc["embedding"], fmt)
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"embedding": embedding}}))
+        if len(operations) >= batch_size:
+            converted += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        converted += collection.bulk_write(operations, ordered=False).modified_count
+    if converted:
+        logger.info(f"已将 {collection.name} 中 {converted} 个嵌入向量改写为{fmt}格式")
+    return converted
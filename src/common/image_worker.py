@@ -0,0 +1,264 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+from src.common.logger import get_module_logger
+
+logger = get_module_logger("image_worker")
+
+# 常见图片格式的文件头，与Pillow的format名称（小写）对应
+_SIGNATURES = (
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"BM", "bmp"),
+)
+
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """根据文件头判断常见图片格式，不需要解码，无法判断时返回None"""
+    for signature, image_format in _SIGNATURES:
+        if data.startswith(signature):
+            return image_format
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def probe_format(data: bytes) -> Optional[str]:
+    """用Pillow读取图片头判断格式，无法识别时返回None"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.format.lower() if img.format else None
+    except Exception:
+        return None
+
+
+def sample_frame_indices(total_frames: int, max_frames: int) -> List[int]:
+    """从total_frames帧中均匀抽取最多max_frames帧的下标"""
+    if total_frames <= max_frames:
+        return list(range(total_frames))
+    return [int(i * (total_frames - 1) / (max_frames - 1)) for i in range(max_frames)]
+
+
+def sample_gif_frames(data: bytes, max_frames: int = 15, frame_height: int = 200, quality: int = 85) -> bytes:
+    """均匀抽取动图的若干帧，缩放到相同高度后水平拼接为一张JPG
+
+    只对被抽中的帧做颜色转换和缩放，其余帧不会被复制或保留在内存中。
+    """
+    with Image.open(io.BytesIO(data)) as gif:
+        total_frames = getattr(gif, "n_frames", 1)
+        indices = sample_frame_indices(total_frames, max_frames)
+        width, height = gif.size
+        frame_width = max(1, int(frame_height / height * width))
+
+        combined = Image.new("RGB", (frame_width * len(indices), frame_height))
+        for position, index in enumerate(indices):
+            gif.seek(index)
+            frame = gif.convert("RGB").resize((frame_width, frame_height), Image.Resampling.LANCZOS)
+            combined.paste(frame, (position * frame_width, 0))
+
+    buffer = io.BytesIO()
+    combined.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def dhash(data: bytes, hash_size: int = 8) -> int:
+    """计算图片的差异哈希（dHash），返回hash_size*hash_size位的整数
+
+    缩小为灰度图后比较每行相邻像素的明暗，对重新编码、轻微缩放和压缩不敏感。
+    透明部分先铺上白色背景；动图只取第一帧。
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("L", ((hash_size + 1) * 4, hash_size * 4))
+        if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+            rgba = img.convert("RGBA")
+            background = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+            img = Image.alpha_composite(background, rgba)
+        small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+def _static_format(img: Image.Image, source_format: Optional[str]) -> str:
+    """静态图片的保存格式：带透明通道的PNG保持PNG，其余保存为JPEG"""
+    return "PNG" if source_format == "PNG" and img.mode in ("RGBA", "LA") else "JPEG"
+
+
+def _save_static(img: Image.Image, source_format: Optional[str], quality: int) -> bytes:
+    """按_static_format选择的格式保存静态图片"""
+    buffer = io.BytesIO()
+    if _static_format(img, source_format) == "PNG":
+        img.save(buffer, format="PNG", optimize=True)
+    else:
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _save_animated(img: Image.Image, size: Tuple[int, int]) -> bytes:
+    """把动图的每一帧缩放到size后重新保存为GIF"""
+    frames = []
+    for frame_index in range(img.n_frames):
+        img.seek(frame_index)
+        frames.append(img.resize(size, Image.Resampling.LANCZOS))
+    buffer = io.BytesIO()
+    frames[0].save(
+        buffer,
+        format="GIF",
+        save_all=True,
+        append_images=frames[1:],
+        optimize=True,
+        duration=img.info.get("duration", 100),
+        loop=img.info.get("loop", 0),
+    )
+    return buffer.getvalue()
+
+
+def compress_image(data: bytes, target_size: int = int(0.8 * 1024 * 1024), threshold: int = 2 * 1024 * 1024) -> bytes:
+    """按面积比例缩小图片，使其大约压缩到target_size字节
+
+    不超过threshold的图片原样返回。动图逐帧缩小（额外再缩小一半），静态图保持原格式或转为JPG。
+    """
+    if len(data) <= threshold:
+        return data
+
+    with Image.open(io.BytesIO(data)) as img:
+        original_width, original_height = img.size
+        scale = min(1.0, (target_size / len(data)) ** 0.5)
+        new_width = max(1, int(original_width * scale))
+        new_height = max(1, int(original_height * scale))
+
+        if getattr(img, "is_animated", False):
+            return _save_animated(img, (max(1, new_width // 2), max(1, new_height // 2)))  # 动图折上折
+
+        source_format = img.format
+        img.draft(img.mode, (new_width, new_height))
+        resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        return _save_static(resized, source_format, 95)
+
+
+def prepare_image(data: bytes, max_side: int, max_bytes: int, quality: int = 85) -> Optional[Tuple[bytes, str]]:
+    """在发送给模型之前规范图片尺寸：长边不超过max_side，大小尽量不超过max_bytes
+
+    已经满足要求时返回None，调用方直接使用原图；否则返回(新的图片数据, 小写格式名)。
+    按面积估算缩放比例，编码后仍然超出预算时继续缩小，最多尝试4次。
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        if max(width, height) <= max_side and len(data) <= max_bytes:
+            return None
+
+        scale = min(1.0, max_side / max(width, height))
+        if len(data) > max_bytes:
+            scale = min(scale, (max_bytes / len(data)) ** 0.5)
+
+        animated = getattr(img, "is_animated", False)
+        source_format = img.format
+        if not animated:
+            img.draft(img.mode, (max(1, int(width * scale)), max(1, int(height * scale))))
+            image_format = _static_format(img, source_format)
+
+        for _ in range(4):
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            if animated:
+                encoded, image_format = _save_animated(img, size), "GIF"
+            else:
+                encoded = _save_static(img.resize(size, Image.Resampling.LANCZOS), source_format, quality)
+            if len(encoded) <= max_bytes:
+                break
+            scale *= 0.75
+        return encoded, image_format.lower()
+
+
+def _process_context():
+    """工作进程的启动方式
+
+    机器人进程里已经有pymongo、watchdog、日志和网络线程，fork会把这些线程持有的锁原样复制到子进程，可能死锁。
+    优先用forkserver：从一个干净的服务进程fork工作进程，并预先导入本模块；不支持时（Windows）用spawn。
+    本模块放在src.common下，工作进程导入它时不会执行src.plugins的__init__（加载整个机器人）。
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["__main__", __name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class ImageWorker:
+    """图片处理工作池
+
+    Pillow的解码、缩放和重新编码都是CPU密集的同步操作，放在事件循环里会卡住所有聊天。
+    这里把它们交给进程池执行，对外提供异步接口；进程池不可用时退回线程池。
+    格式识别优先用文件头判断，只有无法判断时才交给工作池。
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_process_context())
+            except (OSError, NotImplementedError) as e:
+                logger.warning(f"无法创建图片处理进程池，改用线程池: {str(e)}")
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="image_worker")
+        return self._executor
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        except BrokenProcessPool:
+            # 工作进程意外退出（例如被OOM杀掉），关闭损坏的进程池并重建后重试一次
+            logger.warning("图片处理进程池已损坏，正在重建")
+            self.shutdown()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+
+    async def detect_format(self, data: bytes) -> Optional[str]:
+        """识别图片格式（Pillow的小写格式名），无法识别时返回None"""
+        return sniff_format(data) or await self._run(probe_format, data)
+
+    async def sample_gif_frames(
+        self, data: bytes, max_frames: int = 15, frame_height: int = 200, quality: int = 85
+    ) -> bytes:
+        """抽取动图的若干帧并水平拼接为一张JPG"""
+        return await self._run(sample_gif_frames, data, max_frames, frame_height, quality)
+
+    async def compress(
+        self, data: bytes, target_size: int = int(0.8 * 1024 * 1024), threshold: int = 2 * 1024 * 1024
+    ) -> bytes:
+        """把超过threshold的图片压缩到大约target_size字节"""
+        return await self._run(compress_image, data, target_size, threshold)
+
+    async def prepare(self, data: bytes, max_side: int, max_bytes: int) -> Optional[Tuple[bytes, str]]:
+        """规范图片尺寸，已经满足要求时返回None"""
+        return await self._run(prepare_image, data, max_side, max_bytes)
+
+    async def dhash(self, data: bytes) -> int:
+        """计算图片的差异哈希"""
+        return await self._run(dhash, data)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# 创建全局实例
+image_worker = ImageWorker()
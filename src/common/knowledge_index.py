@@ -0,0 +1,406 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from src.common.database import db
+from src.common.embedding_codec import decode_embedding
+from src.common.logger import get_module_logger
+
+logger = get_module_logger("knowledge_index")
+
+
+class _IVF(NamedTuple):
+    centroids: np.ndarray  # (nlist, dim)，已归一化
+    lists: List[np.ndarray]  # 每个聚类中心下的行号
+    trained_on: int  # 训练时的向量数
+
+
+class _View(NamedTuple):
+    """索引的只读快照，检索时整体读取，同步时整体替换，检索不需要加锁"""
+
+    matrix: Optional[np.ndarray]  # (count, dim)，已归一化的float32
+    ids: List[Any]  # 行号 -> knowledges中的_id
+    ivf: Optional[_IVF]
+
+
+class KnowledgeIndex:
+    """知识库向量索引
+
+    把knowledges集合中的嵌入向量（double数组或embedding_codec的二进制格式）还原、归一化后按行存放在一个连续的float32文件中（numpy memmap），
+    _id等元数据存放在旁边的json中。精确检索是一次矩阵向量乘法（BLAS）加argpartition取前k个，
+    不再让MongoDB在聚合管道里逐元素计算每条知识的余弦相似度。
+
+    向量数达到ivf_threshold后启用IVF：用球面k-means把向量分到约sqrt(N)个聚类中，
+    检索时只计算与查询最接近的nprobe个聚类里的向量，是近似检索。
+
+    知识通常由独立的导入脚本写入数据库，机器人进程用sync_task在后台线程中每隔sync_interval秒按_id增量追加新写入的知识，
+    检索只读取当前的快照，不会在事件循环上访问数据库；发现数据库中的知识变少（例如被清空）时重建索引。
+    index_dir为None时只在内存中维护。
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    META_FILE = "meta.json"
+
+    def __init__(
+        self,
+        index_dir: Optional[str] = "data/knowledge_index",
+        sync_interval: float = 60,
+        ivf_threshold: int = 50000,
+        nprobe: int = 16,
+    ):
+        self.index_dir = index_dir
+        self.sync_interval = sync_interval
+        self.ivf_threshold = ivf_threshold  # 向量数达到该值时启用IVF，设为0关闭
+        self.nprobe = nprobe
+        self.dim: Optional[int] = None
+        self._view = _View(None, [], None)
+        self._scanned = 0  # 已经同步过的知识条数（包括维度不一致被跳过的）
+        self._last_id = None  # 已经同步过的最大_id
+        self._last_sync = 0.0
+        self._loaded = False
+        self._lock = threading.Lock()  # 保护同步过程，检索只读取_view快照
+
+    def __len__(self) -> int:
+        return len(self._view.ids)
+
+    # ---- 持久化 ----
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _load(self) -> None:
+        """读取上次保存的索引，文件不完整时从头重建"""
+        if self.index_dir is None:
+            return
+        if not os.path.exists(self._path(self.META_FILE)):
+            self._reset()
+            return
+        try:
+            with open(self._path(self.META_FILE), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            count, dim = len(meta["ids"]), meta["dim"]
+            expected = count * dim * 4
+            size = os.path.getsize(self._path(self.VECTORS_FILE))
+            if size < expected:
+                raise ValueError(f"向量文件不完整: {size} < {expected}")
+            if size > expected:
+                # 上次追加向量后没来得及写入元数据，丢弃多出来的部分
+                os.truncate(self._path(self.VECTORS_FILE), expected)
+            self.dim = dim
+            self._scanned = meta["scanned"]
+            self._last_id = ObjectId(meta["last_id"]) if meta.get("last_id") else None
+            ids = [ObjectId(i) for i in meta["ids"]]
+            self._view = _View(self._map(count), ids, None)
+            logger.info(f"已加载知识库索引: {count} 条向量")
+        except Exception as e:
+            logger.warning(f"知识库索引文件无效，将重新构建: {str(e)}")
+            self._reset()
+
+    def _map(self, count: int) -> Optional[np.ndarray]:
+        if count == 0:
+            return None
+        return np.memmap(self._path(self.VECTORS_FILE), dtype=np.float32, mode="r", shape=(count, self.dim))
+
+    def _save_meta(self) -> None:
+        meta = {
+            "dim": self.dim,
+            "scanned": self._scanned,
+            "last_id": str(self._last_id) if self._last_id else None,
+            "ids": [str(i) for i in self._view.ids],
+        }
+        tmp_path = self._path(self.META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path(self.META_FILE))
+
+    def _reset(self) -> None:
+        self.dim = None
+        self._view = _View(None, [], None)
+        self._scanned = 0
+        self._last_id = None
+        if self.index_dir is not None:
+            os.makedirs(self.index_dir, exist_ok=True)
+            # 用新文件替换而不是原地截断，仍在使用旧快照的检索不会读到被截掉的映射
+            tmp_path = self._path(self.VECTORS_FILE + ".tmp")
+            open(tmp_path, "wb").close()
+            os.replace(tmp_path, self._path(self.VECTORS_FILE))
+            self._save_meta()
+
+    # ---- 同步 ----
+
+    @staticmethod
+    def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def _append(self, ids: List[Any], vectors: np.ndarray) -> None:
+        """追加一批已归一化的向量"""
+        matrix, old_ids, ivf = self._view
+        count = len(old_ids) + len(ids)
+        if self.index_dir is not None:
+            with open(self._path(self.VECTORS_FILE), "ab") as f:
+                f.write(vectors.tobytes())
+            matrix = self._map(count)
+        else:
+            matrix = vectors if matrix is None else np.concatenate([matrix, vectors])
+        if ivf is not None:
+            ivf = self._extend_ivf(ivf, vectors, len(old_ids))
+        self._view = _View(matrix, old_ids + ids, ivf)
+
+    def _append_docs(self, docs: List[dict]) -> None:
+        ids, rows = [], []
+        for doc in docs:
+            embedding = decode_embedding(doc.get("embedding"))
+            if embedding is None or embedding.size == 0:
+                continue
+            if self.dim is None:
+                self.dim = embedding.size
+            if embedding.size != self.dim:
+                continue
+            ids.append(doc["_id"])
+            rows.append(embedding)
+        self._scanned += len(docs)
+        self._last_id = docs[-1]["_id"]
+        skipped = len(docs) - len(ids)
+        if skipped:
+            logger.warning(f"{skipped} 条知识没有嵌入向量或维度与索引({self.dim})不一致，未加入索引")
+        if ids:
+            self._append(ids, self._normalize_rows(np.asarray(rows, dtype=np.float32)))
+        if self.index_dir is not None:
+            self._save_meta()
+
+    def sync(self, force: bool = False) -> None:
+        """把数据库中新写入的知识追加到索引，两次同步至少间隔sync_interval秒（force时不限制）"""
+        with self._lock:
+            self._sync(force)
+
+    async def sync_task(self) -> None:
+        """后台同步任务：在线程中同步索引，不阻塞事件循环，同步失败时记录日志并在下个周期重试"""
+        while True:
+            try:
+                await asyncio.to_thread(self.sync, True)
+            except Exception:
+                logger.exception("知识库索引同步失败")
+            await asyncio.sleep(self.sync_interval)
+
+    def _sync(self, force: bool) -> None:
+        now = time.time()
+        if not force and now - self._last_sync < self.sync_interval:
+            return
+        self._last_sync = now
+        if not self._loaded:
+            self._loaded = True
+            self._load()
+
+        total = db.knowledges.estimated_document_count()
+        if total < self._scanned:
+            logger.info(f"知识库中的知识减少了（{self._scanned} -> {total}），重建索引")
+            self._reset()
+
+        query = {"_id": {"$gt": self._last_id}} if self._last_id is not None else {}
+        cursor = db.knowledges.find(query, {"embedding": 1}).sort("_id", 1).batch_size(1024)
+        added = len(self)
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= 4096:
+                self._append_docs(batch)
+                batch = []
+        if batch:
+            self._append_docs(batch)
+        added = len(self) - added
+        if added:
+            logger.info(f"知识库索引新增 {added} 条向量，共 {len(self)} 条")
+        self._maybe_train_ivf()
+
+    # ---- IVF ----
+
+    def _maybe_train_ivf(self) -> None:
+        matrix, ids, ivf = self._view
+        count = len(ids)
+        if not self.ivf_threshold or count < self.ivf_threshold:
+            if ivf is not None:
+                self._view = _View(matrix, ids, None)
+            return
+        # 向量数比训练时翻倍后重新训练，保持聚类大小均衡
+        if ivf is None or count >= ivf.trained_on * 2:
+            start = time.time()
+            self._view = _View(matrix, ids, self._train_ivf(matrix))
+            logger.info(
+                f"知识库IVF训练完成: {count} 条向量，{len(self._view.ivf.lists)} 个聚类，耗时 {time.time() - start:.1f}秒"
+            )
+
+    @staticmethod
+    def _assign(centroids: np.ndarray, matrix: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        return np.concatenate(
+            [np.argmax(matrix[i : i + chunk] @ centroids.T, axis=1) for i in range(0, len(matrix), chunk)]
+        )
+
+    def _train_ivf(self, matrix: np.ndarray, iterations: int = 10) -> _IVF:
+        """球面k-means：在抽样上训练聚类中心，再把全部向量分配到最近的中心"""
+        count = len(matrix)
+        nlist = max(16, int(np.sqrt(count)))
+        rng = np.random.default_rng(0)
+        sample = np.asarray(matrix[np.sort(rng.choice(count, min(count, nlist * 64), replace=False))])
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            nonempty = np.bincount(assignment, minlength=nlist) > 0
+            centroids[nonempty] = self._normalize_rows(sums[nonempty])
+
+        assignment = self._assign(centroids, matrix)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        lists = [order[bounds[i] : bounds[i + 1]] for i in range(nlist)]
+        return _IVF(centroids, lists, count)
+
+    def _extend_ivf(self, ivf: _IVF, vectors: np.ndarray, offset: int) -> _IVF:
+        """把新追加的向量分配到已有的聚类中"""
+        assignment = self._assign(ivf.centroids, vectors)
+        lists = list(ivf.lists)
+        for cluster in np.unique(assignment):
+            rows = np.flatnonzero(assignment == cluster) + offset
+            lists[cluster] = np.concatenate([lists[cluster], rows])
+        return _IVF(ivf.centroids, lists, ivf.trained_on)
+
+    # ---- 检索 ----
+
+    def _prepare_query(self, query_embedding) -> Optional[np.ndarray]:
+        """把查询向量转换为归一化的float32数组，维度不一致或为零向量时返回None"""
+        if query_embedding is None or len(query_embedding) == 0:
+            return None
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        if query.size != self.dim:
+            logger.warning(f"查询向量维度({query.size})与知识库索引维度({self.dim})不一致")
+            return None
+        norm = float(np.linalg.norm(query))
+        return query / norm if norm > 0 else None
+
+    def search(self, query_embedding, limit: int = 5, threshold: Optional[float] = None) -> List[Tuple[Any, float]]:
+        """返回与查询余弦相似度最高的limit条知识的(_id, 相似度)，按相似度降序排列
+
+        Args:
+            query_embedding: 查询的嵌入向量
+            limit: 最大返回结果数
+            threshold: 相似度阈值，低于阈值的结果被丢弃
+        """
+        return self.search_many([query_embedding], limit, threshold)[0]
+
+    def search_many(
+        self, query_embeddings: List, limit: int = 5, threshold: Optional[float] = None
+    ) -> List[List[Tuple[Any, float]]]:
+        """用一次矩阵乘法检索多个查询，返回每个查询的结果，格式与search相同
+
+        启用IVF时取所有查询探测到的聚类的并集作为候选，每个查询的候选不少于单独检索时。
+        """
+        results: List[List[Tuple[Any, float]]] = [[] for _ in query_embeddings]
+        if not query_embeddings or limit <= 0:
+            return results
+
+        matrix, ids, ivf = self._view
+        if matrix is None:
+            return results
+        prepared = [(i, self._prepare_query(q)) for i, q in enumerate(query_embeddings)]
+        prepared = [(i, q) for i, q in prepared if q is not None]
+        if not prepared:
+            return results
+        positions = [i for i, _ in prepared]
+        queries = np.stack([q for _, q in prepared])
+
+        if ivf is not None:
+            nprobe = min(self.nprobe, len(ivf.lists))
+            probe = np.unique(np.argpartition(-(queries @ ivf.centroids.T), nprobe - 1, axis=1)[:, :nprobe])
+            rows = np.sort(np.concatenate([ivf.lists[c] for c in probe]))
+            scores = queries @ matrix[rows].T
+        else:
+            rows = None
+            scores = queries @ matrix.T
+
+        for position, query_scores in zip(positions, scores):
+            if threshold is not None:
+                candidates = np.flatnonzero(query_scores >= threshold)
+            else:
+                candidates = np.arange(len(query_scores))
+            if len(candidates) > limit:
+                candidates = candidates[np.argpartition(-query_scores[candidates], limit - 1)[:limit]]
+            candidates = candidates[np.argsort(-query_scores[candidates])]
+            rows_found = rows[candidates] if rows is not None else candidates
+            results[position] = [(ids[row], float(query_scores[i])) for row, i in zip(rows_found, candidates)]
+        return results
+
+    def search_documents(
+        self,
+        query_embedding,
+        limit: int = 5,
+        threshold: Optional[float] = None,
+        projection: Optional[Dict[str, int]] = None,
+    ) -> List[dict]:
+        """检索并从数据库读取对应的知识，每条结果附带similarity字段，按相似度降序排列"""
+        return self.search_documents_many([query_embedding], limit, threshold, projection)[0]
+
+    async def search_documents_async(
+        self,
+        query_embedding,
+        limit: int = 5,
+        threshold: Optional[float] = None,
+        projection: Optional[Dict[str, int]] = None,
+    ) -> List[dict]:
+        """search_documents的异步版本：检索和读取数据库都在线程中执行，不阻塞事件循环"""
+        return await asyncio.to_thread(self.search_documents, query_embedding, limit, threshold, projection)
+
+    async def search_documents_many_async(
+        self,
+        query_embeddings: List,
+        limit: int = 5,
+        threshold: Optional[float] = None,
+        projection: Optional[Dict[str, int]] = None,
+    ) -> List[List[dict]]:
+        """search_documents_many的异步版本：检索和读取数据库都在线程中执行，不阻塞事件循环"""
+        return await asyncio.to_thread(self.search_documents_many, query_embeddings, limit, threshold, projection)
+
+    def search_documents_many(
+        self,
+        query_embeddings: List,
+        limit: int = 5,
+        threshold: Optional[float] = None,
+        projection: Optional[Dict[str, int]] = None,
+    ) -> List[List[dict]]:
+        """检索多个查询并合并去重，按查询分组返回从数据库读取的知识
+
+        多个查询命中同一条知识时，只放在相似度最高的查询的分组里（相同时取靠前的查询）。
+        每条结果附带similarity（所在分组的相似度）和scores（查询下标 -> 相似度，包含所有命中它的查询）字段，
+        每个分组按相似度降序排列。所有查询的结果只读取一次数据库。
+        """
+        hits = self.search_many(query_embeddings, limit, threshold)
+        scores: Dict[Any, Dict[int, float]] = {}
+        for position, query_hits in enumerate(hits):
+            for _id, similarity in query_hits:
+                scores.setdefault(_id, {})[position] = similarity
+
+        grouped: List[List[dict]] = [[] for _ in query_embeddings]
+        if not scores:
+            return grouped
+        cursor = db.knowledges.find({"_id": {"$in": list(scores)}}, projection or {"content": 1})
+        for doc in cursor:
+            # 索引同步之前被删除的知识不会出现在结果中
+            doc_scores = scores[doc["_id"]]
+            best = max(doc_scores, key=lambda position: (doc_scores[position], -position))
+            doc["similarity"] = doc_scores[best]
+            doc["scores"] = doc_scores
+            grouped[best].append(doc)
+        for group in grouped:
+            group.sort(key=lambda doc: doc["similarity"], reverse=True)
+        return grouped
+
+
+# 机器人进程共用的知识库索引
+knowledge_index = KnowledgeIndex()
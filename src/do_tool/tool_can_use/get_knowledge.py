@@ -1,6 +1,6 @@
 from src.do_tool.tool_can_use.base_tool import BaseTool
 from src.plugins.chat.utils import get_embedding
-from src.common.database import db
+from src.common.knowledge_index import knowledge_index
 from src.common.logger import get_module_logger
 from typing import Dict, Any, Union
 
@@ -38,7 +38,7 @@ class SearchKnowledgeTool(BaseTool):
             # 调用知识库搜索
             embedding = await get_embedding(query, request_type="info_retrieval")
             if embedding:
-                knowledge_info = self.get_info_from_db(embedding, limit=3, threshold=threshold)
+                knowledge_info = await self.get_info_from_db(embedding, limit=3, threshold=threshold)
                 if knowledge_info:
                     content = f"你知道这些知识: {knowledge_info}"
                 else:
@@ -49,7 +49,7 @@ class SearchKnowledgeTool(BaseTool):
             logger.error(f"知识库搜索工具执行失败: {str(e)}")
             return {"name": "search_knowledge", "content": f"知识库搜索失败: {str(e)}"}
 
-    def get_info_from_db(
+    async def get_info_from_db(
         self, query_embedding: list, limit: int = 1, threshold: float = 0.5, return_raw: bool = False
     ) -> Union[str, list]:
         """从数据库中获取相关信息
@@ -66,59 +66,7 @@ class SearchKnowledgeTool(BaseTool):
         if not query_embedding:
             return "" if not return_raw else []
 
-        # 使用余弦相似度计算
-        pipeline = [
-            {
-                "$addFields": {
-                    "dotProduct": {
-                        "$reduce": {
-                            "input": {"$range": [0, {"$size": "$embedding"}]},
-                            "initialValue": 0,
-                            "in": {
-                                "$add": [
-                                    "$$value",
-                                    {
-                                        "$multiply": [
-                                            {"$arrayElemAt": ["$embedding", "$$this"]},
-                                            {"$arrayElemAt": [query_embedding, "$$this"]},
-                                        ]
-                                    },
-                                ]
-                            },
-                        }
-                    },
-                    "magnitude1": {
-                        "$sqrt": {
-                            "$reduce": {
-                                "input": "$embedding",
-                                "initialValue": 0,
-                                "in": {"$add": ["$$value", {"$multiply": ["$$this", "$$this"]}]},
-                            }
-                        }
-                    },
-                    "magnitude2": {
-                        "$sqrt": {
-                            "$reduce": {
-                                "input": query_embedding,
-                                "initialValue": 0,
-                                "in": {"$add": ["$$value", {"$multiply": ["$$this", "$$this"]}]},
-                            }
-                        }
-                    },
-                }
-            },
-            {"$addFields": {"similarity": {"$divide": ["$dotProduct", {"$multiply": ["$magnitude1", "$magnitude2"]}]}}},
-            {
-                "$match": {
-                    "similarity": {"$gte": threshold}  # 只保留相似度大于等于阈值的结果
-                }
-            },
-            {"$sort": {"similarity": -1}},
-            {"$limit": limit},
-            {"$project": {"content": 1, "similarity": 1}},
-        ]
-
-        results = list(db.knowledges.aggregate(pipeline))
+        results = await knowledge_index.search_documents_async(query_embedding, limit=limit, threshold=threshold)
         logger.debug(f"知识库查询结果数量: {len(results)}")
 
         if not results:
@@ -198,9 +198,7 @@ class SubHeartflow:
             limit=global_config.MAX_CONTEXT_SIZE,
         )
 
-        relation_prompt = ""
-        for person in who_chat_in_group:
-            relation_prompt += await relationship_manager.build_relationship_info(person)
+        relation_prompt = await relationship_manager.build_relationship_infos(who_chat_in_group)
 
         # relation_prompt_all = (
         #     f"{relation_prompt}关系等级越大，关系越好，请分析聊天记录，"
@@ -90,6 +90,10 @@ class Identity:
         """
         获取身份特征的prompt
         """
+        return random.choice(self.get_prompt_candidates(x_person, level))
+
+    def get_prompt_candidates(self, x_person, level) -> List[str]:
+        """get_prompt所有可能的结果，level为1时每个细节对应一个结果，其余level只有一个结果"""
         if x_person == 2:
             prompt_identity = "你"
         elif x_person == 1:
@@ -98,14 +102,12 @@ class Identity:
             prompt_identity = "他"
 
         if level == 1:
-            identity_detail = self.identity_detail
-            random.shuffle(identity_detail)
-            prompt_identity += identity_detail[0]
+            return [f"{prompt_identity}{detail}。" for detail in self.identity_detail]
         elif level == 2:
-            for detail in identity_detail:
+            for detail in self.identity_detail:
                 prompt_identity += f",{detail}"
         prompt_identity += "。"
-        return prompt_identity
+        return [prompt_identity]
 
     def to_dict(self) -> dict:
         """将身份特征转换为字典格式"""
@@ -1,4 +1,5 @@
-from typing import Optional
+from typing import Dict, Optional, Tuple
+import random
 from .personality import Personality
 from .identity import Identity
 
@@ -16,6 +17,8 @@ class Individuality:
     def __init__(self):
         self.personality: Optional[Personality] = None
         self.identity: Optional[Identity] = None
+        # (type, x_person, level) -> get_prompt所有可能的结果，人格或身份更新时清空
+        self._prompt_cache: Dict[tuple, Tuple[str, ...]] = {}
 
     @classmethod
     def get_instance(cls) -> "Individuality":
@@ -62,6 +65,7 @@ class Individuality:
         self.identity = Identity.initialize(
             identity_detail=identity_detail, height=height, weight=weight, age=age, gender=gender, appearance=appearance
         )
+        self.invalidate_prompt_cache()
 
     def to_dict(self) -> dict:
         """将个体特征转换为字典格式"""
@@ -78,18 +82,30 @@ class Individuality:
             instance.personality = Personality.from_dict(data["personality"])
         if data.get("identity"):
             instance.identity = Identity.from_dict(data["identity"])
+        instance.invalidate_prompt_cache()
         return instance
 
+    def invalidate_prompt_cache(self) -> None:
+        """清空get_prompt的缓存，直接修改人格或身份的属性后需要调用"""
+        self._prompt_cache.clear()
+
     def get_prompt(self, type, x_person, level):
         """
         获取个体特征的prompt
+
+        每组参数的所有可能结果只构建一次，随机选择侧面或细节的level每次仍从中随机选一个
         """
-        if type == "personality":
-            return self.personality.get_prompt(x_person, level)
-        elif type == "identity":
-            return self.identity.get_prompt(x_person, level)
-        else:
-            return ""
+        key = (type, x_person, level)
+        candidates = self._prompt_cache.get(key)
+        if candidates is None:
+            if type == "personality":
+                candidates = tuple(self.personality.get_prompt_candidates(x_person, level))
+            elif type == "identity":
+                candidates = tuple(self.identity.get_prompt_candidates(x_person, level))
+            else:
+                candidates = ("",)
+            self._prompt_cache[key] = candidates
+        return candidates[0] if len(candidates) == 1 else random.choice(candidates)
 
     def get_traits(self, factor):
         """
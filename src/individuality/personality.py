@@ -121,6 +121,10 @@ class Personality:
         return instance
 
     def get_prompt(self, x_person, level):
+        return random.choice(self.get_prompt_candidates(x_person, level))
+
+    def get_prompt_candidates(self, x_person, level) -> List[str]:
+        """get_prompt所有可能的结果，level为2时每个侧面对应一个结果，其余level只有一个结果"""
         # 开始构建prompt
         if x_person == 2:
             prompt_personality = "你"
@@ -133,9 +137,7 @@ class Personality:
         prompt_personality += self.personality_core
 
         if level == 2:
-            personality_sides = self.personality_sides
-            random.shuffle(personality_sides)
-            prompt_personality += f",{personality_sides[0]}"
+            return [f"{prompt_personality},{side}。" for side in self.personality_sides]
         elif level == 3:
             personality_sides = self.personality_sides
             for side in personality_sides:
@@ -143,4 +145,4 @@ class Personality:
 
         prompt_personality += "。"
 
-        return prompt_personality
+        return [prompt_personality]
@@ -14,6 +14,7 @@ from .plugins.storage.storage import MessageStorage
 from .plugins.config.config import global_config
 from .plugins.chat.bot import chat_bot
 from .common.logger import get_module_logger
+from .common.knowledge_index import knowledge_index
 from .plugins.remote import heartbeat_thread  # noqa: F401
 from .individuality.individuality import Individuality
 from .common.server import global_server
@@ -27,6 +28,7 @@ class MainSystem:
         self.mood_manager = MoodManager.get_instance()
         self.hippocampus_manager = HippocampusManager.get_instance()
         self._message_manager_started = False
+        self._knowledge_sync_task = None
         self.individuality = Individuality.get_instance()
 
         # 使用消息API替代直接的FastAPI实例
@@ -55,6 +57,9 @@ class MainSystem:
         emoji_manager.initialize()
         logger.success("表情包管理器初始化成功")
 
+        # 在后台加载并定期同步知识库向量索引，加载完成前检索使用已有的部分
+        self._knowledge_sync_task = asyncio.create_task(knowledge_index.sync_task())
+
         # 启动情绪管理器
         self.mood_manager.start_mood_update(update_interval=global_config.mood_update_interval)
         logger.success("情绪管理器启动成功")
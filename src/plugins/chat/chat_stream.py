@@ -1,9 +1,9 @@
 import asyncio
 import hashlib
 import time
-import copy
-from typing import Dict, Optional
+from typing import Dict, Optional, Set
 
+from pymongo import UpdateOne
 
 from ...common.database import db
 from ..message.message_base import GroupInfo, UserInfo
@@ -64,6 +64,31 @@ class ChatStream:
         self.saved = False
 
 
+class ChatStreamView(ChatStream):
+    """聊天流视图，用于代替对聊天流的深拷贝
+
+    视图共享原聊天流的状态，只在自身上覆盖本条消息的用户信息和群组信息（写时复制：
+    对视图的赋值只影响视图本身），未覆盖的属性读取时回落到原聊天流。
+    """
+
+    def __init__(self, stream: ChatStream, user_info: UserInfo, group_info: Optional[GroupInfo] = None):
+        # 不调用父类初始化，其余属性全部从原聊天流读取
+        self._stream = stream
+        self.user_info = user_info
+        if group_info:
+            self.group_info = group_info
+
+    def __getattr__(self, name):
+        # 只有在视图自身找不到属性时才会进入这里
+        if name.startswith("__") or name == "_stream":
+            raise AttributeError(name)
+        return getattr(self._stream, name)
+
+    def update_active_time(self):
+        """更新原聊天流的最后活跃时间"""
+        self._stream.update_active_time()
+
+
 class ChatManager:
     """聊天管理器，管理所有聊天流"""
 
@@ -78,6 +103,7 @@ class ChatManager:
     def __init__(self):
         if not self._initialized:
             self.streams: Dict[str, ChatStream] = {}  # stream_id -> ChatStream
+            self._dirty_streams: Set[str] = set()  # 有未保存修改的stream_id
             self._ensure_collection()
             self._initialized = True
             # 在事件循环中启动初始化
@@ -143,13 +169,10 @@ class ChatManager:
             # 检查内存中是否存在
             if stream_id in self.streams:
                 stream = self.streams[stream_id]
-                # 更新用户信息和群组信息
                 stream.update_active_time()
-                stream = copy.deepcopy(stream)
-                stream.user_info = user_info
-                if group_info:
-                    stream.group_info = group_info
-                return stream
+                self._dirty_streams.add(stream_id)
+                # 用本条消息的用户信息和群组信息覆盖，而不是拷贝整个聊天流
+                return ChatStreamView(stream, user_info, group_info)
 
             # 检查数据库中是否存在
             data = db.chat_streams.find_one({"stream_id": stream_id})
@@ -175,7 +198,7 @@ class ChatManager:
         # 保存到内存和数据库
         self.streams[stream_id] = stream
         await self._save_stream(stream)
-        return copy.deepcopy(stream)
+        return ChatStreamView(stream, user_info, group_info)
 
     def get_stream(self, stream_id: str) -> Optional[ChatStream]:
         """通过stream_id获取聊天流"""
@@ -193,11 +216,31 @@ class ChatManager:
         if not stream.saved:
             db.chat_streams.update_one({"stream_id": stream.stream_id}, {"$set": stream.to_dict()}, upsert=True)
             stream.saved = True
+        self._dirty_streams.discard(stream.stream_id)
 
     async def _save_all_streams(self):
-        """保存所有聊天流"""
-        for stream in self.streams.values():
-            await self._save_stream(stream)
+        """保存所有有修改的聊天流，一次bulk_write写入"""
+        if not self._dirty_streams:
+            return
+        dirty_ids, self._dirty_streams = self._dirty_streams, set()
+        operations = []
+        dirty_streams = []
+        for stream_id in dirty_ids:
+            stream = self.streams.get(stream_id)
+            if stream is None or stream.saved:
+                continue
+            operations.append(UpdateOne({"stream_id": stream_id}, {"$set": stream.to_dict()}, upsert=True))
+            dirty_streams.append(stream)
+        if not operations:
+            return
+        try:
+            db.chat_streams.bulk_write(operations, ordered=False)
+        except Exception:
+            # 写入失败时保留脏标记，下次自动保存重试
+            self._dirty_streams.update(dirty_ids)
+            raise
+        for stream in dirty_streams:
+            stream.saved = True
 
     async def load_all_streams(self):
         """从数据库加载所有聊天流"""
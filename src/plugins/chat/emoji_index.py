@@ -0,0 +1,131 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from src.common.embedding_codec import decode_embedding
+from src.common.logger import get_module_logger
+
+logger = get_module_logger("emoji_index")
+
+
+class EmojiVectorIndex:
+    """表情包向量索引
+
+    在内存中维护一个预先归一化的float32嵌入矩阵，每行对应一个表情包。
+    数据库中以二进制格式存储的嵌入向量在加入索引时还原为float32。
+    查询时只需要一次矩阵向量乘法加argpartition取前k个，不再每次从数据库读取全部嵌入向量。
+    增删都是O(1)（删除时用最后一行填补空位），矩阵容量按倍数增长。
+    """
+
+    def __init__(self, initial_capacity: int = 256):
+        self.initial_capacity = initial_capacity
+        self.dim: Optional[int] = None
+        self._matrix: Optional[np.ndarray] = None  # 前_size行有效
+        self._size = 0
+        self._ids: List[Any] = []  # 行号 -> 表情包_id
+        self._meta: List[Tuple[str, str]] = []  # 行号 -> (path, description)
+        self._rows: Dict[Any, int] = {}  # 表情包_id -> 行号
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, emoji_id) -> bool:
+        return emoji_id in self._rows
+
+    def clear(self) -> None:
+        self.dim = None
+        self._matrix = None
+        self._size = 0
+        self._ids = []
+        self._meta = []
+        self._rows = {}
+
+    def load(self, emojis: Iterable[dict]) -> None:
+        """用数据库中的表情包记录重建索引"""
+        self.clear()
+        skipped = 0
+        for emoji in emojis:
+            if not self.add(emoji["_id"], emoji.get("path", ""), emoji.get("description", ""), emoji.get("embedding")):
+                skipped += 1
+        if skipped:
+            logger.warning(f"[索引] {skipped} 个表情包的嵌入向量无效或维度不一致，未加入索引")
+        logger.info(f"[索引] 已加载 {self._size} 个表情包向量")
+
+    @staticmethod
+    def _normalize(vector) -> Optional[np.ndarray]:
+        array = decode_embedding(vector)
+        if array is None:
+            return None
+        norm = float(np.linalg.norm(array))
+        if not np.isfinite(norm):
+            return None
+        # 零向量保留为全零行，相似度恒为0
+        return array / norm if norm > 0 else array
+
+    def add(self, emoji_id, path: str, description: str, embedding) -> bool:
+        """加入或更新一个表情包，嵌入向量无效或维度不一致时返回False"""
+        if embedding is None or len(embedding) == 0:
+            return False
+        vector = self._normalize(embedding)
+        if vector is None or vector.size == 0:
+            return False
+        if self.dim is None:
+            self.dim = vector.size
+            self._matrix = np.zeros((self.initial_capacity, self.dim), dtype=np.float32)
+        elif vector.size != self.dim:
+            return False
+
+        row = self._rows.get(emoji_id)
+        if row is None:
+            if self._size == self._matrix.shape[0]:
+                grown = np.zeros((self._size * 2, self.dim), dtype=np.float32)
+                grown[: self._size] = self._matrix[: self._size]
+                self._matrix = grown
+            row = self._size
+            self._size += 1
+            self._ids.append(emoji_id)
+            self._meta.append((path, description))
+            self._rows[emoji_id] = row
+        else:
+            self._meta[row] = (path, description)
+        self._matrix[row] = vector
+        return True
+
+    def remove(self, emoji_id) -> bool:
+        """移除一个表情包，不存在时返回False"""
+        row = self._rows.pop(emoji_id, None)
+        if row is None:
+            return False
+        last = self._size - 1
+        if row != last:
+            # 用最后一行填补被删除的行
+            self._matrix[row] = self._matrix[last]
+            self._ids[row] = self._ids[last]
+            self._meta[row] = self._meta[last]
+            self._rows[self._ids[row]] = row
+        self._ids.pop()
+        self._meta.pop()
+        self._size = last
+        return True
+
+    def top_k(self, query, k: int = 10) -> List[Tuple[Any, str, str, float]]:
+        """返回与query余弦相似度最高的k个表情包，按相似度降序排列
+
+        Returns:
+            List[Tuple[_id, path, description, similarity]]
+        """
+        if self._size == 0 or query is None or len(query) == 0:
+            return []
+        vector = self._normalize(query)
+        if vector is None or vector.size != self.dim:
+            logger.warning(f"[索引] 查询向量维度({len(query)})与索引维度({self.dim})不一致")
+            return []
+
+        scores = self._matrix[: self._size] @ vector
+        k = min(k, self._size)
+        if k < self._size:
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(self._size)
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(self._ids[i], *self._meta[i], float(scores[i])) for i in candidates]
@@ -1,23 +1,29 @@
 import asyncio
 import base64
-import hashlib
 import os
 import random
 import time
 import traceback
-from typing import Optional, Tuple
-from PIL import Image
-import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
 from ...common.database import db
+from ...common.embedding_codec import compact_embeddings, encode_embedding
 from ..config.config import global_config
 from ..chat.utils import get_embedding
 from ..chat.utils_image import ImageManager, image_path_to_base64
+from .emoji_index import EmojiVectorIndex
+from .emoji_watcher import EmojiDirWatcher, FileHashCache
 from ..models.utils_model import LLM_request
 from src.common.logger import get_module_logger
 
 logger = get_module_logger("emoji")
 
+EMOJI_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif")
+
 
 image_manager = ImageManager()
 
@@ -42,6 +48,15 @@ class EmojiManager:
         self.emoji_num = 0
         self.emoji_num_max = global_config.max_emoji_num
         self.emoji_num_max_reach_deletion = global_config.max_reach_deletion
+        # 内存中的表情包向量索引，启动时加载，注册和清理时增量更新
+        self.index = EmojiVectorIndex()
+        # 扫描注册：读取文件和计算哈希的线程数、描述和嵌入的并发数、每批写入数据库的记录数
+        self._io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="emoji_io")
+        # (路径, 大小, 修改时间) -> 哈希，保存在表情包目录外，重启后没有变化的文件不需要重新读取
+        self.file_cache = FileHashCache(os.path.join("data", "emoji_hash_cache.json"))
+        self.watcher: Optional[EmojiDirWatcher] = None
+        self.scan_concurrency = 4
+        self.scan_write_batch_size = 50
 
         logger.info("启动表情包管理器")
 
@@ -72,6 +87,11 @@ class EmojiManager:
                 self._update_emoji_count()
                 # 启动时执行一次完整性检查
                 self.check_emoji_file_integrity()
+                # 改写旧的嵌入向量需要扫描整个集合，只在显式开启时执行
+                if os.getenv("COMPACT_EMOJI_EMBEDDINGS", "false").lower() == "true":
+                    converted = compact_embeddings(db.emoji)
+                    logger.info(f"已改写 {converted} 个表情包嵌入向量")
+                self._load_index()
             except Exception:
                 logger.exception("初始化表情管理器失败")
 
@@ -88,7 +108,6 @@ class EmojiManager:
         这个函数用于确保MongoDB数据库中存在emoji集合,并创建必要的索引。
 
         索引的作用是加快数据库查询速度:
-        - embedding字段的2dsphere索引: 用于加速向量相似度搜索,帮助快速找到相似的表情包
         - tags字段的普通索引: 加快按标签搜索表情包的速度
         - filename字段的唯一索引: 确保文件名不重复,同时加快按文件名查找的速度
 
@@ -96,8 +115,26 @@ class EmojiManager:
         """
         if "emoji" not in db.list_collection_names():
             db.create_collection("emoji")
-            db.emoji.create_index([("embedding", "2dsphere")])
             db.emoji.create_index([("filename", 1)], unique=True)
+        # 向量检索由内存索引完成，旧版本创建的2dsphere索引用不上，而且无法索引二进制格式的嵌入向量
+        if "embedding_2dsphere" in db.emoji.index_information():
+            db.emoji.drop_index("embedding_2dsphere")
+
+    def _load_index(self):
+        """从数据库加载所有未拉黑表情包的嵌入向量到内存索引"""
+        try:
+            self.index.load(
+                db.emoji.find(
+                    {"blacklist": {"$exists": False}}, {"_id": 1, "path": 1, "embedding": 1, "description": 1}
+                )
+            )
+        except Exception as e:
+            logger.error(f"[错误] 加载表情包索引失败: {str(e)}")
+
+    def _delete_emoji_record(self, emoji_id):
+        """删除表情包记录，同时移出内存索引"""
+        self.index.remove(emoji_id)
+        return db.emoji.delete_one({"_id": emoji_id})
 
     def record_usage(self, emoji_id: str):
         """记录表情使用次数"""
@@ -133,55 +170,27 @@ class EmojiManager:
                 return None
 
             try:
-                # 获取所有表情包
-                all_emojis = [
-                    e
-                    for e in db.emoji.find({}, {"_id": 1, "path": 1, "embedding": 1, "description": 1, "blacklist": 1})
-                    if "blacklist" not in e
-                ]
-
-                if not all_emojis:
+                if len(self.index) == 0:
                     logger.warning("数据库中没有任何表情包")
                     return None
 
-                # 计算余弦相似度并排序
-                def cosine_similarity(v1, v2):
-                    if not v1 or not v2:
-                        return 0
-                    dot_product = sum(a * b for a, b in zip(v1, v2))
-                    norm_v1 = sum(a * a for a in v1) ** 0.5
-                    norm_v2 = sum(b * b for b in v2) ** 0.5
-                    if norm_v1 == 0 or norm_v2 == 0:
-                        return 0
-                    return dot_product / (norm_v1 * norm_v2)
-
-                # 计算所有表情包与输入文本的相似度
-                emoji_similarities = [
-                    (emoji, cosine_similarity(text_embedding, emoji.get("embedding", []))) for emoji in all_emojis
-                ]
-
-                # 按相似度降序排序
-                emoji_similarities.sort(key=lambda x: x[1], reverse=True)
-
-                # 获取前3个最相似的表情包
-                top_10_emojis = emoji_similarities[: 10 if len(emoji_similarities) > 10 else len(emoji_similarities)]
+                # 一次矩阵向量乘法得到与所有表情包的相似度，取前10个
+                top_10_emojis = self.index.top_k(text_embedding, k=10)
 
                 if not top_10_emojis:
                     logger.warning("未找到匹配的表情包")
                     return None
 
-                # 从前3个中随机选择一个
-                selected_emoji, similarity = random.choice(top_10_emojis)
+                # 从前10个中随机选择一个
+                emoji_id, path, description, similarity = random.choice(top_10_emojis)
 
-                if selected_emoji and "path" in selected_emoji:
+                if path:
                     # 更新使用次数
-                    db.emoji.update_one({"_id": selected_emoji["_id"]}, {"$inc": {"usage_count": 1}})
+                    db.emoji.update_one({"_id": emoji_id}, {"$inc": {"usage_count": 1}})
 
-                    logger.info(
-                        f"[匹配] 找到表情包: {selected_emoji.get('description', '无描述')} (相似度: {similarity:.4f})"
-                    )
+                    logger.info(f"[匹配] 找到表情包: {description or '无描述'} (相似度: {similarity:.4f})")
                     # 稍微改一下文本描述，不然容易产生幻觉，描述已经包含 表情包 了
-                    return selected_emoji["path"], "[ %s ]" % selected_emoji.get("description", "无描述")
+                    return path, "[ %s ]" % (description or "无描述")
 
             except Exception as search_error:
                 logger.error(f"[错误] 搜索表情包失败: {str(search_error)}")
@@ -238,16 +247,288 @@ class EmojiManager:
             logger.error(f"[错误] 获取表情包情感失败: {str(e)}")
             return None
 
-    async def scan_new_emojis(self):
-        """扫描新的表情包"""
+    def _hash_emoji_file(self, image_path: str) -> Optional[Tuple[str, str]]:
+        """返回表情包文件的(md5, 图片格式)，文件无法读取或不是图片时返回None，在线程池中运行
+
+        文件的大小和修改时间没有变化时直接使用缓存的哈希，不重新读取
+        """
+        try:
+            image_hash, image_format = self.file_cache.get(image_path)
+        except Exception as e:
+            logger.error(f"[错误] 读取表情包失败: {image_path}, 错误: {str(e)}")
+            return None
+        if image_format is None:
+            logger.error(f"[错误] 无法识别的图片文件: {image_path}")
+            return None
+        return image_hash, image_format
+
+    async def _hash_emoji_files(self, filenames: List[str]) -> List[dict]:
+        """阶段1：在线程池中并行读取文件并计算哈希，无法读取的文件直接删除"""
+        loop = asyncio.get_running_loop()
+        paths = [os.path.join(self.EMOJI_DIR, filename) for filename in filenames]
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._io_executor, self._hash_emoji_file, path) for path in paths)
+        )
+
+        emojis = []
+        for filename, path, result in zip(filenames, paths, results):
+            if result is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                self.file_cache.discard(path)
+                continue
+            image_hash, image_format = result
+            emojis.append({"filename": filename, "path": path, "hash": image_hash, "format": image_format})
+        return emojis
+
+    def _remove_duplicate_file(self, emoji: dict, original: str):
+        if os.path.exists(emoji["path"]):
+            os.remove(emoji["path"])
+        self.file_cache.discard(emoji["path"])
+        logger.info(f"[去重] 表情包与 {original} 内容相同，已移除: {emoji['filename']}")
+
+    def _remove_duplicate_files(self, emojis: List[dict], by_hash: Dict[str, dict]) -> List[dict]:
+        """内容相同的文件只保留一个，其余从目录中删除，返回保留的表情包
+
+        优先保留已注册的文件。否则重复的文件没有记录，之后扫描到它时会被当作“hash已存在但path不存在”，
+        删掉原文件的记录再重新注册。
+        """
+        kept: Dict[str, dict] = {}
+        for emoji in emojis:
+            first = kept.get(emoji["hash"])
+            if first is None:
+                kept[emoji["hash"]] = emoji
+                continue
+            registered = by_hash.get(emoji["hash"])
+            if registered and registered["filename"] == emoji["filename"]:
+                kept[emoji["hash"]] = emoji
+                self._remove_duplicate_file(first, emoji["filename"])
+            else:
+                self._remove_duplicate_file(emoji, first["filename"])
+
+        result = []
+        for emoji in kept.values():
+            registered = by_hash.get(emoji["hash"])
+            if (
+                registered
+                and registered["filename"] != emoji["filename"]
+                and os.path.exists(os.path.join(self.EMOJI_DIR, registered["filename"]))
+            ):
+                # 与本批次之外已注册且文件仍在的表情包重复
+                self._remove_duplicate_file(emoji, registered["filename"])
+                continue
+            result.append(emoji)
+        return result
+
+    def _reconcile_registered_emojis(self, emojis: List[dict]) -> List[dict]:
+        """阶段2：批量查询已有记录，清理不一致的记录，同步已注册表情包到images集合，返回需要注册的表情包"""
+        projection = {"_id": 1, "filename": 1, "hash": 1, "description": 1}
+        by_hash = {
+            e["hash"]: e for e in db.emoji.find({"hash": {"$in": [emoji["hash"] for emoji in emojis]}}, projection)
+        }
+        emojis = self._remove_duplicate_files(emojis, by_hash)
+        by_path = {
+            e["filename"]: e
+            for e in db.emoji.find({"filename": {"$in": [emoji["filename"] for emoji in emojis]}}, projection)
+        }
+
+        new_emojis = []
+        registered = []
+        for emoji in emojis:
+            filename = emoji["filename"]
+            existing_emoji_by_path = by_path.get(filename)
+            existing_emoji_by_hash = by_hash.get(emoji["hash"])
+            if existing_emoji_by_path and existing_emoji_by_hash:
+                if existing_emoji_by_path["_id"] != existing_emoji_by_hash["_id"]:
+                    logger.error(f"[错误] 表情包已存在但记录不一致: {filename}")
+                    self._delete_emoji_record(existing_emoji_by_path["_id"])
+                    self._delete_emoji_record(existing_emoji_by_hash["_id"])
+                    existing_emoji = None
+                else:
+                    existing_emoji = existing_emoji_by_hash
+            elif existing_emoji_by_hash:
+                logger.error(f"[错误] 表情包hash已存在但path不存在: {filename}")
+                self._delete_emoji_record(existing_emoji_by_hash["_id"])
+                existing_emoji = None
+            elif existing_emoji_by_path:
+                logger.error(f"[错误] 表情包path已存在但hash不存在: {filename}")
+                self._delete_emoji_record(existing_emoji_by_path["_id"])
+                existing_emoji = None
+            else:
+                existing_emoji = None
+
+            if existing_emoji:
+                registered.append((emoji, existing_emoji.get("description")))
+            else:
+                new_emojis.append(emoji)
+
+        # 即使表情包已存在，也检查是否需要同步到images集合
+        if registered:
+            synced_hashes = {
+                image["hash"]
+                for image in db.images.find({"hash": {"$in": [emoji["hash"] for emoji, _ in registered]}}, {"hash": 1})
+            }
+            to_sync = [(emoji, description) for emoji, description in registered if emoji["hash"] not in synced_hashes]
+            if to_sync:
+                self._save_emoji_images(to_sync)
+                for emoji, _ in to_sync:
+                    logger.success(f"[同步] 已同步表情包到images集合: {emoji['filename']}")
+        return new_emojis
+
+    def _save_emoji_images(self, emojis: List[Tuple[dict, str]]):
+        """批量保存表情包到images集合和image_descriptions集合"""
+        now = int(time.time())
+        operations = [
+            UpdateOne(
+                {"hash": emoji["hash"]},
+                {
+                    "$set": {
+                        "hash": emoji["hash"],
+                        "path": emoji["path"],
+                        "type": "emoji",
+                        "description": description,
+                        "timestamp": now,
+                    }
+                },
+                upsert=True,
+            )
+            for emoji, description in emojis
+        ]
+        db.images.bulk_write(operations, ordered=False)
+        image_manager._save_descriptions_to_db({emoji["hash"]: description for emoji, description in emojis}, "emoji")
+
+    async def _prepare_emoji_record(self, emoji: dict, cached_description: Optional[str]) -> Optional[dict]:
+        """阶段3：为单个新表情包生成描述、检查并计算嵌入向量，返回待写入的记录"""
+        filename = emoji["filename"]
+        image_base64 = await asyncio.get_running_loop().run_in_executor(
+            self._io_executor, image_path_to_base64, emoji["path"]
+        )
+        if image_base64 is None:
+            return None
+
+        if cached_description:
+            description = cached_description
+        else:
+            # 近似图片只复用描述，仍按新表情包注册（dHash相近不代表是同一张图）
+            _, similar = await image_manager.find_similar(base64.b64decode(image_base64), "emoji")
+            # 获取表情包的描述
+            description = similar[1] if similar else await self._get_emoji_description(image_base64)
+
+        if global_config.EMOJI_CHECK:
+            check = await self._check_emoji(image_base64, emoji["format"])
+            if check is None:
+                # 检查请求失败，保留文件等下次扫描重试
+                logger.warning(f"[跳过] 表情包检查失败: {filename}")
+                return None
+            if "是" not in check:
+                os.remove(emoji["path"])
+                logger.info(f"[过滤] 表情包描述: {description}")
+                logger.info(f"[过滤] 表情包不满足规则，已移除: {check}")
+                return None
+            logger.info(f"[检查] 表情包检查通过: {check}")
+
+        if description is None:
+            logger.warning(f"[跳过] 表情包: {filename}")
+            return None
+
+        embedding = await get_embedding(description, request_type="emoji")
+        if not embedding:
+            logger.error(f"获取消息嵌入向量失败，跳过表情包: {filename}")
+            return None
+
+        return {
+            "filename": filename,
+            "path": emoji["path"],
+            "embedding": encode_embedding(embedding),
+            "description": description,
+            "hash": emoji["hash"],
+            "timestamp": int(time.time()),
+        }
+
+    def _flush_emoji_records(self, records: List[dict]):
+        """阶段4：批量写入新表情包记录，并加入内存索引"""
+        if not records:
+            return
+        failed = set()
+        try:
+            db.emoji.insert_many(records, ordered=False)
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            logger.error(f"[错误] {len(failed)} 个表情包记录写入失败")
+
+        inserted = [record for i, record in enumerate(records) if i not in failed]
+        for record in inserted:
+            # insert_many会把生成的_id写回记录
+            self.index.add(record["_id"], record["path"], record["description"], record["embedding"])
+            logger.success(f"[注册] 新表情包: {record['filename']}")
+            logger.info(f"[描述] {record['description']}")
+        if inserted:
+            self._save_emoji_images([(record, record["description"]) for record in inserted])
+        self.emoji_num += len(inserted)
+        logger.info(f"[统计] 当前表情包数量: {self.emoji_num}/{self.emoji_num_max}")
+
+    async def _register_new_emojis(self, emojis: List[dict]):
+        """阶段3、4：限制并发地处理新表情包，攒批写入数据库，注册数量不超过上限"""
+        if not emojis:
+            return
+        cached_descriptions = {
+            d["hash"]: d["description"]
+            for d in db.image_descriptions.find(
+                {"hash": {"$in": [emoji["hash"] for emoji in emojis]}, "type": "emoji"}, {"hash": 1, "description": 1}
+            )
+        }
+        semaphore = asyncio.Semaphore(self.scan_concurrency)
+        pending: List[dict] = []
+        in_flight = 0
+        limit_logged = False
+
+        async def process(emoji: dict):
+            nonlocal in_flight, limit_logged
+            async with semaphore:
+                # 已注册、待写入和处理中的数量合计不超过上限
+                if self.emoji_num + len(pending) + in_flight >= self.emoji_num_max:
+                    if not limit_logged:
+                        limit_logged = True
+                        logger.warning(f"[警告] 表情包数量已达到上限({self.emoji_num}/{self.emoji_num_max})，停止注册")
+                    return
+                in_flight += 1
+                try:
+                    record = await self._prepare_emoji_record(emoji, cached_descriptions.get(emoji["hash"]))
+                except Exception:
+                    logger.exception(f"[错误] 处理表情包失败: {emoji['filename']}")
+                    record = None
+                finally:
+                    in_flight -= 1
+                if record:
+                    pending.append(record)
+                    if len(pending) >= self.scan_write_batch_size:
+                        batch = pending[:]
+                        pending.clear()
+                        self._flush_emoji_records(batch)
+
+        await asyncio.gather(*(process(emoji) for emoji in emojis))
+        self._flush_emoji_records(pending)
+
+    async def scan_new_emojis(self, filenames: Optional[List[str]] = None):
+        """扫描新的表情包，filenames为None时扫描整个目录，否则只处理给定的文件
+
+        分阶段处理：线程池并行读取文件和计算哈希 -> 批量查询数据库 ->
+        限制并发地生成描述、检查和计算嵌入向量 -> 攒批写入数据库
+        """
         try:
             emoji_dir = self.EMOJI_DIR
             os.makedirs(emoji_dir, exist_ok=True)
 
             # 获取所有支持的图片文件
+            if filenames is None:
+                filenames = os.listdir(emoji_dir)
             files_to_process = [
-                f for f in os.listdir(emoji_dir) if f.lower().endswith((".jpg", ".jpeg", ".png", ".gif"))
+                f
+                for f in filenames
+                if f.lower().endswith(EMOJI_EXTENSIONS) and os.path.isfile(os.path.join(emoji_dir, f))
             ]
+            if not files_to_process:
+                return
 
             # 检查当前表情包数量
             self._update_emoji_count()
@@ -259,135 +540,48 @@ class EmojiManager:
             remaining_slots = self.emoji_num_max - self.emoji_num
             logger.info(f"[注册] 还可以注册 {remaining_slots} 个表情包")
 
-            for filename in files_to_process:
-                # 如果已经达到上限，停止注册
-                if self.emoji_num >= self.emoji_num_max:
-                    logger.warning(f"[警告] 表情包数量已达到上限({self.emoji_num}/{self.emoji_num_max})，停止注册")
-                    break
-
-                image_path = os.path.join(emoji_dir, filename)
-
-                # 获取图片的base64编码和哈希值
-                image_base64 = image_path_to_base64(image_path)
-                if image_base64 is None:
-                    os.remove(image_path)
-                    continue
-
-                image_bytes = base64.b64decode(image_base64)
-                image_hash = hashlib.md5(image_bytes).hexdigest()
-                image_format = Image.open(io.BytesIO(image_bytes)).format.lower()
-                # 检查是否已经注册过
-                existing_emoji_by_path = db["emoji"].find_one({"filename": filename})
-                existing_emoji_by_hash = db["emoji"].find_one({"hash": image_hash})
-                if existing_emoji_by_path and existing_emoji_by_hash:
-                    if existing_emoji_by_path["_id"] != existing_emoji_by_hash["_id"]:
-                        logger.error(f"[错误] 表情包已存在但记录不一致: {filename}")
-                        db.emoji.delete_one({"_id": existing_emoji_by_path["_id"]})
-                        db.emoji.delete_one({"_id": existing_emoji_by_hash["_id"]})
-                        existing_emoji = None
-                    else:
-                        existing_emoji = existing_emoji_by_hash
-                elif existing_emoji_by_hash:
-                    logger.error(f"[错误] 表情包hash已存在但path不存在: {filename}")
-                    db.emoji.delete_one({"_id": existing_emoji_by_hash["_id"]})
-                    existing_emoji = None
-                elif existing_emoji_by_path:
-                    logger.error(f"[错误] 表情包path已存在但hash不存在: {filename}")
-                    db.emoji.delete_one({"_id": existing_emoji_by_path["_id"]})
-                    existing_emoji = None
-                else:
-                    existing_emoji = None
-
-                description = None
-
-                if existing_emoji:
-                    # 即使表情包已存在，也检查是否需要同步到images集合
-                    description = existing_emoji.get("description")
-                    # 检查是否在images集合中存在
-                    existing_image = db.images.find_one({"hash": image_hash})
-                    if not existing_image:
-                        # 同步到images集合
-                        image_doc = {
-                            "hash": image_hash,
-                            "path": image_path,
-                            "type": "emoji",
-                            "description": description,
-                            "timestamp": int(time.time()),
-                        }
-                        db.images.update_one({"hash": image_hash}, {"$set": image_doc}, upsert=True)
-                        # 保存描述到image_descriptions集合
-                        image_manager._save_description_to_db(image_hash, description, "emoji")
-                        logger.success(f"[同步] 已同步表情包到images集合: {filename}")
-                    continue
-
-                # 检查是否在images集合中已有描述
-                existing_description = image_manager._get_description_from_db(image_hash, "emoji")
-
-                if existing_description:
-                    description = existing_description
-                else:
-                    # 获取表情包的描述
-                    description = await self._get_emoji_description(image_base64)
-
-                if global_config.EMOJI_CHECK:
-                    check = await self._check_emoji(image_base64, image_format)
-                    if "是" not in check:
-                        os.remove(image_path)
-                        logger.info(f"[过滤] 表情包描述: {description}")
-                        logger.info(f"[过滤] 表情包不满足规则，已移除: {check}")
-                        continue
-                    logger.info(f"[检查] 表情包检查通过: {check}")
-
-                if description is not None:
-                    embedding = await get_embedding(description, request_type="emoji")
-                    if not embedding:
-                        logger.error("获取消息嵌入向量失败")
-                        raise ValueError("获取消息嵌入向量失败")
-                    # 准备数据库记录
-                    emoji_record = {
-                        "filename": filename,
-                        "path": image_path,
-                        "embedding": embedding,
-                        "description": description,
-                        "hash": image_hash,
-                        "timestamp": int(time.time()),
-                    }
-
-                    # 保存到emoji数据库
-                    db["emoji"].insert_one(emoji_record)
-                    logger.success(f"[注册] 新表情包: {filename}")
-                    logger.info(f"[描述] {description}")
-
-                    # 更新当前表情包数量
-                    self.emoji_num += 1
-                    logger.info(f"[统计] 当前表情包数量: {self.emoji_num}/{self.emoji_num_max}")
-
-                    # 保存到images数据库
-                    image_doc = {
-                        "hash": image_hash,
-                        "path": image_path,
-                        "type": "emoji",
-                        "description": description,
-                        "timestamp": int(time.time()),
-                    }
-                    db.images.update_one({"hash": image_hash}, {"$set": image_doc}, upsert=True)
-                    # 保存描述到image_descriptions集合
-                    image_manager._save_description_to_db(image_hash, description, "emoji")
-                    logger.success(f"[同步] 已保存到images集合: {filename}")
-                else:
-                    logger.warning(f"[跳过] 表情包: {filename}")
+            emojis = await self._hash_emoji_files(files_to_process)
+            new_emojis = self._reconcile_registered_emojis(emojis)
+            self.file_cache.save()
+            if new_emojis:
+                logger.info(f"[注册] 发现 {len(new_emojis)} 个未注册的表情包")
+            await self._register_new_emojis(new_emojis)
 
         except Exception:
             logger.exception("[错误] 扫描表情包失败")
 
-    def check_emoji_file_integrity(self):
+    def check_emoji_file_integrity(self, paths: Optional[List[str]] = None):
         """检查表情包文件完整性
         如果文件已被删除，则从数据库中移除对应记录
+
+        Args:
+            paths: 只检查这些路径对应的记录，为None时检查全部记录
         """
+        for emoji_id in self._check_emoji_records(paths):
+            self.index.remove(emoji_id)
+
+    async def check_emoji_file_integrity_async(self, paths: Optional[List[str]] = None):
+        """在线程池中检查表情包文件完整性，不阻塞事件循环
+
+        哈希缓存没有命中的文件需要读取并计算哈希；缓存保存在文件中，只有第一次启动或文件变化时才需要读取。
+        内存索引只在事件循环中修改。
+        """
+        loop = asyncio.get_running_loop()
+        removed_ids = await loop.run_in_executor(self._io_executor, self._check_emoji_records, paths)
+        for emoji_id in removed_ids:
+            self.index.remove(emoji_id)
+
+    def _check_emoji_records(self, paths: Optional[List[str]]) -> List:
+        """检查表情包记录并删除失效的记录，返回被删除的记录_id，由调用方移出内存索引"""
+        removed_ids = []
         try:
             self._ensure_db()
-            # 获取所有表情包记录
-            all_emojis = list(db.emoji.find())
+            query = {} if paths is None else {"path": {"$in": paths}}
+            # 不读取嵌入向量，缺少嵌入向量的记录单独查询
+            missing_embedding = {
+                e["_id"] for e in db.emoji.find({**query, "embedding": {"$exists": False}}, {"_id": 1})
+            }
+            all_emojis = list(db.emoji.find(query, {"embedding": 0}))
             removed_count = 0
             total_count = len(all_emojis)
 
@@ -396,20 +590,24 @@ class EmojiManager:
                     if "path" not in emoji:
                         logger.warning(f"[检查] 发现无效记录（缺少path字段），ID: {emoji.get('_id', 'unknown')}")
                         db.emoji.delete_one({"_id": emoji["_id"]})
+                        removed_ids.append(emoji["_id"])
                         removed_count += 1
                         continue
 
-                    if "embedding" not in emoji:
+                    if emoji["_id"] in missing_embedding:
                         logger.warning(f"[检查] 发现过时记录（缺少embedding字段），ID: {emoji.get('_id', 'unknown')}")
                         db.emoji.delete_one({"_id": emoji["_id"]})
+                        removed_ids.append(emoji["_id"])
                         removed_count += 1
                         continue
 
                     # 检查文件是否存在
                     if not os.path.exists(emoji["path"]):
                         logger.warning(f"[检查] 表情包文件已被删除: {emoji['path']}")
+                        self.file_cache.discard(emoji["path"])
                         # 从数据库中删除记录
                         result = db.emoji.delete_one({"_id": emoji["_id"]})
+                        removed_ids.append(emoji["_id"])
                         if result.deleted_count > 0:
                             logger.debug(f"[清理] 成功删除数据库记录: {emoji['_id']}")
                             removed_count += 1
@@ -419,13 +617,15 @@ class EmojiManager:
 
                     if "hash" not in emoji:
                         logger.warning(f"[检查] 发现缺失记录（缺少hash字段），ID: {emoji.get('_id', 'unknown')}")
-                        hash = hashlib.md5(open(emoji["path"], "rb").read()).hexdigest()
+                        hash, _ = self.file_cache.get(emoji["path"])
                         db.emoji.update_one({"_id": emoji["_id"]}, {"$set": {"hash": hash}})
                     else:
-                        file_hash = hashlib.md5(open(emoji["path"], "rb").read()).hexdigest()
+                        # 文件没有变化时使用缓存的哈希，不重新读取
+                        file_hash, _ = self.file_cache.get(emoji["path"])
                         if emoji["hash"] != file_hash:
                             logger.warning(f"[检查] 表情包文件hash不匹配，ID: {emoji.get('_id', 'unknown')}")
                             db.emoji.delete_one({"_id": emoji["_id"]})
+                            removed_ids.append(emoji["_id"])
                             removed_count += 1
 
                     # 修复拼写错误
@@ -446,10 +646,12 @@ class EmojiManager:
                 logger.info(f"[统计] 清理前: {total_count} | 清理后: {remaining_count}")
             else:
                 logger.info(f"[检查] 已检查 {total_count} 个表情包记录")
+            self.file_cache.save()
 
         except Exception as e:
             logger.error(f"[错误] 检查表情包完整性失败: {str(e)}")
             logger.error(traceback.format_exc())
+        return removed_ids
 
     def check_emoji_file_full(self):
         """检查表情包文件是否完整，如果数量超出限制且允许删除，则删除多余的表情包
@@ -516,7 +718,7 @@ class EmojiManager:
                         logger.info(f"[删除] 文件: {emoji['path']} (使用次数: {emoji.get('usage_count', 0)})")
 
                     # 删除数据库记录
-                    db.emoji.delete_one({"_id": emoji["_id"]})
+                    self._delete_emoji_record(emoji["_id"])
                     deleted_count += 1
 
                     # 同时从images集合中删除
@@ -534,25 +736,56 @@ class EmojiManager:
         except Exception as e:
             logger.error(f"[错误] 检查表情包数量失败: {str(e)}")
 
+    def _check_emoji_limit(self) -> bool:
+        """表情包数量超过上限时按配置删除多余的表情包，返回是否继续注册"""
+        if self.emoji_num > self.emoji_num_max:
+            logger.warning(f"[警告] 表情包数量超过最大限制: {self.emoji_num} > {self.emoji_num_max},跳过注册")
+            if not global_config.max_reach_deletion:
+                logger.warning("表情包数量超过最大限制，终止注册")
+                return False
+            logger.warning("表情包数量超过最大限制，开始删除表情包")
+            self.check_emoji_file_full()
+        return True
+
     async def start_periodic_check_register(self):
-        """定期检查表情包完整性和数量"""
-        while True:
-            logger.info("[扫描] 开始检查表情包完整性...")
-            self.check_emoji_file_integrity()
-            logger.info("[扫描] 开始删除所有图片缓存...")
-            await self.delete_all_images()
-            logger.info("[扫描] 开始扫描新表情包...")
-            if self.emoji_num < self.emoji_num_max:
-                await self.scan_new_emojis()
-            if self.emoji_num > self.emoji_num_max:
-                logger.warning(f"[警告] 表情包数量超过最大限制: {self.emoji_num} > {self.emoji_num_max},跳过注册")
-                if not global_config.max_reach_deletion:
-                    logger.warning("表情包数量超过最大限制，终止注册")
-                    break
-                else:
-                    logger.warning("表情包数量超过最大限制，开始删除表情包")
-                    self.check_emoji_file_full()
-            await asyncio.sleep(global_config.EMOJI_CHECK_INTERVAL * 60)
+        """检查表情包完整性和数量
+
+        启动时完整检查并扫描一次，之后由表情包目录的变化驱动（watchdog文件事件，未安装时轮询目录），
+        只检查和注册变化过的文件。每隔EMOJI_CHECK_INTERVAL再完整检查并扫描一次整个目录，
+        重试因数量上限或检查、描述请求失败而没有注册的文件，同时清理图片缓存。
+        """
+        self._ensure_emoji_dir()
+        self.watcher = EmojiDirWatcher(self.EMOJI_DIR, EMOJI_EXTENSIONS)
+        self.watcher.start()
+
+        logger.info("[扫描] 开始检查表情包完整性...")
+        await self.check_emoji_file_integrity_async()
+        logger.info("[扫描] 开始删除所有图片缓存...")
+        await self.delete_all_images()
+        logger.info("[扫描] 开始扫描新表情包...")
+        if self.emoji_num < self.emoji_num_max:
+            await self.scan_new_emojis()
+
+        interval = global_config.EMOJI_CHECK_INTERVAL * 60
+        next_cleanup = time.time() + interval
+        try:
+            while self._check_emoji_limit():
+                changed = await self.watcher.wait_changes(timeout=max(0.0, next_cleanup - time.time()))
+                if changed:
+                    logger.info(f"[扫描] 表情包目录有 {len(changed)} 个文件发生变化")
+                    await self.check_emoji_file_integrity_async([os.path.join(self.EMOJI_DIR, f) for f in changed])
+                    # scan_new_emojis会重新统计数量并检查上限
+                    await self.scan_new_emojis(list(changed))
+                if time.time() >= next_cleanup:
+                    logger.info("[扫描] 开始删除所有图片缓存...")
+                    await self.delete_all_images()
+                    # 完整对账：文件没有变化时哈希直接取自缓存，只有未注册的文件会重新处理
+                    logger.info("[扫描] 开始完整检查表情包目录...")
+                    await self.check_emoji_file_integrity_async()
+                    await self.scan_new_emojis()
+                    next_cleanup = time.time() + interval
+        finally:
+            self.watcher.stop()
 
     async def delete_all_images(self):
         """删除 data/image 目录下的所有文件"""
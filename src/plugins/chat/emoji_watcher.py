@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+from PIL import Image
+
+from src.common.logger import get_module_logger
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog为可选依赖，没有安装时轮询目录
+    FileSystemEventHandler = object
+    Observer = None
+
+logger = get_module_logger("emoji_watcher")
+
+
+class FileHashCache:
+    """文件哈希缓存，以(路径, 大小, 修改时间)为键，文件没有变化时不重新读取
+
+    指定cache_file时缓存保存在文件中，重启后没有变化的文件也不需要重新读取。
+    """
+
+    def __init__(self, cache_file: Optional[str] = None):
+        self.cache_file = cache_file
+        self._entries: Dict[str, Tuple[int, int, str, Optional[str]]] = {}  # 路径 -> (大小, mtime_ns, md5, 图片格式)
+        self._dirty = False
+        self._save_lock = threading.Lock()  # 事件循环和线程池都可能保存缓存
+        if cache_file:
+            self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                self._entries = {path: tuple(entry) for path, entry in json.load(f).items()}
+        except Exception as e:
+            logger.warning(f"表情包哈希缓存文件无效，将重新计算: {str(e)}")
+            self._entries = {}
+
+    def save(self) -> None:
+        """有变化时把缓存写入cache_file"""
+        if not self.cache_file or not self._dirty:
+            return
+        with self._save_lock:
+            self._dirty = False
+            entries = dict(self._entries)
+            tmp_path = self.cache_file + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.cache_file)
+
+    def get(self, path: str) -> Tuple[str, Optional[str]]:
+        """返回文件的(md5, 图片格式)，不是图片时格式为None，文件无法读取时抛出OSError"""
+        stat = os.stat(path)
+        entry = self._entries.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2], entry[3]
+
+        with open(path, "rb") as f:
+            data = f.read()
+        file_hash = hashlib.md5(data).hexdigest()
+        try:
+            image_format = Image.open(io.BytesIO(data)).format.lower()
+        except Exception:
+            image_format = None
+        self._entries[path] = (stat.st_size, stat.st_mtime_ns, file_hash, image_format)
+        self._dirty = True
+        return file_hash, image_format
+
+    def discard(self, path: str) -> None:
+        if self._entries.pop(path, None) is not None:
+            self._dirty = True
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    """把watchdog线程中的文件事件转交给事件循环
+
+    只处理新增、修改、删除和移动事件。读取文件也会产生打开、关闭事件，
+    而注册表情包、发送表情包都会读取文件，处理这些事件会让每次读取都触发一次重新扫描。
+    """
+
+    def __init__(self, watcher: "EmojiDirWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def _notify(self, event):
+        if event.is_directory:
+            return
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if path:
+                self.watcher.loop.call_soon_threadsafe(self.watcher.add_change, os.path.basename(path))
+
+    def on_created(self, event):
+        self._notify(event)
+
+    def on_modified(self, event):
+        self._notify(event)
+
+    def on_deleted(self, event):
+        self._notify(event)
+
+    def on_moved(self, event):
+        self._notify(event)
+
+
+class EmojiDirWatcher:
+    """表情包目录监听器
+
+    安装了watchdog时使用系统文件事件（Linux下为inotify），否则定期比较目录中文件的(大小, 修改时间)。
+    变化的文件名被收集起来，由wait_changes一次取走。
+    """
+
+    def __init__(self, directory: str, extensions: Tuple[str, ...], poll_interval: float = 30, settle_time: float = 1):
+        self.directory = directory
+        self.extensions = extensions
+        self.poll_interval = poll_interval  # 轮询间隔（秒），只在没有watchdog时使用
+        self.settle_time = settle_time  # 收到事件后再等待一会儿，合并同一文件写入过程中的多次事件
+        self.changes: Set[str] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+        self._observer = None
+        self._poll_task: Optional[asyncio.Task] = None
+        self._snapshot: Dict[str, Tuple[int, int]] = {}
+
+    def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_ChangeHandler(self), self.directory, recursive=False)
+            self._observer.start()
+            logger.info(f"[监听] 使用文件系统事件监听表情包目录: {self.directory}")
+        else:
+            self._snapshot = self._take_snapshot()
+            self._poll_task = asyncio.create_task(self._poll())
+            logger.info(f"[监听] 未安装watchdog，每{self.poll_interval}秒轮询表情包目录: {self.directory}")
+
+    def stop(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+
+    def add_change(self, filename: str) -> None:
+        if filename.lower().endswith(self.extensions):
+            self.changes.add(filename)
+            self._changed.set()
+
+    def _take_snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(self.extensions):
+                    stat = entry.stat()
+                    snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                snapshot = await asyncio.to_thread(self._take_snapshot)
+            except Exception as e:
+                logger.error(f"[监听] 轮询表情包目录失败: {str(e)}")
+                continue
+            for filename in snapshot.keys() | self._snapshot.keys():
+                if snapshot.get(filename) != self._snapshot.get(filename):
+                    self.add_change(filename)
+            self._snapshot = snapshot
+
+    async def wait_changes(self, timeout: Optional[float] = None) -> Set[str]:
+        """等待目录变化，返回期间变化过（新增、修改、删除）的文件名，超时返回空集合"""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return set()
+        await asyncio.sleep(self.settle_time)
+        self._changed.clear()
+        changes, self.changes = self.changes, set()
+        return changes
@@ -6,7 +6,7 @@ import urllib3
 
 from .utils_image import image_manager
 
-from ..message.message_base import Seg, UserInfo, BaseMessageInfo, MessageBase
+from ..message.message_base import Seg, UserInfo, BaseMessageInfo, MessageBase, LazyMessage
 from .chat_stream import ChatStream
 from src.common.logger import get_module_logger
 
@@ -72,7 +72,9 @@ class MessageRecv(Message):
         """
         self.message_info = BaseMessageInfo.from_dict(message_dict.get("message_info", {}))
 
-        self.message_segment = Seg.from_dict(message_dict.get("message_segment", {}))
+        # 消息段在第一次访问时才解析，只看message_info就被过滤掉的消息不需要解析消息段
+        self._segment = None
+        self._segment_dict = message_dict.get("message_segment", {})
         self.raw_message = message_dict.get("raw_message")
 
         # 处理消息内容
@@ -80,6 +82,11 @@ class MessageRecv(Message):
         self.detailed_plain_text = ""  # 初始化为空字符串
         self.is_emoji = False
 
+    # 与LazyMessage共用延迟解析和to_dict的实现
+    message_segment = LazyMessage.message_segment
+    segment_parsed = LazyMessage.segment_parsed
+    to_dict = LazyMessage.to_dict
+
     def update_chat_stream(self, chat_stream: ChatStream):
         self.chat_stream = chat_stream
 
@@ -88,9 +95,22 @@ class MessageRecv(Message):
 
         这个方法必须在创建实例后显式调用，因为它包含异步操作。
         """
+        images = self._collect_images(self.message_segment)
+        if len(images) > 1:
+            # 多张图片（包括合并转发中的图片）合并为一次视觉请求，逐段处理时直接命中缓存
+            await image_manager.prefetch_image_descriptions(images)
         self.processed_plain_text = await self._process_message_segments(self.message_segment)
         self.detailed_plain_text = self._generate_detailed_text()
 
+    @staticmethod
+    def _collect_images(segment: Seg) -> List[str]:
+        """按顺序收集消息段中所有base64图片"""
+        if segment.type == "seglist":
+            return [image for seg in segment.data for image in MessageRecv._collect_images(seg)]
+        if segment.type == "image" and isinstance(segment.data, str):
+            return [segment.data]
+        return []
+
     async def _process_message_segments(self, segment: Seg) -> str:
         """递归处理消息段，转换为文字描述
 
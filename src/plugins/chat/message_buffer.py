@@ -5,11 +5,12 @@ from dataclasses import dataclass, field
 from .message import MessageRecv
 from ..message.message_base import BaseMessageInfo, GroupInfo
 import hashlib
-from typing import Dict
+from typing import Dict, List, Tuple
 from collections import OrderedDict
 import random
 import time
 from ..config.config import global_config
+from ..utils.timer_wheel import TimerWheel
 
 logger = get_module_logger("message_buffer")
 
@@ -22,9 +23,20 @@ class CacheMessages:
 
 
 class MessageBuffer:
-    def __init__(self):
+    def __init__(self, idle_prune_time: float = 300):
         self.buffer_pool: Dict[str, OrderedDict[str, CacheMessages]] = {}
-        self.lock = asyncio.Lock()
+        self.locks: Dict[str, asyncio.Lock] = {}  # 按person_id_分片的锁
+        self.last_active: Dict[str, float] = {}  # person_id_ -> 最近一次收到消息的时间
+        self.idle_prune_time = idle_prune_time  # 没有待定消息的缓冲区空闲多久后清理（秒）
+        self._last_prune_time = time.time()
+        # 所有消息的缓冲计时共用一个时间轮，到期的判定批量处理
+        self.timer_wheel = TimerWheel(self._on_debounce_expired)
+
+    def _get_lock(self, person_id_: str) -> asyncio.Lock:
+        lock = self.locks.get(person_id_)
+        if lock is None:
+            lock = self.locks[person_id_] = asyncio.Lock()
+        return lock
 
     def get_person_id_(self, platform: str, user_id: str, group_info: GroupInfo):
         """获取唯一id"""
@@ -41,13 +53,14 @@ class MessageBuffer:
             person_id = person_info_manager.get_person_id(
                 message.message_info.user_info.platform, message.message_info.user_info.user_id
             )
-            asyncio.create_task(self.save_message_interval(person_id, message.message_info))
+            await self.save_message_interval(person_id, message.message_info)
             return
         person_id_ = self.get_person_id_(
             message.message_info.platform, message.message_info.user_info.user_id, message.message_info.group_info
         )
 
-        async with self.lock:
+        async with self._get_lock(person_id_):
+            self.last_active[person_id_] = time.time()
             if person_id_ not in self.buffer_pool:
                 self.buffer_pool[person_id_] = OrderedDict()
 
@@ -78,31 +91,67 @@ class MessageBuffer:
             # 添加新消息
             self.buffer_pool[person_id_][message.message_info.message_id] = CacheMessages(message=message)
 
-        # 启动3秒缓冲计时器
+        # 启动缓冲计时器
         person_id = person_info_manager.get_person_id(
             message.message_info.user_info.platform, message.message_info.user_info.user_id
         )
-        asyncio.create_task(self.save_message_interval(person_id, message.message_info))
-        asyncio.create_task(self._debounce_processor(person_id_, message.message_info.message_id, person_id))
+        await self.save_message_interval(person_id, message.message_info)
+        await self._debounce_processor(person_id_, message.message_info.message_id, person_id)
 
     async def _debounce_processor(self, person_id_: str, message_id: str, person_id: str):
-        """等待3秒无新消息"""
+        """在时间轮上登记缓冲计时，到期时无新消息则判定为T"""
         interval_time = await person_info_manager.get_value(person_id, "msg_interval")
         if not isinstance(interval_time, (int, str)) or not str(interval_time).isdigit():
             logger.debug("debounce_processor无效的时间")
             return
         interval_time = max(0.5, int(interval_time) / 1000)
-        await asyncio.sleep(interval_time)
+        self.timer_wheel.schedule(interval_time, (person_id_, message_id))
 
-        async with self.lock:
-            if person_id_ not in self.buffer_pool or message_id not in self.buffer_pool[person_id_]:
-                logger.debug(f"消息已被清理，msgid: {message_id}")
-                return
+    async def _on_debounce_expired(self, expired: List[Tuple[str, str]]):
+        """批量处理到期的缓冲计时"""
+        by_person: Dict[str, List[str]] = {}
+        for person_id_, message_id in expired:
+            by_person.setdefault(person_id_, []).append(message_id)
 
-            cache_msg = self.buffer_pool[person_id_][message_id]
-            if cache_msg.result == "U":
-                cache_msg.result = "T"
-                cache_msg.cache_determination.set()
+        for person_id_, message_ids in by_person.items():
+            if person_id_ not in self.buffer_pool:
+                # 缓冲区已被释放，不再为它创建锁
+                logger.debug(f"缓冲区已被清理，msgid: {message_ids}")
+                continue
+            async with self._get_lock(person_id_):
+                user_msgs = self.buffer_pool.get(person_id_)
+                for message_id in message_ids:
+                    if not user_msgs or message_id not in user_msgs:
+                        logger.debug(f"消息已被清理，msgid: {message_id}")
+                        continue
+                    cache_msg = user_msgs[message_id]
+                    if cache_msg.result == "U":
+                        cache_msg.result = "T"
+                        cache_msg.cache_determination.set()
+
+        if time.time() - self._last_prune_time > 60:
+            self._prune_idle_buffers()
+
+    def _prune_idle_buffers(self):
+        """清理空的或长时间没有待定消息的缓冲区"""
+        now = time.time()
+        self._last_prune_time = now
+        for person_id_ in list(self.buffer_pool.keys()):
+            lock = self.locks.get(person_id_)
+            if lock and lock.locked():
+                continue
+            user_msgs = self.buffer_pool.get(person_id_)
+            idle = now - self.last_active.get(person_id_, 0) > self.idle_prune_time
+            if not user_msgs or (idle and all(msg.result != "U" for msg in user_msgs.values())):
+                self._drop_buffer(person_id_)
+        # 缓冲区已释放、没有协程持有的锁
+        for person_id_ in [k for k, lock in self.locks.items() if k not in self.buffer_pool and not lock.locked()]:
+            del self.locks[person_id_]
+
+    def _drop_buffer(self, person_id_: str):
+        self.buffer_pool.pop(person_id_, None)
+        self.locks.pop(person_id_, None)
+        self.last_active.pop(person_id_, None)
 
     async def query_buffer_result(self, message: MessageRecv) -> bool:
         """查询缓冲结果，并清理"""
@@ -112,7 +161,11 @@ class MessageBuffer:
             message.message_info.platform, message.message_info.user_info.user_id, message.message_info.group_info
         )
 
-        async with self.lock:
+        if person_id_ not in self.buffer_pool:
+            logger.debug(f"查询异常，缓冲区不存在，msgid: {message.message_info.message_id}")
+            return False
+
+        async with self._get_lock(person_id_):
             user_msgs = self.buffer_pool.get(person_id_, {})
             cache_msg = user_msgs.get(message.message_info.message_id)
 
@@ -125,14 +178,18 @@ class MessageBuffer:
             result = cache_msg.result == "T"
 
             if result:
-                async with self.lock:  # 再次加锁
+                async with self._get_lock(person_id_):  # 再次加锁
+                    user_msgs = self.buffer_pool.get(person_id_)
+                    if user_msgs is None:
+                        # 等待期间缓冲区已被清理，没有可整合的消息
+                        return result
                     # 清理所有早于当前消息的已处理消息， 收集所有早于当前消息的F消息的processed_plain_text
                     keep_msgs = OrderedDict()
                     combined_text = []
                     found = False
                     type = "text"
                     is_update = True
-                    for msg_id, msg in self.buffer_pool[person_id_].items():
+                    for msg_id, msg in user_msgs.items():
                         if msg_id == message.message_info.message_id:
                             found = True
                             type = msg.message.message_segment.type
@@ -161,27 +218,27 @@ class MessageBuffer:
                             message.is_emoji = False
                             logger.debug(f"整合了{len(combined_text) - 1}条F消息的内容，覆盖当前emoji消息")
 
-                    self.buffer_pool[person_id_] = keep_msgs
+                    if keep_msgs:
+                        self.buffer_pool[person_id_] = keep_msgs
+                    else:
+                        # 缓冲区已清空，释放它（锁由当前协程持有，退出后不再被引用）
+                        self.buffer_pool.pop(person_id_, None)
+                        self.last_active.pop(person_id_, None)
+                        self.locks.pop(person_id_, None)
             return result
         except asyncio.TimeoutError:
             logger.debug(f"查询超时消息id： {message.message_info.message_id}")
             return False
 
     async def save_message_interval(self, person_id: str, message: BaseMessageInfo):
-        message_interval_list = await person_info_manager.get_value(person_id, "msg_interval_list")
         now_time_ms = int(round(time.time() * 1000))
-        if len(message_interval_list) < 1000:
-            message_interval_list.append(now_time_ms)
-        else:
-            message_interval_list.pop(0)
-            message_interval_list.append(now_time_ms)
         data = {
             "platform": message.platform,
             "user_id": message.user_info.user_id,
             "nickname": message.user_info.user_nickname,
             "konw_time": int(time.time()),
         }
-        await person_info_manager.update_one_field(person_id, "msg_interval_list", message_interval_list, data)
+        await person_info_manager.push_message_interval(person_id, now_time_ms, data)
 
 
 message_buffer = MessageBuffer()
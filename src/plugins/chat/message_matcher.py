@@ -0,0 +1,238 @@
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Pattern, Set, Tuple
+
+from ..config.config import global_config
+from src.common.logger import get_module_logger
+
+logger = get_module_logger("message_matcher")
+
+_DEFAULT_FLAGS = re.compile("").flags
+# 数字反向引用、命名反向引用和条件分组，可能有误判（如转义的反斜杠后跟数字），误判时只是不做预筛
+_BACKREFERENCE_PATTERN = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+
+class AhoCorasick:
+    """Aho-Corasick多模式字符串匹配，一次扫描找出文本中出现的所有模式"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Set[int]] = [set()]
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build()
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def _add(self, pattern: str) -> None:
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+            node = next_node
+        self._output[node].add(len(self.patterns))
+        self.patterns.append(pattern)
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0) if node else 0
+                self._output[child] |= self._output[self._fail[child]]
+
+    def find_all(self, text: str) -> Set[int]:
+        """返回文本中出现过的所有模式的下标"""
+        hits: Set[int] = set()
+        if not self.patterns:
+            return hits
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                hits |= output[node]
+        return hits
+
+    def find_first(self, text: str) -> Optional[str]:
+        """返回文本中最先结束的模式，没有则返回None"""
+        if not self.patterns:
+            return None
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                return self.patterns[min(output[node])]
+        return None
+
+
+def combine_patterns(patterns: List[Pattern]) -> Optional[Pattern]:
+    """把多个正则合并为一个交替表达式，用于一次扫描判断是否有任一正则命中
+
+    合并后的表达式只用作预筛：没有命中时所有正则都不命中；命中时再逐个匹配以取得具体结果。
+    无法合并时返回None：带有标志（含全局内联标志）、反向引用或条件分组的正则合并后分组编号会改变，
+    预筛可能漏掉原本能命中的文本；重名分组则无法编译。
+    """
+    if not patterns:
+        return None
+    for p in patterns:
+        if p.flags != _DEFAULT_FLAGS or _BACKREFERENCE_PATTERN.search(p.pattern):
+            return None
+    try:
+        return re.compile("|".join(f"(?:{p.pattern})" for p in patterns))
+    except re.error:
+        return None
+
+
+class MessageMatcher:
+    """过滤词、提及检测和关键词反应共用的匹配器
+
+    从配置编译一次：字面量使用Aho-Corasick，正则合并为一个交替表达式做预筛。
+    配置中的相关项被替换或增删后会在下次使用时自动重建。
+    """
+
+    at_strip_pattern = re.compile(r"\@[\s\S]*?（(\d+)）")
+    reply_strip_pattern = re.compile(r"回复[\s\S]*?\((\d+)\)的消息，说： ")
+
+    def __init__(self):
+        self._signature = None
+        self.ban_words = AhoCorasick([])
+        self.ban_regex: List[Pattern] = []
+        self.ban_regex_combined: Optional[Pattern] = None
+        self.mention_names = AhoCorasick([])
+        self.at_pattern: Optional[Pattern] = None
+        self.reply_pattern: Optional[Pattern] = None
+        self.keyword_rules: List[dict] = []
+        self.keywords = AhoCorasick([])
+        self.keyword_owner: List[int] = []  # 关键词下标 -> 规则下标
+        self.rule_regex_combined: Optional[Pattern] = None
+        self._has_rule_regex = False
+
+    def _config_signature(self) -> Tuple:
+        """配置相关项的指纹，只取对象身份和长度，代价为O(1)"""
+        items = (
+            global_config.ban_words,
+            global_config.ban_msgs_regex,
+            global_config.BOT_ALIAS_NAMES,
+            global_config.keywords_reaction_rules,
+        )
+        return (
+            tuple((id(item), len(item)) for item in items),
+            global_config.BOT_NICKNAME,
+            global_config.BOT_QQ,
+        )
+
+    def _ensure_built(self) -> None:
+        signature = self._config_signature()
+        if signature != self._signature:
+            self.rebuild()
+            self._signature = signature
+
+    def rebuild(self) -> None:
+        """根据当前配置重新编译所有匹配器"""
+        self.ban_words = AhoCorasick(global_config.ban_words)
+        self.ban_regex = list(global_config.ban_msgs_regex)
+        self.ban_regex_combined = combine_patterns(self.ban_regex)
+
+        names = [global_config.BOT_NICKNAME] + list(global_config.BOT_ALIAS_NAMES)
+        self.mention_names = AhoCorasick(name for name in names if name)
+        self.at_pattern = re.compile(rf"@[\s\S]*?（id:{global_config.BOT_QQ}）")
+        self.reply_pattern = re.compile(rf"回复[\s\S]*?\({global_config.BOT_QQ}\)的消息，说：")
+
+        self.keyword_rules = [rule for rule in global_config.keywords_reaction_rules if rule.get("enable", False)]
+        keywords = []
+        self.keyword_owner = []
+        rule_regex = []
+        for index, rule in enumerate(self.keyword_rules):
+            for keyword in rule.get("keywords", []):
+                keywords.append(keyword)
+                self.keyword_owner.append(index)
+            rule_regex.extend(p for p in rule.get("regex", []) if isinstance(p, re.Pattern))
+        self.keywords = AhoCorasick(keywords)
+        self.rule_regex_combined = combine_patterns(rule_regex)
+        self._has_rule_regex = bool(rule_regex)
+        logger.debug(
+            f"匹配器已重建: 过滤词{len(self.ban_words.patterns)}个, 过滤正则{len(self.ban_regex)}个, "
+            f"关键词规则{len(self.keyword_rules)}条"
+        )
+
+    def find_ban_word(self, text: str) -> Optional[str]:
+        """返回文本中命中的过滤词，没有则返回None"""
+        self._ensure_built()
+        return self.ban_words.find_first(text)
+
+    def find_ban_regex(self, text: str) -> Optional[Pattern]:
+        """返回文本命中的过滤正则，没有则返回None"""
+        self._ensure_built()
+        if self.ban_regex_combined is not None and not self.ban_regex_combined.search(text):
+            return None
+        for pattern in self.ban_regex:
+            if pattern.search(text):
+                return pattern
+        return None
+
+    def is_at_bot(self, text: str) -> bool:
+        self._ensure_built()
+        return bool(self.at_pattern.search(text))
+
+    def is_reply_to_bot(self, text: str) -> bool:
+        self._ensure_built()
+        return bool(self.reply_pattern.match(text))
+
+    def mentions_bot_name(self, text: str) -> bool:
+        """去掉@和回复部分后，检查文本中是否出现机器人的名字或别名"""
+        self._ensure_built()
+        content = self.at_strip_pattern.sub("", text)
+        content = self.reply_strip_pattern.sub("", content)
+        return self.mention_names.find_first(content) is not None
+
+    def match_keyword_reactions(self, message_txt: str, use_regex: bool = True) -> List[str]:
+        """返回命中的关键词反应（按规则顺序），规则的关键词没有命中时再尝试它的正则"""
+        self._ensure_built()
+        if not self.keyword_rules:
+            return []
+
+        keyword_hit_rules = {self.keyword_owner[i] for i in self.keywords.find_all(message_txt.lower())}
+        regex_candidate = (
+            use_regex
+            and self._has_rule_regex
+            and (self.rule_regex_combined is None or self.rule_regex_combined.search(message_txt) is not None)
+        )
+
+        reactions = []
+        for index, rule in enumerate(self.keyword_rules):
+            if index in keyword_hit_rules:
+                logger.info(f"检测到以下关键词之一：{rule.get('keywords', [])}，触发反应：{rule.get('reaction', '')}")
+                reactions.append(rule.get("reaction", ""))
+            elif regex_candidate:
+                for pattern in rule.get("regex", []):
+                    result = pattern.search(message_txt)
+                    if result:
+                        reaction = rule.get("reaction", "")
+                        for name, content in result.groupdict().items():
+                            reaction = reaction.replace(f"[{name}]", content)
+                        logger.info(f"匹配到以下正则表达式：{pattern}，触发反应：{reaction}")
+                        reactions.append(reaction)
+                        break
+        return reactions
+
+
+message_matcher = MessageMatcher()
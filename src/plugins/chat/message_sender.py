@@ -1,13 +1,15 @@
 import asyncio
+import heapq
+import itertools
 import time
 from typing import Dict, List, Optional, Union
 
 from src.common.logger import get_module_logger
-from ...common.database import db
 from ..message.api import global_api
 from .message import MessageSending, MessageThinking, MessageSet
 
 from ..storage.storage import MessageStorage
+from ..storage.recall_registry import recall_registry
 from ..config.config import global_config
 from .utils import truncate_message, calculate_typing_time, count_messages_between
 
@@ -35,13 +37,9 @@ class Message_Sender:
         """设置当前bot实例"""
         pass
 
-    def get_recalled_messages(self, stream_id: str) -> list:
-        """获取所有撤回的消息"""
-        recalled_messages = []
-
-        recalled_messages = list(db.recalled_messages.find({"stream_id": stream_id}, {"message_id": 1}))
-        # 按thinking_start_time排序，时间早的在前面
-        return recalled_messages
+    def is_recalled(self, message: MessageSending) -> bool:
+        """检查要回复的消息是否已被撤回"""
+        return recall_registry.is_recalled(message.chat_stream.stream_id, message.reply_to_message_id)
 
     async def send_via_ws(self, message: MessageSending) -> None:
         try:
@@ -56,14 +54,9 @@ class Message_Sender:
         """发送消息"""
 
         if isinstance(message, MessageSending):
-            recalled_messages = self.get_recalled_messages(message.chat_stream.stream_id)
-            is_recalled = False
-            for recalled_message in recalled_messages:
-                if message.reply_to_message_id == recalled_message["message_id"]:
-                    is_recalled = True
-                    logger.warning(f"消息“{message.processed_plain_text}”已被撤回，不发送")
-                    break
-            if not is_recalled:
+            if self.is_recalled(message):
+                logger.warning(f"消息“{message.processed_plain_text}”已被撤回，不发送")
+            else:
                 # print(message.processed_plain_text + str(message.is_emoji))
                 typing_time = calculate_typing_time(
                     input_string=message.processed_plain_text,
@@ -96,83 +89,124 @@ class Message_Sender:
 
 
 class MessageContainer:
-    """单个聊天流的发送/思考消息容器"""
+    """单个聊天流的发送/思考消息容器
+
+    消息按thinking_start_time维护在小顶堆中，删除采用惰性标记，
+    新消息加入或消息被移除时通过wakeup事件唤醒该聊天流的发送任务。
+    """
 
     def __init__(self, chat_id: str, max_size: int = 100):
         self.chat_id = chat_id
         self.max_size = max_size
-        self.messages = []
+        self._heap: List[list] = []  # [thinking_start_time, 序号, 消息(被移除时置None), 入队时间]
+        self._entries: Dict[int, list] = {}  # id(message) -> 堆条目
+        self._seq = itertools.count()
         self.last_send_time = 0
+        self.last_active_time = time.time()
         self.thinking_wait_timeout = 20  # 思考等待超时时间（秒）
+        self.wakeup = asyncio.Event()
 
-    def get_timeout_messages(self) -> List[MessageSending]:
-        """获取所有超时的Message_Sending对象（思考时间超过20秒），按thinking_start_time排序"""
-        current_time = time.time()
-        timeout_messages = []
+    def __len__(self) -> int:
+        return len(self._entries)
 
-        for msg in self.messages:
-            if isinstance(msg, MessageSending):
-                if current_time - msg.thinking_start_time > self.thinking_wait_timeout:
-                    timeout_messages.append(msg)
+    @property
+    def messages(self) -> List[Union[MessageSending, MessageThinking]]:
+        """按thinking_start_time排序的所有消息（只读快照，修改请使用remove_message）"""
+        return [entry[2] for entry in sorted(self._entries.values())]
 
-        # 按thinking_start_time排序，时间早的在前面
-        timeout_messages.sort(key=lambda x: x.thinking_start_time)
+    def get_enqueue_time(self, message: Union[MessageThinking, MessageSending]) -> Optional[float]:
+        """获取消息进入容器的时间"""
+        entry = self._entries.get(id(message))
+        return entry[3] if entry else None
 
-        return timeout_messages
+    def get_timeout_messages(self) -> List[MessageSending]:
+        """获取所有超时的Message_Sending对象（思考时间超过20秒），按thinking_start_time排序"""
+        current_time = time.time()
+        return [
+            msg
+            for msg in self.messages
+            if isinstance(msg, MessageSending) and current_time - msg.thinking_start_time > self.thinking_wait_timeout
+        ]
 
     def get_earliest_message(self) -> Optional[Union[MessageThinking, MessageSending]]:
         """获取thinking_start_time最早的消息对象"""
-        if not self.messages:
+        while self._heap and self._heap[0][2] is None:
+            heapq.heappop(self._heap)
+        if not self._heap:
             return None
-        earliest_time = float("inf")
-        earliest_message = None
-        for msg in self.messages:
-            msg_time = msg.thinking_start_time
-            if msg_time < earliest_time:
-                earliest_time = msg_time
-                earliest_message = msg
-        return earliest_message
+        return self._heap[0][2]
 
     def add_message(self, message: Union[MessageThinking, MessageSending]) -> None:
         """添加消息到队列"""
         if isinstance(message, MessageSet):
             for single_message in message.messages:
-                self.messages.append(single_message)
+                self._push(single_message)
         else:
-            self.messages.append(message)
+            self._push(message)
+        self.last_active_time = time.time()
+        self.wakeup.set()
+
+    def _push(self, message: Union[MessageThinking, MessageSending]) -> None:
+        if id(message) in self._entries:
+            return
+        entry = [message.thinking_start_time, next(self._seq), message, time.time()]
+        self._entries[id(message)] = entry
+        heapq.heappush(self._heap, entry)
 
     def remove_message(self, message: Union[MessageThinking, MessageSending]) -> bool:
         """移除消息，如果消息存在则返回True，否则返回False"""
-        try:
-            if message in self.messages:
-                self.messages.remove(message)
-                return True
-            return False
-        except Exception:
-            logger.exception("移除消息时发生错误")
+        entry = self._entries.pop(id(message), None)
+        if entry is None:
             return False
+        entry[2] = None
+        self.last_active_time = time.time()
+        self.wakeup.set()
+        return True
+
+    def pop_thinking_message(self, thinking_id: str) -> Optional[MessageThinking]:
+        """取出指定id的思考消息，不存在（例如已超时被移除）时返回None"""
+        for msg in self.messages:
+            if isinstance(msg, MessageThinking) and msg.message_info.message_id == thinking_id:
+                self.remove_message(msg)
+                return msg
+        return None
 
     def has_messages(self) -> bool:
         """检查是否有待发送的消息"""
-        return bool(self.messages)
+        return bool(self._entries)
 
     def get_all_messages(self) -> List[Union[MessageSending, MessageThinking]]:
         """获取所有消息"""
-        return list(self.messages)
+        return self.messages
 
 
 class MessageManager:
-    """管理所有聊天流的消息容器"""
+    """管理所有聊天流的消息容器
 
-    def __init__(self):
+    每个聊天流容器有独立的发送任务，由add_message唤醒，
+    没有消息时按最近的超时截止时间休眠，空闲超过idle_timeout后回收容器。
+    """
+
+    def __init__(self, idle_timeout: float = 600):
         self.containers: Dict[str, MessageContainer] = {}  # chat_id -> MessageContainer
         self.storage = MessageStorage()
+        self.idle_timeout = idle_timeout  # 容器空闲回收时间（秒）
         self._running = True
+        self._started = False
+        self._workers: Dict[str, asyncio.Task] = {}  # chat_id -> 发送任务
+
+        # 发送指标
+        self._sent_count = 0
+        self._send_lag_total = 0.0
+        self._send_lag_max = 0.0
+        self._send_lag_last = 0.0
+        self._evicted_count = 0
 
     def get_container(self, chat_id: str) -> MessageContainer:
         """获取或创建聊天流的消息容器"""
         if chat_id not in self.containers:
             self.containers[chat_id] = MessageContainer(chat_id)
+        self._ensure_worker(chat_id)
         return self.containers[chat_id]
 
     def add_message(self, message: Union[MessageThinking, MessageSending, MessageSet]) -> None:
@@ -182,105 +216,173 @@ class MessageManager:
         container = self.get_container(chat_stream.stream_id)
         container.add_message(message)
 
-    async def process_chat_messages(self, chat_id: str):
-        """处理聊天流消息"""
+    def _ensure_worker(self, chat_id: str) -> None:
+        """确保聊天流的发送任务在运行"""
+        if not self._started or not self._running:
+            return
+        worker = self._workers.get(chat_id)
+        if worker is None or worker.done():
+            self._workers[chat_id] = asyncio.create_task(self._container_worker(chat_id))
+
+    def _evict_container(self, chat_id: str) -> None:
+        """回收空闲容器"""
+        self.containers.pop(chat_id, None)
+        self._workers.pop(chat_id, None)
+        self._evicted_count += 1
+        logger.trace(f"回收空闲消息容器: {chat_id}")
+
+    def get_metrics(self) -> dict:
+        """获取发送队列指标"""
+        queue_depth = {chat_id: len(container) for chat_id, container in self.containers.items()}
+        return {
+            "containers": len(self.containers),
+            "evicted_containers": self._evicted_count,
+            "queue_depth": sum(queue_depth.values()),
+            "queue_depth_by_chat": queue_depth,
+            "sent_count": self._sent_count,
+            "send_lag_avg": self._send_lag_total / self._sent_count if self._sent_count else 0.0,
+            "send_lag_max": self._send_lag_max,
+            "send_lag_last": self._send_lag_last,
+        }
+
+    def _record_send_lag(self, container: MessageContainer, message: MessageSending) -> None:
+        """记录发送延迟：从消息进入容器到开始发送的时间"""
+        enqueue_time = container.get_enqueue_time(message)
+        if enqueue_time is None:
+            return
+        lag = time.time() - enqueue_time
+        self._sent_count += 1
+        self._send_lag_total += lag
+        self._send_lag_last = lag
+        self._send_lag_max = max(self._send_lag_max, lag)
+
+    async def _send_single_message(self, container: MessageContainer, msg: MessageSending) -> None:
+        """判断是否需要引用回复，然后发送并存储单条消息"""
+        self._record_send_lag(container, msg)
+        msg.update_thinking_time()
+        thinking_messages_count, thinking_messages_length = count_messages_between(
+            start_time=msg.thinking_start_time, end_time=time.time(), stream_id=msg.chat_stream.stream_id
+        )
+
+        if (
+            msg.is_head
+            and (thinking_messages_count > 4 or thinking_messages_length > 250)
+            and not msg.is_private_message()  # 避免在私聊时插入reply
+        ):
+            logger.debug(f"设置回复消息{msg.processed_plain_text}")
+            msg.set_reply()
+
+        await msg.process()
+
+        await message_sender.send_message(msg)
+
+        await self.storage.store_message(msg, msg.chat_stream)
+
+        container.last_send_time = time.time()
+        if not container.remove_message(msg):
+            logger.warning("尝试删除不存在的消息")
+
+    async def process_chat_messages(self, chat_id: str) -> Optional[float]:
+        """处理聊天流消息
+
+        Returns:
+            Optional[float]: 距离下一次需要处理的秒数，容器为空时返回None
+        """
         container = self.get_container(chat_id)
-        if container.has_messages():
-            # print(f"处理有message的容器chat_id: {chat_id}")
-            message_earliest = container.get_earliest_message()
-
-            if isinstance(message_earliest, MessageThinking):
-                """取得了思考消息"""
-                message_earliest.update_thinking_time()
-                thinking_time = message_earliest.thinking_time
-                # print(thinking_time)
-                print(
-                    f"消息正在思考中，已思考{int(thinking_time)}秒\r",
-                    end="",
-                    flush=True,
-                )
+        if not container.has_messages():
+            return None
 
-                # 检查是否超时
-                if thinking_time > global_config.thinking_timeout:
-                    logger.warning(f"消息思考超时({thinking_time}秒)，移除该消息")
-                    container.remove_message(message_earliest)
+        message_earliest = container.get_earliest_message()
 
-            else:
-                """取得了发送消息"""
-                thinking_time = message_earliest.update_thinking_time()
-                thinking_start_time = message_earliest.thinking_start_time
-                now_time = time.time()
-                thinking_messages_count, thinking_messages_length = count_messages_between(
-                    start_time=thinking_start_time, end_time=now_time, stream_id=message_earliest.chat_stream.stream_id
-                )
-                # print(thinking_time)
-                # print(thinking_messages_count)
-                # print(thinking_messages_length)
+        if isinstance(message_earliest, MessageThinking):
+            """取得了思考消息"""
+            thinking_time = message_earliest.update_thinking_time()
+            logger.trace(f"消息正在思考中，已思考{int(thinking_time)}秒")
 
-                if (
-                    message_earliest.is_head
-                    and (thinking_messages_count > 4 or thinking_messages_length > 250)
-                    and not message_earliest.is_private_message()  # 避免在私聊时插入reply
-                ):
-                    logger.debug(f"设置回复消息{message_earliest.processed_plain_text}")
-                    message_earliest.set_reply()
+            # 检查是否超时
+            if thinking_time > global_config.thinking_timeout:
+                logger.warning(f"消息思考超时({thinking_time}秒)，移除该消息")
+                container.remove_message(message_earliest)
 
-                await message_earliest.process()
+        else:
+            """取得了发送消息"""
+            await self._send_single_message(container, message_earliest)
 
-                # print(f"message_earliest.thinking_start_tim22222e:{message_earliest.thinking_start_time}")
+        message_timeout = container.get_timeout_messages()
+        if message_timeout:
+            logger.debug(f"发现{len(message_timeout)}条超时消息")
+            for msg in message_timeout:
+                if msg == message_earliest:
+                    continue
 
-                await message_sender.send_message(message_earliest)
+                try:
+                    await self._send_single_message(container, msg)
+                except Exception:
+                    logger.exception("处理超时消息时发生错误")
+                    continue
 
-                await self.storage.store_message(message_earliest, message_earliest.chat_stream)
+        return self._next_wakeup_delay(container)
 
-                container.remove_message(message_earliest)
+    def _next_wakeup_delay(self, container: MessageContainer) -> Optional[float]:
+        """计算容器下一次需要处理的时间：堆顶是发送消息时立即处理，否则等到最近的超时点"""
+        message_earliest = container.get_earliest_message()
+        if message_earliest is None:
+            return None
+        if not isinstance(message_earliest, MessageThinking):
+            return 0
 
-            message_timeout = container.get_timeout_messages()
-            if message_timeout:
-                logger.debug(f"发现{len(message_timeout)}条超时消息")
-                for msg in message_timeout:
-                    if msg == message_earliest:
-                        continue
-
-                    try:
-                        thinking_time = msg.update_thinking_time()
-                        thinking_start_time = msg.thinking_start_time
-                        now_time = time.time()
-                        thinking_messages_count, thinking_messages_length = count_messages_between(
-                            start_time=thinking_start_time, end_time=now_time, stream_id=msg.chat_stream.stream_id
-                        )
-                        # print(thinking_time)
-                        # print(thinking_messages_count)
-                        # print(thinking_messages_length)
-                        if (
-                            msg.is_head
-                            and (thinking_messages_count > 4 or thinking_messages_length > 250)
-                            and not msg.is_private_message()  # 避免在私聊时插入reply
-                        ):
-                            logger.debug(f"设置回复消息{msg.processed_plain_text}")
-                            msg.set_reply()
-
-                        await msg.process()
-
-                        await message_sender.send_message(msg)
-
-                        await self.storage.store_message(msg, msg.chat_stream)
-
-                        if not container.remove_message(msg):
-                            logger.warning("尝试删除不存在的消息")
-                    except Exception:
-                        logger.exception("处理超时消息时发生错误")
-                        continue
+        now = time.time()
+        deadline = message_earliest.thinking_start_time + global_config.thinking_timeout
+        for msg in container.messages:
+            if isinstance(msg, MessageSending):
+                deadline = min(deadline, msg.thinking_start_time + container.thinking_wait_timeout)
+                break
+        # 多等一点，保证到达时严格超过超时阈值
+        return max(0.0, deadline - now) + 0.05
 
-    async def start_processor(self):
-        """启动消息处理器"""
+    async def _container_worker(self, chat_id: str) -> None:
+        """单个聊天流的发送任务"""
         while self._running:
-            await asyncio.sleep(1)
-            tasks = []
-            for chat_id in self.containers.keys():
-                tasks.append(self.process_chat_messages(chat_id))
+            container = self.containers.get(chat_id)
+            if container is None:
+                return
+            container.wakeup.clear()
+
+            try:
+                delay = await self.process_chat_messages(chat_id)
+            except Exception:
+                logger.exception(f"处理聊天流{chat_id}的消息时发生错误")
+                delay = 1
+
+            if delay == 0:
+                continue
+            if delay is None:
+                idle_time = time.time() - container.last_active_time
+                if idle_time >= self.idle_timeout:
+                    self._evict_container(chat_id)
+                    return
+                delay = self.idle_timeout - idle_time
+
+            try:
+                await asyncio.wait_for(container.wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
 
-            await asyncio.gather(*tasks)
+    async def start_processor(self):
+        """启动消息处理器，为已存在的容器启动发送任务，之后的容器由add_message按需启动"""
+        self._running = True
+        self._started = True
+        for chat_id in list(self.containers.keys()):
+            self._ensure_worker(chat_id)
+
+    async def stop_processor(self):
+        """停止所有发送任务"""
+        self._running = False
+        workers = list(self._workers.values())
+        self._workers.clear()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
 
 
 # 创建全局消息管理器实例
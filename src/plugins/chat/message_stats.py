@@ -0,0 +1,91 @@
+import time
+from bisect import bisect_right
+from typing import Dict, List, Tuple
+
+from ...common.database import db
+from src.common.logger import get_module_logger
+
+logger = get_module_logger("message_stats")
+
+
+class StreamMessageCounter:
+    """单个聊天流的消息计数器
+
+    按到达顺序记录消息时间，并维护消息数量和文本长度的前缀和，
+    任意时间区间内的消息数量和文本总长度都可以通过二分查找在O(log n)内得到。
+    """
+
+    def __init__(self, stream_id: str, retention: float = 3600):
+        self.stream_id = stream_id
+        self.retention = retention  # 保留的时间窗口（秒）
+        self.times: List[float] = []  # 按到达顺序的消息时间（单调不减）
+        self.length_prefix: List[int] = [0]  # length_prefix[i] 为前i条消息的文本长度之和
+
+    def record(self, message_time: float, text_length: int) -> None:
+        """记录一条新消息"""
+        # 按到达顺序计数，乱序到达的消息归入当前最新的时间点，保证times单调
+        if self.times and message_time < self.times[-1]:
+            message_time = self.times[-1]
+        self.times.append(message_time)
+        self.length_prefix.append(self.length_prefix[-1] + text_length)
+        self._trim(message_time)
+
+    def _trim(self, now: float) -> None:
+        """丢弃保留窗口之外的记录，超出部分累计到一定数量后再批量删除"""
+        cut = bisect_right(self.times, now - self.retention)
+        if cut > 256 and cut * 2 > len(self.times):
+            del self.times[:cut]
+            del self.length_prefix[:cut]
+
+    def count_between(self, start_time: float, end_time: float) -> Tuple[int, int]:
+        """统计 (start_time, end_time] 之间的消息数量和文本总长度"""
+        if end_time <= start_time:
+            return 0, 0
+        start = bisect_right(self.times, start_time)
+        end = bisect_right(self.times, end_time)
+        if end <= start:
+            return 0, 0
+        return end - start, self.length_prefix[end] - self.length_prefix[start]
+
+
+class MessageRangeStats:
+    """所有聊天流的消息区间统计
+
+    由MessageStorage在存储消息时更新，聊天流第一次被访问时从数据库加载保留窗口内的消息作为初始数据。
+    """
+
+    def __init__(self, retention: float = 3600):
+        self.retention = retention
+        self.counters: Dict[str, StreamMessageCounter] = {}
+
+    def _get_counter(self, stream_id: str) -> StreamMessageCounter:
+        counter = self.counters.get(stream_id)
+        if counter is None:
+            counter = StreamMessageCounter(stream_id, retention=self.retention)
+            self._seed_from_db(counter)
+            self.counters[stream_id] = counter
+        return counter
+
+    def _seed_from_db(self, counter: StreamMessageCounter) -> None:
+        """从数据库加载保留窗口内的消息"""
+        try:
+            cursor = db.messages.find(
+                {"chat_id": counter.stream_id, "time": {"$gte": time.time() - self.retention}},
+                {"time": 1, "processed_plain_text": 1},
+                sort=[("time", 1), ("_id", 1)],
+            )
+            for msg in cursor:
+                counter.record(msg["time"], len(msg.get("processed_plain_text") or ""))
+        except Exception as e:
+            logger.error(f"加载聊天流{counter.stream_id}的消息统计失败: {str(e)}")
+
+    def record(self, stream_id: str, message_time: float, text: str) -> None:
+        """记录一条新消息，需要在消息写入数据库之前调用，避免初始加载时重复计数"""
+        self._get_counter(stream_id).record(message_time, len(text or ""))
+
+    def count_between(self, start_time: float, end_time: float, stream_id: str) -> Tuple[int, int]:
+        """统计聊天流在 (start_time, end_time] 之间的消息数量和文本总长度"""
+        return self._get_counter(stream_id).count_between(start_time, end_time)
+
+
+message_range_stats = MessageRangeStats()
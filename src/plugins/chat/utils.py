@@ -14,6 +14,8 @@ from ..config.config import global_config
 from .message import MessageRecv, Message
 from ..message.message_base import UserInfo
 from .chat_stream import ChatStream
+from .message_stats import message_range_stats
+from .message_matcher import message_matcher
 from ..moods.moods import MoodManager
 from ...common.database import db
 
@@ -40,14 +42,12 @@ def db_message_to_str(message_dict: Dict) -> str:
 
 def is_mentioned_bot_in_message(message: MessageRecv) -> bool:
     """检查消息是否提到了机器人"""
-    keywords = [global_config.BOT_NICKNAME]
-    nicknames = global_config.BOT_ALIAS_NAMES
     reply_probability = 0
     is_at = False
     is_mentioned = False
 
     # 判断是否被@
-    if re.search(f"@[\s\S]*?（id:{global_config.BOT_QQ}）", message.processed_plain_text):
+    if message_matcher.is_at_bot(message.processed_plain_text):
         is_at = True
         is_mentioned = True
 
@@ -57,18 +57,12 @@ def is_mentioned_bot_in_message(message: MessageRecv) -> bool:
     else:
         if not is_mentioned:
             # 判断是否被回复
-            if re.match(f"回复[\s\S]*?\({global_config.BOT_QQ}\)的消息，说：", message.processed_plain_text):
+            if message_matcher.is_reply_to_bot(message.processed_plain_text):
                 is_mentioned = True
 
             # 判断内容中是否被提及
-            message_content = re.sub(r"\@[\s\S]*?（(\d+)）", "", message.processed_plain_text)
-            message_content = re.sub(r"回复[\s\S]*?\((\d+)\)的消息，说： ", "", message_content)
-            for keyword in keywords:
-                if keyword in message_content:
-                    is_mentioned = True
-            for nickname in nicknames:
-                if nickname in message_content:
-                    is_mentioned = True
+            if message_matcher.mentions_bot_name(message.processed_plain_text):
+                is_mentioned = True
         if is_mentioned and global_config.mentioned_bot_inevitable_reply:
             reply_probability = 1
             logger.info("被提及，回复概率设置为100%")
@@ -87,6 +81,16 @@ async def get_embedding(text, request_type="embedding"):
     return embedding
 
 
+async def get_embeddings(texts, request_type="embedding"):
+    """在一个请求中获取多段文本的embedding向量，失败时返回None"""
+    llm = LLM_request(model=global_config.embedding, request_type=request_type)
+    try:
+        return await llm.get_embeddings(texts)
+    except Exception as e:
+        logger.error(f"批量获取embedding失败: {str(e)}")
+        return None
+
+
 async def get_recent_group_messages(chat_id: str, limit: int = 12) -> list:
     """从数据库获取群组最近的消息记录
 
@@ -547,85 +551,11 @@ def count_messages_between(start_time: float, end_time: float, stream_id: str) -
 
     Returns:
         tuple[int, int]: (消息数量, 文本总长度)
-        - 消息数量：包含起始时间的消息，不包含结束时间的消息
-        - 文本总长度：所有消息的processed_plain_text长度之和
+        - 消息数量：不包含起始时间的消息，包含结束时间的消息
+        - 文本总长度：这些消息的processed_plain_text长度之和
     """
     try:
-        # 获取开始时间之前最新的一条消息
-        start_message = db.messages.find_one(
-            {"chat_id": stream_id, "time": {"$lte": start_time}},
-            sort=[("time", -1), ("_id", -1)],  # 按时间倒序，_id倒序（最后插入的在前）
-        )
-
-        # 获取结束时间最近的一条消息
-        # 先找到结束时间点的所有消息
-        end_time_messages = list(
-            db.messages.find(
-                {"chat_id": stream_id, "time": {"$lte": end_time}},
-                sort=[("time", -1)],  # 先按时间倒序
-            ).limit(10)
-        )  # 限制查询数量，避免性能问题
-
-        if not end_time_messages:
-            logger.warning(f"未找到结束时间 {end_time} 之前的消息")
-            return 0, 0
-
-        # 找到最大时间
-        max_time = end_time_messages[0]["time"]
-        # 在最大时间的消息中找最后插入的（_id最大的）
-        end_message = max([msg for msg in end_time_messages if msg["time"] == max_time], key=lambda x: x["_id"])
-
-        if not start_message:
-            logger.warning(f"未找到开始时间 {start_time} 之前的消息")
-            return 0, 0
-
-        # 调试输出
-        # print("\n=== 消息范围信息 ===")
-        # print("Start message:", {
-        #     "message_id": start_message.get("message_id"),
-        #     "time": start_message.get("time"),
-        #     "text": start_message.get("processed_plain_text", ""),
-        #     "_id": str(start_message.get("_id"))
-        # })
-        # print("End message:", {
-        #     "message_id": end_message.get("message_id"),
-        #     "time": end_message.get("time"),
-        #     "text": end_message.get("processed_plain_text", ""),
-        #     "_id": str(end_message.get("_id"))
-        # })
-        # print("Stream ID:", stream_id)
-
-        # 如果结束消息的时间等于开始时间，返回0
-        if end_message["time"] == start_message["time"]:
-            return 0, 0
-
-        # 获取并打印这个时间范围内的所有消息
-        # print("\n=== 时间范围内的所有消息 ===")
-        all_messages = list(
-            db.messages.find(
-                {"chat_id": stream_id, "time": {"$gte": start_message["time"], "$lte": end_message["time"]}},
-                sort=[("time", 1), ("_id", 1)],  # 按时间正序，_id正序
-            )
-        )
-
-        count = 0
-        total_length = 0
-        for msg in all_messages:
-            count += 1
-            text_length = len(msg.get("processed_plain_text", ""))
-            total_length += text_length
-            # print(f"\n消息 {count}:")
-            # print({
-            #     "message_id": msg.get("message_id"),
-            #     "time": msg.get("time"),
-            #     "text": msg.get("processed_plain_text", ""),
-            #     "text_length": text_length,
-            #     "_id": str(msg.get("_id"))
-            # })
-
-        # 如果时间不同，需要把end_message本身也计入
-        return count - 1, total_length
-
+        return message_range_stats.count_between(start_time, end_time, stream_id)
     except Exception as e:
         logger.error(f"计算消息数量时出错: {str(e)}")
         return 0, 0
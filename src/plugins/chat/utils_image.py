@@ -1,20 +1,68 @@
+import asyncio
 import base64
+import json
 import os
+import re
 import time
 import hashlib
-from typing import Optional
-from PIL import Image
-import io
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
+from pymongo import UpdateOne
 
 from ...common.database import db
 from ..config.config import global_config
 from ..models.utils_model import LLM_request
+from ..utils.bk_tree import BKTree
+from ...common.image_worker import image_worker
 
 from src.common.logger import get_module_logger
 
 logger = get_module_logger("chat_image")
 
+# 感知哈希中1的位数少于该值（或0的位数少于该值）时认为区分度不足
+MIN_DHASH_BITS = 8
+
+BATCH_IMAGE_PROMPT = (
+    "下面依次是同一条消息中的{count}张图片。请分别用中文描述每张图片的内容。如果有文字，请把文字都描述出来。"
+    "并尝试猜测图片的含义，每张最多100个字。"
+    '只输出一个JSON数组，不要输出其他内容，格式为：[{{"index": 1, "description": "第1张图片的描述"}}, ...]，'
+    "index从1开始，与图片的顺序一致，每张图片都要有。"
+)
+
+
+class _DescribeCancelled(Exception):
+    """发起描述生成的请求被取消，等待这次结果的请求改为自己生成"""
+
+
+def parse_batch_descriptions(content: str, count: int) -> Dict[int, str]:
+    """解析批量描述的输出，返回 图片序号(从0开始) -> 描述，无法解析的图片不包含在结果中"""
+    match = re.search(r"\[.*\]", content or "", re.DOTALL)
+    if not match:
+        return {}
+    try:
+        items = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    result = {}
+    for position, item in enumerate(items):
+        if isinstance(item, dict):
+            index, description = item.get("index", position + 1), item.get("description")
+        elif isinstance(item, str):
+            index, description = position + 1, item
+        else:
+            continue
+        try:
+            index = int(index) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < count and isinstance(description, str) and description.strip():
+            result.setdefault(index, description.strip())
+    return result
+
 
 class ImageManager:
     _instance = None
@@ -33,6 +81,20 @@ class ImageManager:
             self._ensure_image_dir()
             self._initialized = True
             self._llm = LLM_request(model=global_config.vlm, temperature=0.4, max_tokens=300, request_type="image")
+            # 一次请求描述多张图片，每批最多batch_describe_size张
+            self.batch_describe_size = 6
+            self._batch_llm = LLM_request(
+                model=global_config.vlm, temperature=0.4, max_tokens=1500, request_type="image"
+            )
+            # 数据库前的内存LRU缓存：(哈希, 类型) -> 描述
+            self._description_cache: OrderedDict[Tuple[str, str], str] = OrderedDict()
+            self.description_cache_size = 4096
+            # 正在生成描述的图片：(哈希, 类型) -> 结果，同一图片的并发请求共用一次生成
+            self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+            # dHash汉明距离不超过该值的图片视为同一张图，复用已有描述；设为负数关闭近似匹配
+            self.similar_distance = global_config.similar_image_distance
+            self._similar_index: Dict[str, BKTree] = {}  # 描述类型 -> dHash的BK树，值为图片MD5
+            self._similar_index_lock = asyncio.Lock()
 
     def _ensure_image_dir(self):
         """确保图像存储目录存在"""
@@ -59,6 +121,7 @@ class ImageManager:
         db.image_descriptions.drop_indexes()
         # 创建新的复合索引
         db.image_descriptions.create_index([("hash", 1), ("type", 1)], unique=True)
+        db.image_descriptions.create_index([("type", 1), ("dhash", 1)])
 
     def _get_description_from_db(self, image_hash: str, description_type: str) -> Optional[str]:
         """从数据库获取图片描述
@@ -70,32 +133,210 @@ class ImageManager:
         Returns:
             Optional[str]: 描述文本，如果不存在则返回None
         """
+        key = (image_hash, description_type)
+        description = self._description_cache.get(key)
+        if description is not None:
+            self._description_cache.move_to_end(key)
+            return description
+
         result = db.image_descriptions.find_one({"hash": image_hash, "type": description_type})
-        return result["description"] if result else None
+        if not result:
+            return None
+        self._cache_description(image_hash, description_type, result["description"])
+        return result["description"]
+
+    def _cache_description(self, image_hash: str, description_type: str, description: Optional[str]) -> None:
+        """写入内存LRU缓存，超出容量时淘汰最久未使用的描述"""
+        if not description:
+            return
+        key = (image_hash, description_type)
+        self._description_cache[key] = description
+        self._description_cache.move_to_end(key)
+        while len(self._description_cache) > self.description_cache_size:
+            self._description_cache.popitem(last=False)
+
+    async def _get_similar_index(self, description_type: str) -> BKTree:
+        """获取某类描述的dHash索引，第一次使用时从数据库加载"""
+        index = self._similar_index.get(description_type)
+        if index is not None:
+            return index
+        async with self._similar_index_lock:
+            if description_type not in self._similar_index:
+                index = BKTree()
+                records = await asyncio.to_thread(
+                    lambda: list(
+                        db.image_descriptions.find(
+                            {"type": description_type, "dhash": {"$exists": True}}, {"hash": 1, "dhash": 1}
+                        )
+                    )
+                )
+                for record in records:
+                    index.add(int(record["dhash"], 16), record["hash"])
+                self._similar_index[description_type] = index
+                logger.debug(f"已加载 {len(index)} 个{description_type}感知哈希")
+        return self._similar_index[description_type]
+
+    async def find_similar(
+        self, image_bytes: bytes, description_type: str
+    ) -> Tuple[Optional[int], Optional[Tuple[str, str]]]:
+        """按感知哈希查找已有描述的近似图片
+
+        Returns:
+            (图片的dHash, (相似图片的MD5, 描述))，没有相似图片时第二项为None，
+            无法计算哈希或近似匹配关闭时两项都为None
+        """
+        if self.similar_distance < 0:
+            return None, None
+        try:
+            image_dhash = await image_worker.dhash(image_bytes)
+        except Exception as e:
+            logger.debug(f"计算感知哈希失败: {str(e)}")
+            return None, None
+        # 几乎纯色或单纯渐变的图片哈希区分度太低，不参与近似匹配
+        if not MIN_DHASH_BITS <= image_dhash.bit_count() <= 64 - MIN_DHASH_BITS:
+            return image_dhash, None
+
+        index = await self._get_similar_index(description_type)
+        for distance, similar_hash in index.search(image_dhash, self.similar_distance):
+            description = self._get_description_from_db(similar_hash, description_type)
+            if description:
+                logger.debug(f"找到相似图片 {similar_hash[:8]}，距离 {distance}")
+                return image_dhash, (similar_hash, description)
+        return image_dhash, None
+
+    async def _describe_once(
+        self, image_hash: str, description_type: str, generate: Callable[[], Awaitable[Optional[str]]]
+    ) -> Optional[str]:
+        """同一图片同时只生成一次描述，其余并发请求等待并共用这次的结果
+
+        发起生成的请求被取消时，等待者不会跟着被取消，而是由其中一个重新生成。
+        """
+        key = (image_hash, description_type)
+        while key in self._inflight:
+            inflight = self._inflight[key]
+            logger.debug(f"等待同一图片正在进行的描述生成: {image_hash[:8]}")
+            try:
+                return await asyncio.shield(inflight)
+            except _DescribeCancelled:
+                continue
 
-    def _save_description_to_db(self, image_hash: str, description: str, description_type: str) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            description = await generate()
+        except asyncio.CancelledError:
+            # 不能取消future，否则所有等待者都会收到CancelledError
+            future.set_exception(_DescribeCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 已在此处抛出，避免没有等待者时报未处理异常
+            raise
+        else:
+            future.set_result(description)
+            return description
+        finally:
+            del self._inflight[key]
+
+    def _save_description_to_db(
+        self, image_hash: str, description: str, description_type: str, image_dhash: Optional[int] = None
+    ) -> None:
         """保存图片描述到数据库
 
         Args:
             image_hash: 图片哈希值
             description: 描述文本
             description_type: 描述类型 ('emoji' 或 'image')
+            image_dhash: 图片的感知哈希，提供时加入近似匹配索引
         """
+        self._cache_description(image_hash, description_type, description)
+        fields = {
+            "description": description,
+            "timestamp": int(time.time()),
+            "hash": image_hash,  # 确保hash字段存在
+            "type": description_type,  # 确保type字段存在
+        }
+        if image_dhash is not None:
+            # 64位无符号整数超出了BSON整数范围，以十六进制字符串保存
+            fields["dhash"] = f"{image_dhash:016x}"
+            index = self._similar_index.get(description_type)
+            if index is not None:
+                index.add(image_dhash, image_hash)
         try:
             db.image_descriptions.update_one(
+                {"hash": image_hash, "type": description_type},
+                {"$set": fields},
+                upsert=True,
+            )
+        except Exception as e:
+            logger.error(f"保存描述到数据库失败: {str(e)}")
+
+    def _save_descriptions_to_db(self, descriptions: Dict[str, str], description_type: str) -> None:
+        """批量保存图片描述到数据库
+
+        Args:
+            descriptions: 图片哈希值 -> 描述文本
+            description_type: 描述类型 ('emoji' 或 'image')
+        """
+        if not descriptions:
+            return
+        for image_hash, description in descriptions.items():
+            self._cache_description(image_hash, description_type, description)
+        now = int(time.time())
+        operations = [
+            UpdateOne(
                 {"hash": image_hash, "type": description_type},
                 {
                     "$set": {
                         "description": description,
-                        "timestamp": int(time.time()),
-                        "hash": image_hash,  # 确保hash字段存在
-                        "type": description_type,  # 确保type字段存在
+                        "timestamp": now,
+                        "hash": image_hash,
+                        "type": description_type,
                     }
                 },
                 upsert=True,
             )
+            for image_hash, description in descriptions.items()
+        ]
+        try:
+            db.image_descriptions.bulk_write(operations, ordered=False)
         except Exception as e:
-            logger.error(f"保存描述到数据库失败: {str(e)}")
+            logger.error(f"批量保存描述到数据库失败: {str(e)}")
+
+    def _save_image_file(
+        self, image_bytes: bytes, image_hash: str, image_format: str, description: str, image_type: str
+    ) -> None:
+        """把图片保存到data/<类型>目录并记录到images集合
+
+        Args:
+            image_type: 图片类型 ('emoji' 或 'image')
+        """
+        word = "表情包" if image_type == "emoji" else "图片"
+        # 生成文件名和路径
+        timestamp = int(time.time())
+        filename = f"{timestamp}_{image_hash[:8]}.{image_format}"
+        if not os.path.exists(os.path.join(self.IMAGE_DIR, image_type)):
+            os.makedirs(os.path.join(self.IMAGE_DIR, image_type))
+        file_path = os.path.join(self.IMAGE_DIR, image_type, filename)
+
+        try:
+            # 保存文件
+            with open(file_path, "wb") as f:
+                f.write(image_bytes)
+
+            # 保存到数据库
+            image_doc = {
+                "hash": image_hash,
+                "path": file_path,
+                "type": image_type,
+                "description": description,
+                "timestamp": timestamp,
+            }
+            db.images.update_one({"hash": image_hash}, {"$set": image_doc}, upsert=True)
+            logger.success(f"保存{word}: {file_path}")
+        except Exception as e:
+            logger.error(f"保存{word}文件失败: {str(e)}")
 
     async def get_emoji_description(self, image_base64: str) -> str:
         """获取表情包描述，带查重和保存功能"""
@@ -103,7 +344,6 @@ class ImageManager:
             # 计算图片哈希
             image_bytes = base64.b64decode(image_base64)
             image_hash = hashlib.md5(image_bytes).hexdigest()
-            image_format = Image.open(io.BytesIO(image_bytes)).format.lower()
 
             # 查询缓存的描述
             cached_description = self._get_description_from_db(image_hash, "emoji")
@@ -111,54 +351,52 @@ class ImageManager:
                 logger.debug(f"缓存表情包描述: {cached_description}")
                 return f"[表情包：{cached_description}]"
 
-            # 调用AI获取描述
-            if image_format == "gif" or image_format == "GIF":
-                image_base64 = self.transform_gif(image_base64)
-                prompt = "这是一个动态图表情包，每一张图代表了动态图的某一帧，黑色背景代表透明，使用中文简洁的描述一下表情包的内容和表达的情感，简短一些"
-                description, _ = await self._llm.generate_response_for_image(prompt, image_base64, "jpg")
-            else:
-                prompt = "这是一个表情包，使用中文简洁的描述一下表情包的内容和表情包所表达的情感"
-                description, _ = await self._llm.generate_response_for_image(prompt, image_base64, image_format)
-
-            cached_description = self._get_description_from_db(image_hash, "emoji")
-            if cached_description:
-                logger.warning(f"虽然生成了描述，但是找到缓存表情包描述: {cached_description}")
-                return f"[表情包：{cached_description}]"
+            description = await self._describe_once(
+                image_hash, "emoji", lambda: self._generate_emoji_description(image_base64, image_bytes, image_hash)
+            )
+            return f"[表情包：{description}]"
+        except Exception as e:
+            logger.error(f"获取表情包描述失败: {str(e)}")
+            return "[表情包]"
 
-            # 根据配置决定是否保存图片
-            if global_config.EMOJI_SAVE:
-                # 生成文件名和路径
-                timestamp = int(time.time())
-                filename = f"{timestamp}_{image_hash[:8]}.{image_format}"
-                if not os.path.exists(os.path.join(self.IMAGE_DIR, "emoji")):
-                    os.makedirs(os.path.join(self.IMAGE_DIR, "emoji"))
-                file_path = os.path.join(self.IMAGE_DIR, "emoji", filename)
+    async def _generate_emoji_description(self, image_base64: str, image_bytes: bytes, image_hash: str) -> str:
+        """调用AI生成表情包描述并保存"""
+        image_format = await image_worker.detect_format(image_bytes)
+        if image_format is None:
+            raise ValueError("无法识别的图片格式")
+
+        image_dhash, similar = await self.find_similar(image_bytes, "emoji")
+        if similar:
+            logger.debug(f"复用相似表情包的描述: {similar[1]}")
+            self._save_description_to_db(image_hash, similar[1], "emoji", image_dhash)
+            return similar[1]
+
+        # 调用AI获取描述
+        if image_format == "gif":
+            strip = await image_worker.sample_gif_frames(image_bytes)
+            prompt = "这是一个动态图表情包，每一张图代表了动态图的某一帧，黑色背景代表透明，使用中文简洁的描述一下表情包的内容和表达的情感，简短一些"
+            description, _ = await self._llm.generate_response_for_image(
+                prompt, base64.b64encode(strip).decode("utf-8"), "jpg", image_bytes=strip
+            )
+        else:
+            prompt = "这是一个表情包，使用中文简洁的描述一下表情包的内容和表情包所表达的情感"
+            description, _ = await self._llm.generate_response_for_image(
+                prompt, image_base64, image_format, image_bytes=image_bytes
+            )
 
-                try:
-                    # 保存文件
-                    with open(file_path, "wb") as f:
-                        f.write(image_bytes)
+        cached_description = self._get_description_from_db(image_hash, "emoji")
+        if cached_description:
+            logger.warning(f"虽然生成了描述，但是找到缓存表情包描述: {cached_description}")
+            return cached_description
 
-                    # 保存到数据库
-                    image_doc = {
-                        "hash": image_hash,
-                        "path": file_path,
-                        "type": "emoji",
-                        "description": description,
-                        "timestamp": timestamp,
-                    }
-                    db.images.update_one({"hash": image_hash}, {"$set": image_doc}, upsert=True)
-                    logger.success(f"保存表情包: {file_path}")
-                except Exception as e:
-                    logger.error(f"保存表情包文件失败: {str(e)}")
+        # 根据配置决定是否保存图片
+        if global_config.EMOJI_SAVE:
+            self._save_image_file(image_bytes, image_hash, image_format, description, "emoji")
 
-            # 保存描述到数据库
-            self._save_description_to_db(image_hash, description, "emoji")
+        # 保存描述到数据库
+        self._save_description_to_db(image_hash, description, "emoji", image_dhash)
 
-            return f"[表情包：{description}]"
-        except Exception as e:
-            logger.error(f"获取表情包描述失败: {str(e)}")
-            return "[表情包]"
+        return description
 
     async def get_image_description(self, image_base64: str) -> str:
         """获取普通图片描述，带查重和保存功能"""
@@ -166,7 +404,6 @@ class ImageManager:
             # 计算图片哈希
             image_bytes = base64.b64decode(image_base64)
             image_hash = hashlib.md5(image_bytes).hexdigest()
-            image_format = Image.open(io.BytesIO(image_bytes)).format.lower()
 
             # 查询缓存的描述
             cached_description = self._get_description_from_db(image_hash, "image")
@@ -174,124 +411,174 @@ class ImageManager:
                 logger.debug(f"图片描述缓存中 {cached_description}")
                 return f"[图片：{cached_description}]"
 
-            # 调用AI获取描述
-            prompt = (
-                "请用中文描述这张图片的内容。如果有文字，请把文字都描述出来。并尝试猜测这个图片的含义。最多100个字。"
+            description = await self._describe_once(
+                image_hash, "image", lambda: self._generate_image_description(image_base64, image_bytes, image_hash)
             )
-            description, _ = await self._llm.generate_response_for_image(prompt, image_base64, image_format)
-
-            cached_description = self._get_description_from_db(image_hash, "image")
-            if cached_description:
-                logger.warning(f"虽然生成了描述，但是找到缓存图片描述 {cached_description}")
-                return f"[图片：{cached_description}]"
-
-            logger.debug(f"描述是{description}")
-
             if description is None:
-                logger.warning("AI未能生成图片描述")
                 return "[图片]"
-
-            # 根据配置决定是否保存图片
-            if global_config.EMOJI_SAVE:
-                # 生成文件名和路径
-                timestamp = int(time.time())
-                filename = f"{timestamp}_{image_hash[:8]}.{image_format}"
-                if not os.path.exists(os.path.join(self.IMAGE_DIR, "image")):
-                    os.makedirs(os.path.join(self.IMAGE_DIR, "image"))
-                file_path = os.path.join(self.IMAGE_DIR, "image", filename)
-
-                try:
-                    # 保存文件
-                    with open(file_path, "wb") as f:
-                        f.write(image_bytes)
-
-                    # 保存到数据库
-                    image_doc = {
-                        "hash": image_hash,
-                        "path": file_path,
-                        "type": "image",
-                        "description": description,
-                        "timestamp": timestamp,
-                    }
-                    db.images.update_one({"hash": image_hash}, {"$set": image_doc}, upsert=True)
-                    logger.success(f"保存图片: {file_path}")
-                except Exception as e:
-                    logger.error(f"保存图片文件失败: {str(e)}")
-
-            # 保存描述到数据库
-            self._save_description_to_db(image_hash, description, "image")
-
             return f"[图片：{description}]"
         except Exception as e:
             logger.error(f"获取图片描述失败: {str(e)}")
             return "[图片]"
 
-    def transform_gif(self, gif_base64: str) -> str:
-        """将GIF转换为水平拼接的静态图像
-
-        Args:
-            gif_base64: GIF的base64编码字符串
-
-        Returns:
-            str: 拼接后的JPG图像的base64编码字符串
-        """
-        try:
-            # 解码base64
-            gif_data = base64.b64decode(gif_base64)
-            gif = Image.open(io.BytesIO(gif_data))
-
-            # 收集所有帧
-            frames = []
-            try:
-                while True:
-                    gif.seek(len(frames))
-                    frame = gif.convert("RGB")
-                    frames.append(frame.copy())
-            except EOFError:
-                pass
-
-            if not frames:
-                raise ValueError("No frames found in GIF")
-
-            # 计算需要抽取的帧的索引
-            total_frames = len(frames)
-            if total_frames <= 15:
-                selected_frames = frames
-            else:
-                # 均匀抽取10帧
-                indices = [int(i * (total_frames - 1) / 14) for i in range(15)]
-                selected_frames = [frames[i] for i in indices]
-
-            # 获取单帧的尺寸
-            frame_width, frame_height = selected_frames[0].size
+    async def _generate_image_description(
+        self, image_base64: str, image_bytes: bytes, image_hash: str
+    ) -> Optional[str]:
+        """调用AI生成图片描述并保存，生成失败时返回None"""
+        image_format = await image_worker.detect_format(image_bytes)
+        if image_format is None:
+            raise ValueError("无法识别的图片格式")
+
+        image_dhash, similar = await self.find_similar(image_bytes, "image")
+        if similar:
+            logger.debug(f"复用相似图片的描述: {similar[1]}")
+            self._save_description_to_db(image_hash, similar[1], "image", image_dhash)
+            return similar[1]
+
+        # 调用AI获取描述
+        prompt = "请用中文描述这张图片的内容。如果有文字，请把文字都描述出来。并尝试猜测这个图片的含义。最多100个字。"
+        description, _ = await self._llm.generate_response_for_image(
+            prompt, image_base64, image_format, image_bytes=image_bytes
+        )
+
+        cached_description = self._get_description_from_db(image_hash, "image")
+        if cached_description:
+            logger.warning(f"虽然生成了描述，但是找到缓存图片描述 {cached_description}")
+            return cached_description
+
+        logger.debug(f"描述是{description}")
+
+        if description is None:
+            logger.warning("AI未能生成图片描述")
+            return None
 
-            # 计算目标尺寸，保持宽高比
-            target_height = 200  # 固定高度
-            target_width = int((target_height / frame_height) * frame_width)
+        # 根据配置决定是否保存图片
+        if global_config.EMOJI_SAVE:
+            self._save_image_file(image_bytes, image_hash, image_format, description, "image")
 
-            # 调整所有帧的大小
-            resized_frames = [
-                frame.resize((target_width, target_height), Image.Resampling.LANCZOS) for frame in selected_frames
-            ]
+        # 保存描述到数据库
+        self._save_description_to_db(image_hash, description, "image", image_dhash)
 
-            # 创建拼接图像
-            total_width = target_width * len(resized_frames)
-            combined_image = Image.new("RGB", (total_width, target_height))
+        return description
 
-            # 水平拼接图像
-            for idx, frame in enumerate(resized_frames):
-                combined_image.paste(frame, (idx * target_width, 0))
+    async def prefetch_image_descriptions(self, images_base64: List[str]) -> None:
+        """为同一条消息中的多张图片预先生成描述
 
-            # 转换为base64
-            buffer = io.BytesIO()
-            combined_image.save(buffer, format="JPEG", quality=85)
-            result_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+        还没有描述的图片合并到同一个视觉请求中（每批最多batch_describe_size张），要求模型按顺序输出JSON，
+        解析后按图片哈希分别写入缓存，之后逐张调用get_image_description时直接命中缓存。
+        批量请求失败或某张图片没有被解析出来时，这些图片退回单张生成。
+        """
+        try:
+            pending: Dict[str, Tuple[str, bytes]] = {}
+            for image_base64 in images_base64:
+                try:
+                    image_bytes = base64.b64decode(image_base64)
+                except Exception:
+                    continue
+                image_hash = hashlib.md5(image_bytes).hexdigest()
+                if (
+                    image_hash in pending
+                    or (image_hash, "image") in self._inflight
+                    or self._get_description_from_db(image_hash, "image")
+                ):
+                    continue
+                pending[image_hash] = (image_base64, image_bytes)
+            # 只有一张时走普通的单张流程
+            if len(pending) < 2:
+                return
+
+            items = list(pending.items())
+            size = self.batch_describe_size
+            await asyncio.gather(*(self._describe_batch(items[i : i + size]) for i in range(0, len(items), size)))
+        except Exception as e:
+            logger.error(f"预先获取图片描述失败: {str(e)}")
 
-            return result_base64
+    async def _describe_batch(self, items: List[Tuple[str, Tuple[str, bytes]]]) -> None:
+        """批量生成描述，结束后把结果交给等待同一图片的请求
 
+        在第一次await之前登记为正在生成，同一图片的其他请求会等待这次批量生成的结果；已经有请求在生成的图片跳过。
+        被取消时与_describe_once相同，等待者收到_DescribeCancelled后自己重新生成。
+        """
+        loop = asyncio.get_running_loop()
+        futures: Dict[str, asyncio.Future] = {}
+        for image_hash, _ in items:
+            if (image_hash, "image") not in self._inflight:
+                futures[image_hash] = self._inflight[(image_hash, "image")] = loop.create_future()
+        items = [item for item in items if item[0] in futures]
+        if not items:
+            return
+
+        descriptions: Dict[str, Optional[str]] = {}
+        try:
+            descriptions = await self._generate_image_descriptions(items)
+        except asyncio.CancelledError:
+            for future in futures.values():
+                future.set_exception(_DescribeCancelled())
+                future.exception()  # 没有等待者时避免报未处理异常
+            raise
         except Exception as e:
-            logger.error(f"GIF转换失败: {str(e)}")
-            return None
+            logger.error(f"批量获取图片描述失败: {str(e)}")
+        finally:
+            for image_hash, future in futures.items():
+                del self._inflight[(image_hash, "image")]
+                if not future.done():
+                    future.set_result(descriptions.get(image_hash))
+
+    async def _generate_image_descriptions(
+        self, items: List[Tuple[str, Tuple[str, bytes]]]
+    ) -> Dict[str, Optional[str]]:
+        """调用AI一次生成多张图片的描述并保存，返回 图片哈希 -> 描述（失败时为None）"""
+        results: Dict[str, Optional[str]] = {}
+        formats = await asyncio.gather(*(image_worker.detect_format(data) for _, (_, data) in items))
+        similars = await asyncio.gather(*(self.find_similar(data, "image") for _, (_, data) in items))
+
+        to_describe = []
+        for (image_hash, (image_base64, image_bytes)), image_format, (image_dhash, similar) in zip(
+            items, formats, similars
+        ):
+            if image_format is None:
+                results[image_hash] = None
+            elif similar:
+                logger.debug(f"复用相似图片的描述: {similar[1]}")
+                self._save_description_to_db(image_hash, similar[1], "image", image_dhash)
+                results[image_hash] = similar[1]
+            else:
+                to_describe.append((image_hash, image_base64, image_bytes, image_format, image_dhash))
+
+        remaining = to_describe
+        if len(to_describe) > 1:
+            prompt = BATCH_IMAGE_PROMPT.format(count=len(to_describe))
+            try:
+                content, _ = await self._batch_llm.generate_response_for_images(
+                    prompt, [(image_base64, image_format) for _, image_base64, _, image_format, _ in to_describe]
+                )
+                parsed = parse_batch_descriptions(content, len(to_describe))
+            except Exception as e:
+                logger.warning(f"批量生成图片描述失败，改为逐张生成: {str(e)}")
+                parsed = {}
+
+            remaining = []
+            for i, (image_hash, image_base64, image_bytes, image_format, image_dhash) in enumerate(to_describe):
+                description = parsed.get(i)
+                if description is None:
+                    remaining.append((image_hash, image_base64, image_bytes, image_format, image_dhash))
+                    continue
+                if global_config.EMOJI_SAVE:
+                    self._save_image_file(image_bytes, image_hash, image_format, description, "image")
+                self._save_description_to_db(image_hash, description, "image", image_dhash)
+                results[image_hash] = description
+            logger.debug(f"一次请求生成了 {len(to_describe) - len(remaining)}/{len(to_describe)} 张图片的描述")
+
+        singles = await asyncio.gather(
+            *(
+                self._generate_image_description(image_base64, image_bytes, image_hash)
+                for image_hash, image_base64, image_bytes, _, _ in remaining
+            ),
+            return_exceptions=True,
+        )
+        for (image_hash, *_), description in zip(remaining, singles):
+            results[image_hash] = None if isinstance(description, BaseException) else description
+        return results
 
 
 # 创建全局单例
@@ -1,7 +1,7 @@
 from src.common.logger import get_module_logger
 from src.plugins.chat.message import MessageRecv
 from src.plugins.storage.storage import MessageStorage
-from src.plugins.config.config import global_config
+from src.plugins.chat.message_matcher import message_matcher
 from datetime import datetime
 
 logger = get_module_logger("pfc_message_processor")
@@ -15,24 +15,20 @@ class MessageProcessor:
 
     def _check_ban_words(self, text: str, chat, userinfo) -> bool:
         """检查消息中是否包含过滤词"""
-        for word in global_config.ban_words:
-            if word in text:
-                logger.info(
-                    f"[{chat.group_info.group_name if chat.group_info else '私聊'}]{userinfo.user_nickname}:{text}"
-                )
-                logger.info(f"[过滤词识别]消息中含有{word}，filtered")
-                return True
+        word = message_matcher.find_ban_word(text)
+        if word is not None:
+            logger.info(f"[{chat.group_info.group_name if chat.group_info else '私聊'}]{userinfo.user_nickname}:{text}")
+            logger.info(f"[过滤词识别]消息中含有{word}，filtered")
+            return True
         return False
 
     def _check_ban_regex(self, text: str, chat, userinfo) -> bool:
         """检查消息是否匹配过滤正则表达式"""
-        for pattern in global_config.ban_msgs_regex:
-            if pattern.search(text):
-                logger.info(
-                    f"[{chat.group_info.group_name if chat.group_info else '私聊'}]{userinfo.user_nickname}:{text}"
-                )
-                logger.info(f"[正则表达式过滤]消息匹配到{pattern}，filtered")
-                return True
+        pattern = message_matcher.find_ban_regex(text)
+        if pattern is not None:
+            logger.info(f"[{chat.group_info.group_name if chat.group_info else '私聊'}]{userinfo.user_nickname}:{text}")
+            logger.info(f"[正则表达式过滤]消息匹配到{pattern}，filtered")
+            return True
         return False
 
     async def process_message(self, message: MessageRecv) -> None:
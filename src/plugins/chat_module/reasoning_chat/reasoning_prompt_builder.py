@@ -1,10 +1,17 @@
+import asyncio
 import random
 import time
 from typing import Optional, Union
 
-from ....common.database import db
-from ...chat.utils import get_embedding, get_recent_group_detailed_plain_text, get_recent_group_speaker
+from ....common.knowledge_index import knowledge_index
+from ...chat.utils import (
+    get_embedding,
+    get_embeddings,
+    get_recent_group_detailed_plain_text,
+    get_recent_group_speaker,
+)
 from ...chat.chat_stream import chat_manager
+from ...chat.message_matcher import message_matcher
 from ...moods.moods import MoodManager
 from ....individuality.individuality import Individuality
 from ...memory_system.Hippocampus import HippocampusManager
@@ -13,6 +20,7 @@ from ...config.config import global_config
 from ...person_info.relationship_manager import relationship_manager
 from src.common.logger import get_module_logger
 from src.plugins.utils.prompt_builder import Prompt, global_prompt_manager
+from src.plugins.utils.stage_runner import Stage, run_stages
 
 logger = get_module_logger("prompt")
 
@@ -48,6 +56,9 @@ def init_prompt():
 
 
 class PromptBuilder:
+    # 构建prompt各阶段的超时时间（秒）
+    STAGE_TIMEOUTS = {"speakers": 3, "relation": 5, "memory": 20, "chat_talking": 5, "knowledge": 15, "schedule": 3}
+
     def __init__(self):
         self.prompt_built = ""
         self.activate_messages = ""
@@ -71,85 +82,66 @@ class PromptBuilder:
         random.shuffle(identity_detail)
         prompt_personality += f",{identity_detail[0]}"
 
-        # 关系
-        who_chat_in_group = [
-            (chat_stream.user_info.platform, chat_stream.user_info.user_id, chat_stream.user_info.user_nickname)
-        ]
-        who_chat_in_group += get_recent_group_speaker(
-            stream_id,
-            (chat_stream.user_info.platform, chat_stream.user_info.user_id),
-            limit=global_config.MAX_CONTEXT_SIZE,
+        # 获取聊天类型
+        chat_in_group = True
+        if stream_id:
+            chat_in_group = bool(chat_manager.get_stream(stream_id).group_info)
+
+        # 记忆、聊天记录、知识、日程和最近发言者互不依赖，同时获取；关系在最近发言者之后获取。
+        # 某个阶段超时或出错时使用空内容
+        timeouts = self.STAGE_TIMEOUTS
+        timings = {}
+        stage_results = await run_stages(
+            [
+                Stage(
+                    "speakers",
+                    lambda: self._get_recent_speakers(chat_stream, stream_id),
+                    timeout=timeouts["speakers"],
+                    fallback=[],
+                ),
+                Stage(
+                    "relation",
+                    lambda speakers: self._build_relation_prompt(chat_stream, speakers),
+                    deps=("speakers",),
+                    timeout=timeouts["relation"],
+                    fallback="",
+                ),
+                Stage(
+                    "memory",
+                    lambda: self._build_memory_prompt(message_txt),
+                    timeout=timeouts["memory"],
+                    fallback="",
+                ),
+                Stage(
+                    "chat_talking",
+                    lambda: self._get_chat_talking_prompt(stream_id),
+                    timeout=timeouts["chat_talking"],
+                    fallback="",
+                ),
+                Stage(
+                    "knowledge",
+                    lambda: self._build_knowledge_prompt(message_txt),
+                    timeout=timeouts["knowledge"],
+                    fallback="",
+                ),
+                Stage(
+                    "schedule",
+                    self._build_schedule_prompt,
+                    timeout=timeouts["schedule"],
+                    fallback="",
+                ),
+            ],
+            timings,
         )
-
-        relation_prompt = ""
-        for person in who_chat_in_group:
-            relation_prompt += await relationship_manager.build_relationship_info(person)
-
-        # relation_prompt_all = (
-        #     f"{relation_prompt}关系等级越大，关系越好，请分析聊天记录，"
-        #     f"根据你和说话者{sender_name}的关系和态度进行回复，明确你的立场和情感。"
-        # )
+        logger.debug("prompt各阶段耗时: " + "，".join(f"{name} {elapsed:.3f}秒" for name, elapsed in timings.items()))
 
         # 心情
-        mood_manager = MoodManager.get_instance()
-        mood_prompt = mood_manager.get_prompt()
-
-        # logger.info(f"心情prompt: {mood_prompt}")
-
-        # 调取记忆
-        memory_prompt = ""
-        related_memory = await HippocampusManager.get_instance().get_memory_from_text(
-            text=message_txt, max_memory_num=2, max_memory_length=2, max_depth=3, fast_retrieval=False
-        )
-        if related_memory:
-            related_memory_info = ""
-            for memory in related_memory:
-                related_memory_info += memory[1]
-            # memory_prompt = f"你想起你之前见过的事情：{related_memory_info}。\n以上是你的回忆，不一定是目前聊天里的人说的，也不一定是现在发生的事情，请记住。\n"
-            memory_prompt = await global_prompt_manager.format_prompt(
-                "memory_prompt", related_memory_info=related_memory_info
-            )
-        else:
-            related_memory_info = ""
-
-        # print(f"相关记忆：{related_memory_info}")
+        mood_prompt = MoodManager.get_instance().get_prompt()
 
-        # 日程构建
-        # schedule_prompt = f"""你现在正在做的事情是：{bot_schedule.get_current_num_task(num=1, time_info=False)}"""
-
-        # 获取聊天上下文
-        chat_in_group = True
-        chat_talking_prompt = ""
-        if stream_id:
-            chat_talking_prompt = get_recent_group_detailed_plain_text(
-                stream_id, limit=global_config.MAX_CONTEXT_SIZE, combine=True
-            )
-            chat_stream = chat_manager.get_stream(stream_id)
-            if chat_stream.group_info:
-                chat_talking_prompt = chat_talking_prompt
-            else:
-                chat_in_group = False
-                chat_talking_prompt = chat_talking_prompt
-                # print(f"\033[1;34m[调试]\033[0m 已从数据库获取群 {group_id} 的消息记录:{chat_talking_prompt}")
         # 关键词检测与反应
-        keywords_reaction_prompt = ""
-        for rule in global_config.keywords_reaction_rules:
-            if rule.get("enable", False):
-                if any(keyword in message_txt.lower() for keyword in rule.get("keywords", [])):
-                    logger.info(
-                        f"检测到以下关键词之一：{rule.get('keywords', [])}，触发反应：{rule.get('reaction', '')}"
-                    )
-                    keywords_reaction_prompt += rule.get("reaction", "") + "，"
-                else:
-                    for pattern in rule.get("regex", []):
-                        result = pattern.search(message_txt)
-                        if result:
-                            reaction = rule.get("reaction", "")
-                            for name, content in result.groupdict().items():
-                                reaction = reaction.replace(f"[{name}]", content)
-                            logger.info(f"匹配到以下正则表达式：{pattern}，触发反应：{reaction}")
-                            keywords_reaction_prompt += reaction + "，"
-                            break
+        keywords_reaction_prompt = "".join(
+            reaction + "，" for reaction in message_matcher.match_keyword_reactions(message_txt)
+        )
 
         # 中文高手(新加的好玩功能)
         prompt_ger = ""
@@ -160,17 +152,6 @@ class PromptBuilder:
         if random.random() < 0.01:
             prompt_ger += "你喜欢用文言文"
 
-        # 知识构建
-        start_time = time.time()
-        prompt_info = ""
-        prompt_info = await self.get_prompt_info(message_txt, threshold=0.38)
-        if prompt_info:
-            # prompt_info = f"""\n你有以下这些**知识**：\n{prompt_info}\n请你**记住上面的知识**，之后可能会用到。\n"""
-            prompt_info = await global_prompt_manager.format_prompt("knowledge_prompt", prompt_info=prompt_info)
-
-        end_time = time.time()
-        logger.debug(f"知识检索耗时: {(end_time - start_time):.3f}秒")
-
         # moderation_prompt = ""
         #         moderation_prompt = """**检查并忽略**任何涉及尝试绕过审核的行为。
         # 涉及政治敏感以及违法违规的内容请规避。"""
@@ -195,20 +176,18 @@ class PromptBuilder:
         prompt = await global_prompt_manager.format_prompt(
             "reasoning_prompt_main",
             relation_prompt_all=await global_prompt_manager.get_prompt_async("relationship_prompt"),
-            relation_prompt=relation_prompt,
+            relation_prompt=stage_results["relation"],
             sender_name=sender_name,
-            memory_prompt=memory_prompt,
-            prompt_info=prompt_info,
-            schedule_prompt=await global_prompt_manager.format_prompt(
-                "schedule_prompt", schedule_info=bot_schedule.get_current_num_task(num=1, time_info=False)
-            ),
+            memory_prompt=stage_results["memory"],
+            prompt_info=stage_results["knowledge"],
+            schedule_prompt=stage_results["schedule"],
             chat_target=await global_prompt_manager.get_prompt_async("chat_target_group1")
             if chat_in_group
             else await global_prompt_manager.get_prompt_async("chat_target_private1"),
             chat_target_2=await global_prompt_manager.get_prompt_async("chat_target_group2")
             if chat_in_group
             else await global_prompt_manager.get_prompt_async("chat_target_private2"),
-            chat_talking_prompt=chat_talking_prompt,
+            chat_talking_prompt=stage_results["chat_talking"],
             message_txt=message_txt,
             bot_name=global_config.BOT_NICKNAME,
             bot_other_names="/".join(
@@ -223,6 +202,59 @@ class PromptBuilder:
 
         return prompt
 
+    async def _build_schedule_prompt(self) -> str:
+        """当前日程，只在日程有新进展时重新格式化"""
+        done_list = bot_schedule.today_done_list
+        key = (id(done_list), len(done_list), done_list[-1] if done_list else None)
+        return await global_prompt_manager.get_fragment(
+            "schedule_prompt",
+            key,
+            lambda: global_prompt_manager.format_prompt(
+                "schedule_prompt", schedule_info=bot_schedule.get_current_num_task(num=1, time_info=False)
+            ),
+        )
+
+    async def _get_recent_speakers(self, chat_stream, stream_id: Optional[int]) -> list:
+        """最近发言的其他用户"""
+        return await asyncio.to_thread(
+            get_recent_group_speaker,
+            stream_id,
+            (chat_stream.user_info.platform, chat_stream.user_info.user_id),
+            limit=global_config.MAX_CONTEXT_SIZE,
+        )
+
+    async def _build_relation_prompt(self, chat_stream, speakers: list) -> str:
+        """当前说话者和最近发言者的关系提示词"""
+        who_chat_in_group = [
+            (chat_stream.user_info.platform, chat_stream.user_info.user_id, chat_stream.user_info.user_nickname)
+        ]
+        return await relationship_manager.build_relationship_infos(who_chat_in_group + speakers)
+
+    async def _build_memory_prompt(self, message_txt: str) -> str:
+        """调取与消息相关的记忆"""
+        related_memory = await HippocampusManager.get_instance().get_memory_from_text(
+            text=message_txt, max_memory_num=2, max_memory_length=2, max_depth=3, fast_retrieval=False
+        )
+        if not related_memory:
+            return ""
+        related_memory_info = "".join(memory[1] for memory in related_memory)
+        return await global_prompt_manager.format_prompt("memory_prompt", related_memory_info=related_memory_info)
+
+    async def _get_chat_talking_prompt(self, stream_id: Optional[int]) -> str:
+        """最近的聊天记录"""
+        if not stream_id:
+            return ""
+        return await asyncio.to_thread(
+            get_recent_group_detailed_plain_text, stream_id, limit=global_config.MAX_CONTEXT_SIZE, combine=True
+        )
+
+    async def _build_knowledge_prompt(self, message_txt: str) -> str:
+        """知识库检索"""
+        prompt_info = await self.get_prompt_info(message_txt, threshold=0.38)
+        if not prompt_info:
+            return ""
+        return await global_prompt_manager.format_prompt("knowledge_prompt", prompt_info=prompt_info)
+
     async def get_prompt_info(self, message: str, threshold: float):
         start_time = time.time()
         related_info = ""
@@ -263,91 +295,59 @@ class PromptBuilder:
                 logger.error("获取消息嵌入向量失败")
                 return ""
 
-            related_info = self.get_info_from_db(embedding, limit=3, threshold=threshold)
+            related_info = await self.get_info_from_db(embedding, limit=3, threshold=threshold)
             logger.info(f"知识库检索完成，总耗时: {time.time() - start_time:.3f}秒")
             return related_info
 
-        # 2. 对每个主题进行知识库查询
+        # 2. 一次请求获取原始消息和所有主题的嵌入向量
+        labels, texts = [], []
+        if message and message.strip():
+            labels.append("原始消息")
+            texts.append(message)
+        for topic in topics:
+            if topic and topic.strip() and topic not in texts:
+                labels.append(topic)
+                texts.append(topic)
         logger.info(f"开始处理{len(topics)}个主题的知识库查询")
 
-        # 优化：批量获取嵌入向量，减少API调用
-        embeddings = {}
-        topics_batch = [topic for topic in topics if len(topic) > 0]
-        if message:  # 确保消息非空
-            topics_batch.append(message)
-
-        # 批量获取嵌入向量
         embed_start_time = time.time()
-        for text in topics_batch:
-            if not text or len(text.strip()) == 0:
-                continue
-
-            try:
-                embedding = await get_embedding(text, request_type="prompt_build")
-                if embedding:
-                    embeddings[text] = embedding
-                else:
-                    logger.warning(f"获取'{text}'的嵌入向量失败")
-            except Exception as e:
-                logger.error(f"获取'{text}'的嵌入向量时发生错误: {str(e)}")
-
+        embeddings = await get_embeddings(texts, request_type="prompt_build")
         logger.info(f"批量获取嵌入向量完成，耗时: {time.time() - embed_start_time:.3f}秒")
 
         if not embeddings:
             logger.error("所有嵌入向量获取失败")
             return ""
 
-        # 3. 对每个主题进行知识库查询
-        all_results = []
+        # 3. 所有查询一起检索，同一条知识只归入相似度最高的查询
         query_start_time = time.time()
-
-        # 首先添加原始消息的查询结果
-        if message in embeddings:
-            original_results = self.get_info_from_db(embeddings[message], limit=3, threshold=threshold, return_raw=True)
-            if original_results:
-                for result in original_results:
-                    result["topic"] = "原始消息"
-                all_results.extend(original_results)
-                logger.info(f"原始消息查询到{len(original_results)}条结果")
-
-        # 然后添加每个主题的查询结果
-        for topic in topics:
-            if not topic or topic not in embeddings:
-                continue
-
-            try:
-                topic_results = self.get_info_from_db(embeddings[topic], limit=3, threshold=threshold, return_raw=True)
-                if topic_results:
-                    # 添加主题标记
-                    for result in topic_results:
-                        result["topic"] = topic
-                    all_results.extend(topic_results)
-                    logger.info(f"主题'{topic}'查询到{len(topic_results)}条结果")
-            except Exception as e:
-                logger.error(f"查询主题'{topic}'时发生错误: {str(e)}")
+        grouped = await knowledge_index.search_documents_many_async(embeddings, limit=3, threshold=threshold)
+        all_results = []
+        for label, results in zip(labels, grouped):
+            for result in results:
+                result["topic"] = label
+            all_results.extend(results)
+            if results:
+                logger.info(f"{label}查询到{len(results)}条结果")
 
         logger.info(f"知识库查询完成，耗时: {time.time() - query_start_time:.3f}秒，共获取{len(all_results)}条结果")
 
-        # 4. 去重和过滤
+        # 4. 按相似度排序，去除内容重复的知识
         process_start_time = time.time()
         unique_contents = set()
         filtered_results = []
-        for result in all_results:
+        for result in sorted(all_results, key=lambda x: x["similarity"], reverse=True):
             content = result["content"]
             if content not in unique_contents:
                 unique_contents.add(content)
                 filtered_results.append(result)
 
-        # 5. 按相似度排序
-        filtered_results.sort(key=lambda x: x["similarity"], reverse=True)
-
-        # 6. 限制总数量（最多10条）
+        # 5. 限制总数量（最多10条）
         filtered_results = filtered_results[:10]
         logger.info(
             f"结果处理完成，耗时: {time.time() - process_start_time:.3f}秒，过滤后剩余{len(filtered_results)}条结果"
         )
 
-        # 7. 格式化输出
+        # 6. 格式化输出
         if filtered_results:
             format_start_time = time.time()
             grouped_results = {}
@@ -373,64 +373,12 @@ class PromptBuilder:
         logger.info(f"知识库检索总耗时: {time.time() - start_time:.3f}秒")
         return related_info
 
-    def get_info_from_db(
+    async def get_info_from_db(
         self, query_embedding: list, limit: int = 1, threshold: float = 0.5, return_raw: bool = False
     ) -> Union[str, list]:
         if not query_embedding:
             return "" if not return_raw else []
-        # 使用余弦相似度计算
-        pipeline = [
-            {
-                "$addFields": {
-                    "dotProduct": {
-                        "$reduce": {
-                            "input": {"$range": [0, {"$size": "$embedding"}]},
-                            "initialValue": 0,
-                            "in": {
-                                "$add": [
-                                    "$$value",
-                                    {
-                                        "$multiply": [
-                                            {"$arrayElemAt": ["$embedding", "$$this"]},
-                                            {"$arrayElemAt": [query_embedding, "$$this"]},
-                                        ]
-                                    },
-                                ]
-                            },
-                        }
-                    },
-                    "magnitude1": {
-                        "$sqrt": {
-                            "$reduce": {
-                                "input": "$embedding",
-                                "initialValue": 0,
-                                "in": {"$add": ["$$value", {"$multiply": ["$$this", "$$this"]}]},
-                            }
-                        }
-                    },
-                    "magnitude2": {
-                        "$sqrt": {
-                            "$reduce": {
-                                "input": query_embedding,
-                                "initialValue": 0,
-                                "in": {"$add": ["$$value", {"$multiply": ["$$this", "$$this"]}]},
-                            }
-                        }
-                    },
-                }
-            },
-            {"$addFields": {"similarity": {"$divide": ["$dotProduct", {"$multiply": ["$magnitude1", "$magnitude2"]}]}}},
-            {
-                "$match": {
-                    "similarity": {"$gte": threshold}  # 只保留相似度大于等于阈值的结果
-                }
-            },
-            {"$sort": {"similarity": -1}},
-            {"$limit": limit},
-            {"$project": {"content": 1, "similarity": 1}},
-        ]
-
-        results = list(db.knowledges.aggregate(pipeline))
+        results = await knowledge_index.search_documents_async(query_embedding, limit=limit, threshold=threshold)
         logger.debug(f"知识库查询结果数量: {len(results)}")
 
         if not results:
@@ -14,11 +14,13 @@ from ...chat.utils import is_mentioned_bot_in_message, get_recent_group_detailed
 from ...chat.utils_image import image_path_to_base64
 from ...willing.willing_manager import willing_manager
 from ...message import UserInfo, Seg
+from ...message.ingress import release_ingress_slot
 from src.heart_flow.heartflow import heartflow
 from src.common.logger import get_module_logger, CHAT_STYLE_CONFIG, LogConfig
 from ...chat.chat_stream import chat_manager
 from ...person_info.relationship_manager import relationship_manager
 from ...chat.message_buffer import message_buffer
+from ...chat.message_matcher import message_matcher
 from src.plugins.respon_info_catcher.info_catcher import info_catcher_manager
 from ...utils.timer_calculater import Timer
 from src.do_tool.tool_use import ToolUser
@@ -65,13 +67,7 @@ class ThinkFlowChat:
     async def _send_response_messages(self, message, chat, response_set: List[str], thinking_id) -> MessageSending:
         """发送回复消息"""
         container = message_manager.get_container(chat.stream_id)
-        thinking_message = None
-
-        for msg in container.messages:
-            if isinstance(msg, MessageThinking) and msg.message_info.message_id == thinking_id:
-                thinking_message = msg
-                container.messages.remove(msg)
-                break
+        thinking_message = container.pop_thinking_message(thinking_id)
 
         if not thinking_message:
             logger.warning("未找到对应的思考消息，可能已超时被移除")
@@ -182,6 +178,8 @@ class ThinkFlowChat:
         logger.trace(f"过滤词/正则表达式过滤成功{message.processed_plain_text}")
 
         await self.storage.store_message(message, chat)
+        # 消息已存储，之后的缓冲等待和回复生成不再占用入站管线的槽位
+        release_ingress_slot()
         logger.trace(f"存储成功{message.processed_plain_text}")
 
         # 记忆激活
@@ -410,22 +408,18 @@ class ThinkFlowChat:
 
     def _check_ban_words(self, text: str, chat, userinfo) -> bool:
         """检查消息中是否包含过滤词"""
-        for word in global_config.ban_words:
-            if word in text:
-                logger.info(
-                    f"[{chat.group_info.group_name if chat.group_info else '私聊'}]{userinfo.user_nickname}:{text}"
-                )
-                logger.info(f"[过滤词识别]消息中含有{word}，filtered")
-                return True
+        word = message_matcher.find_ban_word(text)
+        if word is not None:
+            logger.info(f"[{chat.group_info.group_name if chat.group_info else '私聊'}]{userinfo.user_nickname}:{text}")
+            logger.info(f"[过滤词识别]消息中含有{word}，filtered")
+            return True
         return False
 
     def _check_ban_regex(self, text: str, chat, userinfo) -> bool:
         """检查消息是否匹配过滤正则表达式"""
-        for pattern in global_config.ban_msgs_regex:
-            if pattern.search(text):
-                logger.info(
-                    f"[{chat.group_info.group_name if chat.group_info else '私聊'}]{userinfo.user_nickname}:{text}"
-                )
-                logger.info(f"[正则表达式过滤]消息匹配到{pattern}，filtered")
-                return True
+        pattern = message_matcher.find_ban_regex(text)
+        if pattern is not None:
+            logger.info(f"[{chat.group_info.group_name if chat.group_info else '私聊'}]{userinfo.user_nickname}:{text}")
+            logger.info(f"[正则表达式过滤]消息匹配到{pattern}，filtered")
+            return True
         return False
@@ -1,13 +1,16 @@
+import asyncio
 import random
 from typing import Optional
 
 from ...config.config import global_config
 from ...chat.utils import get_recent_group_detailed_plain_text
 from ...chat.chat_stream import chat_manager
+from ...chat.message_matcher import message_matcher
 from src.common.logger import get_module_logger
 from ....individuality.individuality import Individuality
 from src.heart_flow.heartflow import heartflow
 from src.plugins.utils.prompt_builder import Prompt, global_prompt_manager
+from src.plugins.utils.timer_calculater import Timer
 
 logger = get_module_logger("prompt")
 
@@ -58,6 +61,9 @@ def init_prompt():
 
 
 class PromptBuilder:
+    # 读取聊天记录的超时时间（秒）
+    CHAT_TALKING_TIMEOUT = 5
+
     def __init__(self):
         self.prompt_built = ""
         self.activate_messages = ""
@@ -74,20 +80,24 @@ class PromptBuilder:
         # 日程构建
         # schedule_prompt = f'''你现在正在做的事情是：{bot_schedule.get_current_num_task(num = 1,time_info = False)}'''
 
-        # 获取聊天上下文
+        # 获取聊天类型
         chat_in_group = True
-        chat_talking_prompt = ""
         if stream_id:
-            chat_talking_prompt = get_recent_group_detailed_plain_text(
-                stream_id, limit=global_config.MAX_CONTEXT_SIZE, combine=True
-            )
-            chat_stream = chat_manager.get_stream(stream_id)
-            if chat_stream.group_info:
-                chat_talking_prompt = chat_talking_prompt
-            else:
-                chat_in_group = False
-                chat_talking_prompt = chat_talking_prompt
-                # print(f"\033[1;34m[调试]\033[0m 已从数据库获取群 {group_id} 的消息记录:{chat_talking_prompt}")
+            chat_in_group = bool(chat_manager.get_stream(stream_id).group_info)
+
+        # 聊天记录在线程中从数据库读取，超时或出错时使用空内容
+        timings = {}
+        chat_talking_prompt = ""
+        try:
+            with Timer("chat_talking", timings):
+                chat_talking_prompt = await asyncio.wait_for(
+                    self._get_chat_talking_prompt(stream_id), self.CHAT_TALKING_TIMEOUT
+                )
+        except asyncio.TimeoutError:
+            logger.warning(f"读取聊天记录超过 {self.CHAT_TALKING_TIMEOUT} 秒未完成，使用空内容")
+        except Exception as e:
+            logger.error(f"读取聊天记录失败，使用空内容: {str(e)}")
+        logger.debug(f"读取聊天记录耗时: {timings['chat_talking']:.3f}秒")
 
         # 类型
         # if chat_in_group:
@@ -98,24 +108,9 @@ class PromptBuilder:
         #     chat_target_2 = f"和{sender_name}私聊"
 
         # 关键词检测与反应
-        keywords_reaction_prompt = ""
-        for rule in global_config.keywords_reaction_rules:
-            if rule.get("enable", False):
-                if any(keyword in message_txt.lower() for keyword in rule.get("keywords", [])):
-                    logger.info(
-                        f"检测到以下关键词之一：{rule.get('keywords', [])}，触发反应：{rule.get('reaction', '')}"
-                    )
-                    keywords_reaction_prompt += rule.get("reaction", "") + "，"
-                else:
-                    for pattern in rule.get("regex", []):
-                        result = pattern.search(message_txt)
-                        if result:
-                            reaction = rule.get("reaction", "")
-                            for name, content in result.groupdict().items():
-                                reaction = reaction.replace(f"[{name}]", content)
-                            logger.info(f"匹配到以下正则表达式：{pattern}，触发反应：{reaction}")
-                            keywords_reaction_prompt += reaction + "，"
-                            break
+        keywords_reaction_prompt = "".join(
+            reaction + "，" for reaction in message_matcher.match_keyword_reactions(message_txt)
+        )
 
         # 中文高手(新加的好玩功能)
         prompt_ger = ""
@@ -163,6 +158,14 @@ class PromptBuilder:
 
         return prompt
 
+    async def _get_chat_talking_prompt(self, stream_id: Optional[int]) -> str:
+        """最近的聊天记录"""
+        if not stream_id:
+            return ""
+        return await asyncio.to_thread(
+            get_recent_group_detailed_plain_text, stream_id, limit=global_config.MAX_CONTEXT_SIZE, combine=True
+        )
+
     async def _build_prompt_simple(
         self, chat_stream, message_txt: str, sender_name: str = "某人", stream_id: Optional[int] = None
     ) -> tuple[str, str]:
@@ -196,15 +199,8 @@ class PromptBuilder:
         # else:
         #     chat_target = f"你正在和{sender_name}聊天，这是你们之前聊的内容："
 
-        # 关键词检测与反应
-        keywords_reaction_prompt = ""
-        for rule in global_config.keywords_reaction_rules:
-            if rule.get("enable", False):
-                if any(keyword in message_txt.lower() for keyword in rule.get("keywords", [])):
-                    logger.info(
-                        f"检测到以下关键词之一：{rule.get('keywords', [])}，触发反应：{rule.get('reaction', '')}"
-                    )
-                    keywords_reaction_prompt += rule.get("reaction", "") + "，"
+        # 关键词检测，与原先一样只记录命中的规则，这个模板不使用关键词反应
+        message_matcher.match_keyword_reactions(message_txt, use_regex=False)
 
         logger.debug("开始构建prompt")
 
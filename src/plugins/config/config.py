@@ -223,6 +223,7 @@ class BotConfig:
     EMOJI_SAVE: bool = True  # 偷表情包
     EMOJI_CHECK: bool = False  # 是否开启过滤
     EMOJI_CHECK_PROMPT: str = "符合公序良俗"  # 表情包过滤要求
+    similar_image_distance: int = 5  # dHash汉明距离不超过该值的图片复用已有描述，负数关闭
 
     # memory
     build_memory_interval: int = 600  # 记忆构建间隔（秒）
@@ -268,6 +269,7 @@ class BotConfig:
     enable_friend_chat: bool = False  # 是否启用好友聊天
     # enable_think_flow: bool = False  # 是否启用思考流程
     enable_pfc_chatting: bool = False  # 是否启用PFC聊天
+    plot_habit_distribution: bool = False  # 是否输出用户消息间隔分布图
 
     # 模型配置
     llm_reasoning: Dict[str, str] = field(default_factory=lambda: {})
@@ -409,6 +411,10 @@ class BotConfig:
             if config.INNER_VERSION in SpecifierSet(">=1.1.1"):
                 config.max_emoji_num = emoji_config.get("max_emoji_num", config.max_emoji_num)
                 config.max_reach_deletion = emoji_config.get("max_reach_deletion", config.max_reach_deletion)
+            if config.INNER_VERSION in SpecifierSet(">=1.3.2"):
+                config.similar_image_distance = emoji_config.get(
+                    "similar_image_distance", config.similar_image_distance
+                )
 
         def bot(parent: dict):
             # 机器人基础配置
@@ -546,6 +552,11 @@ class BotConfig:
                             # 如果没有temp参数，就删除默认值
                             cfg_target.pop("temp", None)
 
+                        # 可选：发送给模型的图片的最大边长和最大字节数
+                        for i in ("max_image_side", "max_image_bytes"):
+                            if i in cfg_item:
+                                cfg_target[i] = cfg_item[i]
+
                         provider = cfg_item.get("provider")
                         if provider is None:
                             logger.error(f"provider 字段在模型配置 {item} 中不存在，请检查")
@@ -659,6 +670,10 @@ class BotConfig:
             # config.enable_think_flow = experimental_config.get("enable_think_flow", config.enable_think_flow)
             if config.INNER_VERSION in SpecifierSet(">=1.1.0"):
                 config.enable_pfc_chatting = experimental_config.get("pfc_chatting", config.enable_pfc_chatting)
+            if config.INNER_VERSION in SpecifierSet(">=1.3.1"):
+                config.plot_habit_distribution = experimental_config.get(
+                    "plot_habit_distribution", config.plot_habit_distribution
+                )
 
         # 版本表达式：>=1.0.0,<2.0.0
         # 允许字段：func: method, support: str, notice: str, necessary: bool
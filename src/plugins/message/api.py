@@ -3,7 +3,8 @@ from typing import Dict, Any, Callable, List, Set, Optional
 from src.common.logger import get_module_logger
 from src.plugins.message.message_base import MessageBase
 from src.common.server import global_server
-import aiohttp
+from src.plugins.message.ingress import IngressPipeline, IngressRejected, OVERFLOW_DROP_OLDEST
+from src.plugins.message.egress import OutboundDelivery, RetryableSendError, dumps_json, make_batch_frame
 import asyncio
 import uvicorn
 import os
@@ -57,6 +58,12 @@ class MessageServer(BaseMessageHandler):
         enable_token=False,
         app: Optional[FastAPI] = None,
         path: str = "/ws",
+        ingress_max_workers: int = 64,
+        ingress_max_inflight_per_chat: int = 1,
+        ingress_max_queue_per_chat: int = 100,
+        ingress_overflow_policy: str = OVERFLOW_DROP_OLDEST,
+        delivery_max_retries: int = 3,
+        delivery_max_batch_size: int = 20,
     ):
         super().__init__()
         # 将类级别的处理器添加到实例处理器中
@@ -68,8 +75,19 @@ class MessageServer(BaseMessageHandler):
         self.own_app = app is None  # 标记是否使用自己创建的app
         self.active_websockets: Set[WebSocket] = set()
         self.platform_websockets: Dict[str, WebSocket] = {}  # 平台到websocket的映射
+        self.batch_platforms: Set[str] = set()  # 声明支持批量帧的平台
         self.valid_tokens: Set[str] = set()
         self.enable_token = enable_token
+        # 入站管线：按聊天排队、限制并发，队列溢出时按策略降级
+        self.ingress = IngressPipeline(
+            self._handle_message,
+            max_workers=ingress_max_workers,
+            max_inflight_per_chat=ingress_max_inflight_per_chat,
+            max_queue_per_chat=ingress_max_queue_per_chat,
+            overflow_policy=ingress_overflow_policy,
+        )
+        # 出站投递层：按平台/端点排队发送，积压时合并为批量帧，失败重试
+        self.delivery = OutboundDelivery(max_retries=delivery_max_retries, max_batch_size=delivery_max_batch_size)
         self._setup_routes()
         self._running = False
 
@@ -77,9 +95,11 @@ class MessageServer(BaseMessageHandler):
         @self.app.post("/api/message")
         async def handle_message(message: Dict[str, Any]):
             try:
-                # 创建后台任务处理消息
-                asyncio.create_task(self._handle_message(message))
+                # 交给入站管线排队处理
+                self.ingress.submit(message)
                 return {"status": "success"}
+            except IngressRejected as e:
+                raise HTTPException(status_code=429, detail=str(e)) from e
             except Exception as e:
                 raise HTTPException(status_code=500, detail=str(e)) from e
 
@@ -88,6 +108,7 @@ class MessageServer(BaseMessageHandler):
             headers = dict(websocket.headers)
             token = headers.get("authorization")
             platform = headers.get("platform", "default")  # 获取platform标识
+            supports_batch = headers.get("message-batch", "").lower() in ("1", "true")  # 适配器是否能解析批量帧
             if self.enable_token:
                 if not token or not await self.verify_token(token):
                     await websocket.close(code=1008, reason="Invalid or missing token")
@@ -99,12 +120,19 @@ class MessageServer(BaseMessageHandler):
             # 添加到platform映射
             if platform not in self.platform_websockets:
                 self.platform_websockets[platform] = websocket
+                if supports_batch:
+                    self.batch_platforms.add(platform)
+                else:
+                    self.batch_platforms.discard(platform)
 
             try:
                 while True:
                     message = await websocket.receive_json()
                     # print(f"Received message: {message}")
-                    asyncio.create_task(self._handle_message(message))
+                    try:
+                        self.ingress.submit(message)
+                    except IngressRejected as e:
+                        logger.warning(f"拒绝入站消息: {str(e)}")
             except WebSocketDisconnect:
                 self._remove_websocket(websocket, platform)
             except Exception as e:
@@ -174,6 +202,10 @@ class MessageServer(BaseMessageHandler):
         # 清理platform映射
         self.platform_websockets.clear()
 
+        # 停止入站管线和出站投递
+        await self.ingress.stop()
+        await self.delivery.stop()
+
         # 取消所有后台任务
         for task in self.background_tasks:
             task.cancel()
@@ -204,43 +236,62 @@ class MessageServer(BaseMessageHandler):
         if platform in self.platform_websockets:
             if self.platform_websockets[platform] == websocket:
                 del self.platform_websockets[platform]
+                self.batch_platforms.discard(platform)
 
     async def broadcast_message(self, message: Dict[str, Any]):
         disconnected = set()
+        text = dumps_json(message)
         for websocket in self.active_websockets:
             try:
-                await websocket.send_json(message)
+                await websocket.send_text(text)
             except Exception:
                 disconnected.add(websocket)
         for websocket in disconnected:
             self.active_websockets.remove(websocket)
 
     async def broadcast_to_platform(self, platform: str, message: Dict[str, Any]):
-        """向指定平台的所有WebSocket客户端广播消息"""
-        if platform not in self.platform_websockets:
-            raise ValueError(f"平台：{platform} 未连接")
-
-        disconnected = set()
+        """向指定平台的WebSocket客户端发送消息，经出站投递层排队、合并和重试"""
+        await self.delivery.deliver(
+            f"ws:{platform}",
+            message,
+            lambda payloads: self._send_to_platform(platform, payloads),
+            batchable=platform in self.batch_platforms,
+        )
+
+    async def _send_to_platform(self, platform: str, payloads: List[Dict[str, Any]]):
+        """实际发送一条消息或一个批量帧，发送时才取连接，重试时可以用上重连后的连接
+
+        只有平台未连接（消息确定没有发出）时才重试，发送过程中出错时帧可能已经送达，不再重发。
+        """
+        websocket = self.platform_websockets.get(platform)
+        if websocket is None:
+            raise RetryableSendError(f"平台：{platform} 未连接")
+        frame = payloads[0] if len(payloads) == 1 else make_batch_frame(payloads)
         try:
-            await self.platform_websockets[platform].send_json(message)
+            await websocket.send_text(dumps_json(frame))
         except Exception:
-            disconnected.add(self.platform_websockets[platform])
-
-        # 清理断开的连接
-        for websocket in disconnected:
+            # 清理断开的连接
             self._remove_websocket(websocket, platform)
+            raise
 
     async def send_message(self, message: MessageBase):
         await self.broadcast_to_platform(message.message_info.platform, message.to_dict())
 
     async def send_message_REST(self, url: str, data: Dict[str, Any]) -> Dict[str, Any]:
-        """发送消息到指定端点"""
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, json=data, headers={"Content-Type": "application/json"}) as response:
-                    return await response.json()
-            except Exception as e:
-                raise e
-
-
-global_api = MessageServer(host=os.environ["HOST"], port=int(os.environ["PORT"]), app=global_server.get_app())
+        """发送消息到指定端点，复用该端点的持久会话"""
+        return await self.delivery.deliver(url, data, lambda payloads: self.delivery.post_json(url, payloads[0]))
+
+    def get_delivery_metrics(self) -> dict:
+        """获取出站投递指标（队列深度、投递延迟、重试和批量次数）"""
+        return self.delivery.get_metrics()
+
+
+global_api = MessageServer(
+    host=os.environ["HOST"],
+    port=int(os.environ["PORT"]),
+    app=global_server.get_app(),
+    ingress_max_workers=int(os.environ.get("INGRESS_MAX_WORKERS", "64")),
+    ingress_max_inflight_per_chat=int(os.environ.get("INGRESS_MAX_INFLIGHT_PER_CHAT", "1")),
+    ingress_max_queue_per_chat=int(os.environ.get("INGRESS_MAX_QUEUE_PER_CHAT", "100")),
+    ingress_overflow_policy=os.environ.get("INGRESS_OVERFLOW_POLICY", OVERFLOW_DROP_OLDEST),
+)
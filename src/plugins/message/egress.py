@@ -0,0 +1,250 @@
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from src.common.logger import get_module_logger
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，没有安装时使用标准库
+    orjson = None
+
+logger = get_module_logger("egress")
+
+BATCH_FRAME_TYPE = "message_batch"
+
+
+def dumps_json(data: Any) -> str:
+    """序列化为紧凑的JSON文本，安装了orjson时优先使用orjson"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data).decode()
+        except TypeError:
+            # orjson不支持的内容（如超过64位的整数、非字符串键）退回标准库
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def make_batch_frame(payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """把多条消息打包为一个批量帧"""
+    return {"type": BATCH_FRAME_TYPE, "messages": payloads}
+
+
+class RetryableSendError(Exception):
+    """可以安全重发的发送失败：消息确定没有送出（连接不存在、无法建立连接）或对端要求稍后重试（429/5xx）
+
+    其他异常（包括请求已发出后的读取超时）说明对端可能已经收到消息，重发会造成重复，不会重试。
+    """
+
+
+SendFunc = Callable[[List[Dict[str, Any]]], Awaitable[Any]]
+
+
+@dataclass
+class OutboundItem:
+    """出站队列中的一条消息"""
+
+    payload: Dict[str, Any]
+    send: SendFunc  # 接收一条或多条消息并完成实际发送，可以安全重发的失败抛出RetryableSendError
+    batchable: bool
+    future: asyncio.Future
+    enqueue_time: float = field(default_factory=time.monotonic)
+
+
+class OutboundDelivery:
+    """出站投递层
+
+    - 每个投递目标（平台或REST端点）一个FIFO队列和一个发送任务，同一目标的消息按提交顺序发送
+    - 目标支持批量帧时，上一次发送期间积压的消息合并为一帧发出，不额外等待
+    - 可以安全重发的失败（RetryableSendError）按指数退避加随机抖动重试，其他失败直接返回给调用方
+    - REST端点按主机复用持久的aiohttp会话
+    - 记录投递延迟（从提交到发送完成）
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 20,
+        max_queue_per_target: int = 1000,
+        max_retries: int = 3,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 5.0,
+        request_timeout: float = 30,
+        idle_timeout: float = 300,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_queue_per_target = max_queue_per_target
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.request_timeout = request_timeout
+        self.idle_timeout = idle_timeout  # 目标空闲多久后回收发送任务（秒）
+
+        self.queues: Dict[str, Deque[OutboundItem]] = {}  # 目标 -> 待发送消息
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self.sessions: Dict[str, aiohttp.ClientSession] = {}  # 主机 -> 持久会话
+
+        # 指标
+        self.delivered_count = 0
+        self.failed_count = 0
+        self.retry_count = 0
+        self.batch_count = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._latency_last = 0.0
+
+    async def deliver(self, target: str, payload: Dict[str, Any], send: SendFunc, batchable: bool = False) -> Any:
+        """提交一条消息并等待发送完成，返回发送结果，重试耗尽后抛出最后一次的异常"""
+        queue = self.queues.get(target)
+        if queue is None:
+            queue = self.queues[target] = deque()
+        if len(queue) >= self.max_queue_per_target:
+            raise RuntimeError(f"投递目标{target}的出站队列已满")
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append(OutboundItem(payload, send, batchable, future))
+        self._ensure_worker(target)
+        self._wakeups[target].set()
+        return await future
+
+    def _ensure_worker(self, target: str) -> None:
+        if target not in self._wakeups:
+            self._wakeups[target] = asyncio.Event()
+        worker = self._workers.get(target)
+        if worker is None or worker.done():
+            self._workers[target] = asyncio.create_task(self._target_worker(target))
+
+    def _take_batch(self, queue: Deque[OutboundItem]) -> List[OutboundItem]:
+        """取出队首消息，可批量时连同后面同样可批量的积压消息一起取出"""
+        batch = [queue.popleft()]
+        if batch[0].batchable:
+            while queue and queue[0].batchable and len(batch) < self.max_batch_size:
+                batch.append(queue.popleft())
+        return batch
+
+    async def _target_worker(self, target: str) -> None:
+        queue = self.queues[target]
+        wakeup = self._wakeups[target]
+        while True:
+            if not queue:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if not queue:
+                        # 长时间没有消息，回收该目标
+                        self.queues.pop(target, None)
+                        self._wakeups.pop(target, None)
+                        self._workers.pop(target, None)
+                        return
+                continue
+
+            batch = self._take_batch(queue)
+            payloads = [item.payload for item in batch]
+            try:
+                result = await self._send_with_retry(target, batch[0].send, payloads)
+            except asyncio.CancelledError:
+                for item in batch:
+                    if not item.future.done():
+                        item.future.cancel()
+                raise
+            except Exception as e:
+                self.failed_count += len(batch)
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                continue
+
+            if len(batch) > 1:
+                self.batch_count += 1
+            now = time.monotonic()
+            for item in batch:
+                self._record_latency(now - item.enqueue_time)
+                if not item.future.done():
+                    item.future.set_result(result)
+
+    async def _send_with_retry(self, target: str, send: SendFunc, payloads: List[Dict[str, Any]]) -> Any:
+        attempt = 0
+        while True:
+            try:
+                return await send(payloads)
+            except RetryableSendError as e:
+                if attempt >= self.max_retries:
+                    raise
+                # 指数退避，延迟在[0, 上限]内随机取值，避免多个目标同时重试
+                delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2**attempt))
+                attempt += 1
+                self.retry_count += 1
+                logger.warning(f"向{target}发送消息失败({e})，{delay:.2f}秒后第{attempt}次重试")
+                await asyncio.sleep(delay)
+
+    def _record_latency(self, latency: float) -> None:
+        self.delivered_count += 1
+        self._latency_last = latency
+        self._latency_total += latency
+        self._latency_max = max(self._latency_max, latency)
+
+    def get_session(self, url: str) -> aiohttp.ClientSession:
+        """获取url所在主机的持久会话"""
+        host = urlsplit(url).netloc
+        session = self.sessions.get(host)
+        if session is None or session.closed:
+            session = self.sessions[host] = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+                json_serialize=dumps_json,
+            )
+        return session
+
+    async def post_json(self, url: str, data: Dict[str, Any]) -> Any:
+        """通过持久会话POST一条JSON消息并返回响应内容
+
+        无法建立连接或响应为429/5xx时抛出RetryableSendError；请求发出后的超时等错误原样抛出，不会重试。
+        """
+        session = self.get_session(url)
+        try:
+            async with session.post(
+                url, data=dumps_json(data), headers={"Content-Type": "application/json"}
+            ) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise RetryableSendError(f"{url} 返回HTTP {response.status}")
+                return await response.json()
+        except aiohttp.ClientConnectorError as e:
+            raise RetryableSendError(f"无法连接到{url}: {e}") from e
+
+    def get_metrics(self) -> dict:
+        """获取出站投递指标"""
+        return {
+            "queue_depth": sum(len(queue) for queue in self.queues.values()),
+            "queue_depth_by_target": {k: len(v) for k, v in self.queues.items() if v},
+            "delivered_count": self.delivered_count,
+            "failed_count": self.failed_count,
+            "retry_count": self.retry_count,
+            "batch_count": self.batch_count,
+            "latency_avg": self._latency_total / self.delivered_count if self.delivered_count else 0.0,
+            "latency_max": self._latency_max,
+            "latency_last": self._latency_last,
+        }
+
+    async def stop(self) -> None:
+        """取消所有发送任务并关闭会话"""
+        for worker in list(self._workers.values()):
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+        for queue in self.queues.values():
+            for item in queue:
+                if not item.future.done():
+                    item.future.cancel()
+        self.queues.clear()
+        self._wakeups.clear()
+        for session in self.sessions.values():
+            if not session.closed:
+                await session.close()
+        self.sessions.clear()
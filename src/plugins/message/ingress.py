@@ -0,0 +1,278 @@
+import asyncio
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from src.common.logger import get_module_logger
+
+logger = get_module_logger("ingress")
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_MERGE = "merge"
+OVERFLOW_REJECT = "reject"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_MERGE, OVERFLOW_REJECT)
+
+
+@dataclass
+class IngressItem:
+    """入站队列中的一条消息"""
+
+    message: Dict[str, Any]
+    enqueue_time: float = field(default_factory=time.monotonic)
+
+
+class IngressRejected(Exception):
+    """入站队列已满且溢出策略为reject"""
+
+
+# 当前处理的入站消息占用的槽位的释放函数，由IngressPipeline在调用处理函数前设置
+_current_release: ContextVar[Optional[Callable[[], None]]] = ContextVar("ingress_release", default=None)
+
+
+def release_ingress_slot() -> None:
+    """消息已解析、存储并交给聊天流程后调用，提前归还入站管线的槽位
+
+    之后的缓冲等待和回复生成不再占用该聊天的处理名额，同一聊天的下一条消息可以开始处理。
+    不在入站管线中调用或重复调用时什么也不做。
+    """
+    release = _current_release.get()
+    if release is not None:
+        release()
+
+
+def get_chat_key(message: Dict[str, Any]) -> str:
+    """根据消息字典得到聊天标识：群聊为平台+群号，私聊为平台+用户id"""
+    message_info = message.get("message_info") or {}
+    platform = message_info.get("platform", "")
+    group_info = message_info.get("group_info") or {}
+    if group_info.get("group_id") is not None:
+        return f"{platform}_group_{group_info['group_id']}"
+    user_info = message_info.get("user_info") or {}
+    return f"{platform}_private_{user_info.get('user_id')}"
+
+
+def merge_messages(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """尝试把同一用户的两条消息合并为一条，无法合并时返回None"""
+    old_user = (old.get("message_info") or {}).get("user_info") or {}
+    new_user = (new.get("message_info") or {}).get("user_info") or {}
+    if old_user.get("user_id") is None or old_user.get("user_id") != new_user.get("user_id"):
+        return None
+    old_seg = old.get("message_segment")
+    new_seg = new.get("message_segment")
+    if not old_seg or not new_seg:
+        return None
+
+    segments = []
+    for seg in (old_seg, new_seg):
+        if seg.get("type") == "seglist":
+            segments.extend(seg.get("data") or [])
+        else:
+            segments.append(seg)
+
+    merged = dict(new)
+    merged["message_segment"] = {"type": "seglist", "data": segments}
+    raw_messages = [m.get("raw_message") for m in (old, new) if m.get("raw_message")]
+    if raw_messages:
+        merged["raw_message"] = "".join(raw_messages)
+    return merged
+
+
+class IngressPipeline:
+    """入站消息管线
+
+    - 每个聊天一个FIFO队列，同一聊天的消息按到达顺序开始处理
+    - 全局工作预算限制同时处理的消息数，单个聊天同时处理的消息数不超过max_inflight_per_chat（默认1，按顺序处理）
+    - 处理函数调用release_ingress_slot后即归还槽位，回复生成等耗时的后续流程不计入入站的处理名额
+    - 队列满时按溢出策略处理：drop_oldest（丢弃最旧）、merge（与队尾同一用户的消息合并）、reject（拒绝新消息）
+    - 记录队列深度和排队等待时间
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Awaitable[None]],
+        max_workers: int = 64,
+        max_inflight_per_chat: int = 1,
+        max_queue_per_chat: int = 100,
+        max_total_queued: int = 5000,
+        overflow_policy: str = OVERFLOW_DROP_OLDEST,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略: {overflow_policy}，可选值: {', '.join(OVERFLOW_POLICIES)}")
+        self.handler = handler
+        self.max_workers = max_workers
+        self.max_inflight_per_chat = max_inflight_per_chat
+        self.max_queue_per_chat = max_queue_per_chat
+        self.max_total_queued = max_total_queued
+        self.overflow_policy = overflow_policy
+
+        self.queues: Dict[str, Deque[IngressItem]] = {}  # chat_key -> 待处理消息
+        self.inflight: Dict[str, int] = {}  # chat_key -> 处理中的消息数
+        self._ready: Deque[str] = deque()  # 可以派发消息的聊天（轮转，保证各聊天公平）
+        self._ready_set: Set[str] = set()
+        self._total_queued = 0
+        self._total_inflight = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopped = False
+
+        # 指标
+        self.dropped_count = 0
+        self.merged_count = 0
+        self.rejected_count = 0
+        self.processed_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+
+    def submit(self, message: Dict[str, Any]) -> None:
+        """提交一条消息，队列已满且策略为reject时抛出IngressRejected"""
+        chat_key = get_chat_key(message)
+        if self._stopped:
+            logger.debug(f"入站管线已停止，忽略聊天{chat_key}的消息")
+            return
+        queue = self.queues.get(chat_key)
+        if queue is None:
+            queue = self.queues[chat_key] = deque()
+
+        if len(queue) >= self.max_queue_per_chat or self._total_queued >= self.max_total_queued:
+            if not self._handle_overflow(chat_key, queue, message):
+                return
+
+        queue.append(IngressItem(message))
+        self._total_queued += 1
+        self._mark_ready(chat_key)
+        self._dispatch()
+
+    def _handle_overflow(self, chat_key: str, queue: Deque[IngressItem], message: Dict[str, Any]) -> bool:
+        """处理队列溢出，返回新消息是否还需要入队"""
+        if self.overflow_policy == OVERFLOW_REJECT:
+            self.rejected_count += 1
+            raise IngressRejected(f"聊天{chat_key}的入站队列已满")
+
+        if self.overflow_policy == OVERFLOW_MERGE and queue:
+            merged = merge_messages(queue[-1].message, message)
+            if merged is not None:
+                queue[-1].message = merged
+                self.merged_count += 1
+                return False
+
+        # drop_oldest，或无法合并时退化为丢弃最旧的消息：
+        # 本聊天的队列满时丢弃本聊天的，只是总排队数超限时丢弃排队最多的聊天的
+        if queue and len(queue) >= self.max_queue_per_chat:
+            victim_queue = queue
+        else:
+            victim_queue = self._longest_queue()
+        if victim_queue:
+            victim_queue.popleft()
+            self._total_queued -= 1
+            self.dropped_count += 1
+            logger.warning(f"入站队列已满，丢弃最旧的消息（新消息来自聊天{chat_key}）")
+        return True
+
+    def _longest_queue(self) -> Optional[Deque[IngressItem]]:
+        longest = max(self.queues.values(), key=len, default=None)
+        return longest if longest else None
+
+    def _mark_ready(self, chat_key: str) -> None:
+        if chat_key not in self._ready_set:
+            self._ready_set.add(chat_key)
+            self._ready.append(chat_key)
+
+    def _dispatch(self) -> None:
+        """在工作预算内把就绪聊天的队首消息交给处理函数"""
+        if self._stopped:
+            return
+        while self._ready and self._total_inflight < self.max_workers:
+            chat_key = self._ready.popleft()
+            self._ready_set.discard(chat_key)
+            queue = self.queues.get(chat_key)
+            if not queue:
+                self._maybe_drop_chat(chat_key)
+                continue
+            if self.inflight.get(chat_key, 0) >= self.max_inflight_per_chat:
+                # 等该聊天有消息处理完时再重新就绪
+                continue
+
+            item = queue.popleft()
+            self._total_queued -= 1
+            self._record_wait(item)
+            self.inflight[chat_key] = self.inflight.get(chat_key, 0) + 1
+            self._total_inflight += 1
+            task = asyncio.create_task(self._run(chat_key, item.message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+            if queue:
+                self._mark_ready(chat_key)
+
+    async def _run(self, chat_key: str, message: Dict[str, Any]) -> None:
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self._release(chat_key)
+
+        _current_release.set(release)
+        try:
+            await self.handler(message)
+        except Exception:
+            logger.exception(f"处理聊天{chat_key}的消息失败")
+        finally:
+            # 处理函数没有提前归还槽位时在结束时归还
+            release()
+
+    def _release(self, chat_key: str) -> None:
+        """归还一条消息占用的槽位并继续派发"""
+        self.processed_count += 1
+        self._total_inflight -= 1
+        self.inflight[chat_key] -= 1
+        if self.queues.get(chat_key):
+            self._mark_ready(chat_key)
+        else:
+            self._maybe_drop_chat(chat_key)
+        self._dispatch()
+
+    def _maybe_drop_chat(self, chat_key: str) -> None:
+        """聊天没有排队和处理中的消息时释放它的队列"""
+        if not self.queues.get(chat_key) and not self.inflight.get(chat_key):
+            self.queues.pop(chat_key, None)
+            self.inflight.pop(chat_key, None)
+
+    def _record_wait(self, item: IngressItem) -> None:
+        wait = time.monotonic() - item.enqueue_time
+        self._wait_last = wait
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+
+    def get_metrics(self) -> dict:
+        """获取入站队列指标"""
+        dispatched = self.processed_count + self._total_inflight
+        return {
+            "queue_depth": self._total_queued,
+            "queue_depth_by_chat": {k: len(v) for k, v in self.queues.items() if v},
+            "inflight": self._total_inflight,
+            "processed_count": self.processed_count,
+            "dropped_count": self.dropped_count,
+            "merged_count": self.merged_count,
+            "rejected_count": self.rejected_count,
+            "wait_time_avg": self._wait_total / dispatched if dispatched else 0.0,
+            "wait_time_max": self._wait_max,
+            "wait_time_last": self._wait_last,
+        }
+
+    async def stop(self) -> None:
+        """取消所有处理中的消息并清空队列，之后不再派发消息"""
+        # 先停止派发并清空队列，被取消的任务结束时不会再派发新的消息
+        self._stopped = True
+        self.queues.clear()
+        self._ready.clear()
+        self._ready_set.clear()
+        self._total_queued = 0
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
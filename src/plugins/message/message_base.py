@@ -1,8 +1,18 @@
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from typing import List, Optional, Union, Dict
 
 
-@dataclass
+def _non_none_fields(obj) -> Dict:
+    """按字段顺序收集非None字段，代替asdict（asdict会递归深拷贝，开销大）"""
+    result = {}
+    for name in obj.__slots__:
+        value = getattr(obj, name)
+        if value is not None:
+            result[name] = value
+    return result
+
+
+@dataclass(slots=True)
 class Seg:
     """消息片段类，用于表示消息的不同部分
 
@@ -43,7 +53,7 @@ class Seg:
         return result
 
 
-@dataclass
+@dataclass(slots=True)
 class GroupInfo:
     """群组信息类"""
 
@@ -53,7 +63,7 @@ class GroupInfo:
 
     def to_dict(self) -> Dict:
         """转换为字典格式"""
-        return {k: v for k, v in asdict(self).items() if v is not None}
+        return _non_none_fields(self)
 
     @classmethod
     def from_dict(cls, data: Dict) -> "GroupInfo":
@@ -72,7 +82,7 @@ class GroupInfo:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class UserInfo:
     """用户信息类"""
 
@@ -83,7 +93,7 @@ class UserInfo:
 
     def to_dict(self) -> Dict:
         """转换为字典格式"""
-        return {k: v for k, v in asdict(self).items() if v is not None}
+        return _non_none_fields(self)
 
     @classmethod
     def from_dict(cls, data: Dict) -> "UserInfo":
@@ -103,7 +113,7 @@ class UserInfo:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class FormatInfo:
     """格式信息类"""
 
@@ -117,7 +127,7 @@ class FormatInfo:
 
     def to_dict(self) -> Dict:
         """转换为字典格式"""
-        return {k: v for k, v in asdict(self).items() if v is not None}
+        return _non_none_fields(self)
 
     @classmethod
     def from_dict(cls, data: Dict) -> "FormatInfo":
@@ -133,7 +143,7 @@ class FormatInfo:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class TemplateInfo:
     """模板信息类"""
 
@@ -143,7 +153,7 @@ class TemplateInfo:
 
     def to_dict(self) -> Dict:
         """转换为字典格式"""
-        return {k: v for k, v in asdict(self).items() if v is not None}
+        return _non_none_fields(self)
 
     @classmethod
     def from_dict(cls, data: Dict) -> "TemplateInfo":
@@ -160,7 +170,7 @@ class TemplateInfo:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class BaseMessageInfo:
     """消息信息类"""
 
@@ -175,13 +185,10 @@ class BaseMessageInfo:
 
     def to_dict(self) -> Dict:
         """转换为字典格式"""
-        result = {}
-        for field, value in asdict(self).items():
-            if value is not None:
-                if isinstance(value, (GroupInfo, UserInfo, FormatInfo, TemplateInfo)):
-                    result[field] = value.to_dict()
-                else:
-                    result[field] = value
+        result = _non_none_fields(self)
+        for field in ("group_info", "user_info", "format_info", "template_info"):
+            if field in result:
+                result[field] = result[field].to_dict()
         return result
 
     @classmethod
@@ -246,3 +253,53 @@ class MessageBase:
         message_segment = Seg.from_dict(data.get("message_segment", {}))
         raw_message = data.get("raw_message", None)
         return cls(message_info=message_info, message_segment=message_segment, raw_message=raw_message)
+
+
+class LazyMessage:
+    """紧凑的入站消息表示
+
+    message_info在构造时解析；消息段保留原始字典，第一次访问message_segment时才解析为Seg。
+    消息段未被访问或修改过时，to_dict直接复用原始字典，存储往返不需要重新序列化消息段。
+    """
+
+    __slots__ = ("message_info", "raw_message", "_segment", "_segment_dict")
+
+    def __init__(self, message_info: BaseMessageInfo, segment_dict: Optional[Dict], raw_message: Optional[str] = None):
+        self.message_info = message_info
+        self.raw_message = raw_message
+        self._segment: Optional[Seg] = None
+        self._segment_dict = segment_dict
+
+    @property
+    def message_segment(self) -> Seg:
+        if self._segment is None and self._segment_dict is not None:
+            self._segment = Seg.from_dict(self._segment_dict)
+            self._segment_dict = None
+        return self._segment
+
+    @message_segment.setter
+    def message_segment(self, value: Seg) -> None:
+        self._segment = value
+        self._segment_dict = None
+
+    @property
+    def segment_parsed(self) -> bool:
+        """消息段是否已经解析"""
+        return self._segment_dict is None
+
+    def to_dict(self) -> Dict:
+        """转换为字典格式，与MessageBase.to_dict结果一致"""
+        segment = self._segment_dict if self._segment_dict is not None else self._segment.to_dict()
+        result = {"message_info": self.message_info.to_dict(), "message_segment": segment}
+        if self.raw_message is not None:
+            result["raw_message"] = self.raw_message
+        return result
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LazyMessage":
+        """从字典创建LazyMessage实例，只解析message_info"""
+        return cls(
+            message_info=BaseMessageInfo.from_dict(data.get("message_info", {})),
+            segment_dict=data.get("message_segment", {}),
+            raw_message=data.get("raw_message", None),
+        )
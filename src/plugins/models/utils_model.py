@@ -1,20 +1,34 @@
 import asyncio
+import hashlib
 import json
 import re
+from collections import OrderedDict
 from datetime import datetime
-from typing import Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 import aiohttp
 from src.common.logger import get_module_logger
 import base64
-from PIL import Image
-import io
 import os
 from ...common.database import db
 from ..config.config import global_config
+from ...common.image_worker import compress_image, image_worker
 
 logger = get_module_logger("model_utils")
 
+# compress_base64_image_by_scale只压缩超过这个大小（字节）的图片
+COMPRESS_THRESHOLD = 2 * 1024 * 1024
+
+# 发送给视觉模型的图片默认的最大边长（像素）和最大大小（字节），可以在模型配置中用max_image_side和max_image_bytes覆盖
+DEFAULT_MAX_IMAGE_SIDE = 2048
+DEFAULT_MAX_IMAGE_BYTES = 2 * 1024 * 1024
+# 一个请求中有多张图片时，每张图片分到的大小预算不低于这个值
+MIN_IMAGE_BYTES = 256 * 1024
+
+# 规范化后的图片：(原图MD5, 最大边长, 最大大小) -> (base64, 格式)，原图已经满足要求时为None，不重复保存原图
+_prepared_images: OrderedDict[Tuple[str, int, int], Optional[Tuple[str, str]]] = OrderedDict()
+PREPARED_IMAGE_CACHE_SIZE = 64
+
 
 class LLM_request:
     # 定义需要转换的模型列表，作为类变量避免重复
@@ -43,6 +57,8 @@ class LLM_request:
         self.stream = model.get("stream", False)
         self.pri_in = model.get("pri_in", 0)
         self.pri_out = model.get("pri_out", 0)
+        self.max_image_side = model.get("max_image_side", DEFAULT_MAX_IMAGE_SIDE)
+        self.max_image_bytes = model.get("max_image_bytes", DEFAULT_MAX_IMAGE_BYTES)
 
         # 获取数据库实例
         self._init_database()
@@ -134,6 +150,8 @@ class LLM_request:
         response_handler: callable = None,
         user_id: str = "system",
         request_type: str = None,
+        image_bytes: bytes = None,
+        images: List[Tuple[str, str]] = None,
     ):
         """统一请求执行入口
         Args:
@@ -141,6 +159,8 @@ class LLM_request:
             prompt: prompt文本
             image_base64: 图片的base64编码
             image_format: 图片格式
+            image_bytes: 图片的原始数据，调用方已经解码过时传入，避免再次解码
+            images: 同一个请求中的多张图片 [(base64, 格式)]，每张图片分到的大小预算按张数均分
             payload: 请求体数据
             retry_policy: 自定义重试策略
             response_handler: 自定义响应处理器
@@ -181,7 +201,15 @@ class LLM_request:
 
         # 构建请求体
         if image_base64:
+            source_image = (image_base64, image_format, image_bytes)
+            image_budget = self.max_image_bytes
+            image_base64, image_format = await self._prepare_image(image_base64, image_format, image_bytes)
             payload = await self._build_payload(prompt, image_base64, image_format)
+        elif images:
+            source_images = images
+            image_budget = max(self.max_image_bytes // len(images), MIN_IMAGE_BYTES)
+            images = await self._prepare_images(source_images, image_budget)
+            payload = await self._build_payload(prompt, images=images)
         elif payload is None:
             payload = await self._build_payload(prompt)
 
@@ -207,9 +235,18 @@ class LLM_request:
                                 logger.warning(
                                     f"模型 {self.model_name} 错误码: {response.status}, 等待 {wait_time}秒后重试"
                                 )
-                                if response.status == 413:
-                                    logger.warning("请求体过大，尝试压缩...")
-                                    image_base64 = compress_base64_image_by_scale(image_base64)
+                                if response.status == 413 and images:
+                                    logger.warning("请求体过大，缩小每张图片后重试...")
+                                    image_budget = max(image_budget // 2, MIN_IMAGE_BYTES)
+                                    images = await self._prepare_images(source_images, image_budget)
+                                    payload = await self._build_payload(prompt, images=images)
+                                elif response.status == 413 and image_base64:
+                                    # 图片已经缩小到预算以内，继续减半预算重新缩小
+                                    logger.warning("请求体过大，缩小图片后重试...")
+                                    image_budget = max(image_budget // 2, MIN_IMAGE_BYTES)
+                                    image_base64, image_format = await self._prepare_image(
+                                        *source_image, max_bytes=image_budget
+                                    )
                                     payload = await self._build_payload(prompt, image_base64, image_format)
                                 elif response.status in [500, 503]:
                                     logger.error(
@@ -465,22 +502,10 @@ class LLM_request:
                     logger.critical(
                         f"模型 {self.model_name} HTTP响应错误达到最大重试次数: 状态码: {e.status}, 错误: {e.message}"
                     )
-                    # 安全地检查和记录请求详情
-                    if (
-                        image_base64
-                        and payload
-                        and isinstance(payload, dict)
-                        and "messages" in payload
-                        and len(payload["messages"]) > 0
-                    ):
-                        if isinstance(payload["messages"][0], dict) and "content" in payload["messages"][0]:
-                            content = payload["messages"][0]["content"]
-                            if isinstance(content, list) and len(content) > 1 and "image_url" in content[1]:
-                                payload["messages"][0]["content"][1]["image_url"]["url"] = (
-                                    f"data:image/{image_format.lower() if image_format else 'jpeg'};base64,"
-                                    f"{image_base64[:10]}...{image_base64[-10:]}"
-                                )
-                    logger.critical(f"请求头: {await self._build_headers(no_key=True)} 请求体: {payload}")
+                    # 安全地记录请求详情，图片只保留base64的首尾几个字符
+                    logger.critical(
+                        f"请求头: {await self._build_headers(no_key=True)} 请求体: {self._redact_images(payload)}"
+                    )
                     raise RuntimeError(f"模型 {self.model_name} API请求失败: 状态码 {e.status}, {e.message}") from e
             except Exception as e:
                 if retry < policy["max_retries"] - 1:
@@ -489,27 +514,78 @@ class LLM_request:
                     await asyncio.sleep(wait_time)
                 else:
                     logger.critical(f"模型 {self.model_name} 请求失败: {str(e)}")
-                    # 安全地检查和记录请求详情
-                    if (
-                        image_base64
-                        and payload
-                        and isinstance(payload, dict)
-                        and "messages" in payload
-                        and len(payload["messages"]) > 0
-                    ):
-                        if isinstance(payload["messages"][0], dict) and "content" in payload["messages"][0]:
-                            content = payload["messages"][0]["content"]
-                            if isinstance(content, list) and len(content) > 1 and "image_url" in content[1]:
-                                payload["messages"][0]["content"][1]["image_url"]["url"] = (
-                                    f"data:image/{image_format.lower() if image_format else 'jpeg'};base64,"
-                                    f"{image_base64[:10]}...{image_base64[-10:]}"
-                                )
-                    logger.critical(f"请求头: {await self._build_headers(no_key=True)} 请求体: {payload}")
+                    # 安全地记录请求详情，图片只保留base64的首尾几个字符
+                    logger.critical(
+                        f"请求头: {await self._build_headers(no_key=True)} 请求体: {self._redact_images(payload)}"
+                    )
                     raise RuntimeError(f"模型 {self.model_name} API请求失败: {str(e)}") from e
 
         logger.error(f"模型 {self.model_name} 达到最大重试次数，请求仍然失败")
         raise RuntimeError(f"模型 {self.model_name} 达到最大重试次数，API请求仍然失败")
 
+    async def _prepare_image(
+        self,
+        image_base64: str,
+        image_format: str,
+        image_bytes: Optional[bytes] = None,
+        max_bytes: Optional[int] = None,
+    ) -> Tuple[str, str]:
+        """发送前把图片缩小到模型的尺寸和大小限制以内，结果按原图哈希缓存
+
+        以前只有在服务端返回413之后才压缩，白白上传一次完整的大图。
+        """
+        try:
+            if image_bytes is None:
+                image_bytes = base64.b64decode(image_base64)
+            max_bytes = max_bytes or self.max_image_bytes
+            key = (hashlib.md5(image_bytes).hexdigest(), self.max_image_side, max_bytes)
+            if key in _prepared_images:
+                _prepared_images.move_to_end(key)
+                return _prepared_images[key] or (image_base64, image_format)
+
+            result = await image_worker.prepare(image_bytes, self.max_image_side, max_bytes)
+            if result is None:
+                prepared = None
+            else:
+                data, prepared_format = result
+                logger.debug(f"发送前缩小图片: {len(image_bytes) / 1024:.1f}KB -> {len(data) / 1024:.1f}KB")
+                prepared = (base64.b64encode(data).decode("utf-8"), prepared_format)
+        except Exception as e:
+            logger.warning(f"图片预处理失败，使用原图: {str(e)}")
+            return image_base64, image_format
+
+        _prepared_images[key] = prepared
+        while len(_prepared_images) > PREPARED_IMAGE_CACHE_SIZE:
+            _prepared_images.popitem(last=False)
+        return prepared or (image_base64, image_format)
+
+    async def _prepare_images(self, images: List[Tuple[str, str]], max_bytes: int) -> List[Tuple[str, str]]:
+        """并行规范多张图片的尺寸，每张图片的大小预算为max_bytes"""
+        return list(
+            await asyncio.gather(
+                *(self._prepare_image(data, data_format, max_bytes=max_bytes) for data, data_format in images)
+            )
+        )
+
+    @staticmethod
+    def _redact_images(payload) -> Union[dict, str]:
+        """返回用于日志的请求体副本，图片的data URL只保留首尾几个字符"""
+        if not isinstance(payload, dict) or not isinstance(payload.get("messages"), list):
+            return payload
+        messages = []
+        for message in payload["messages"]:
+            content = message.get("content") if isinstance(message, dict) else None
+            if isinstance(content, list):
+                parts = []
+                for part in content:
+                    url = part.get("image_url", {}).get("url", "") if isinstance(part, dict) else ""
+                    if url.startswith("data:") and len(url) > 64:
+                        part = {**part, "image_url": {**part["image_url"], "url": f"{url[:40]}...{url[-10:]}"}}
+                    parts.append(part)
+                message = {**message, "content": parts}
+            messages.append(message)
+        return {**payload, "messages": messages}
+
     async def _transform_parameters(self, params: dict) -> dict:
         """
         根据模型名称转换参数：
@@ -527,25 +603,27 @@ class LLM_request:
                 new_params["max_completion_tokens"] = new_params.pop("max_tokens")
         return new_params
 
-    async def _build_payload(self, prompt: str, image_base64: str = None, image_format: str = None) -> dict:
-        """构建请求体"""
+    async def _build_payload(
+        self,
+        prompt: str,
+        image_base64: str = None,
+        image_format: str = None,
+        images: List[Tuple[str, str]] = None,
+    ) -> dict:
+        """构建请求体，图片可以是单张(image_base64, image_format)或多张images"""
         # 复制一份参数，避免直接修改 self.params
         params_copy = await self._transform_parameters(self.params)
         if image_base64:
+            images = [(image_base64, image_format)]
+        if images:
+            content = [{"type": "text", "text": prompt}]
+            for data, data_format in images:
+                content.append(
+                    {"type": "image_url", "image_url": {"url": f"data:image/{data_format.lower()};base64,{data}"}}
+                )
             payload = {
                 "model": self.model_name,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/{image_format.lower()};base64,{image_base64}"},
-                            },
-                        ],
-                    }
-                ],
+                "messages": [{"role": "user", "content": content}],
                 "max_tokens": global_config.max_response_length,
                 **params_copy,
             }
@@ -632,11 +710,17 @@ class LLM_request:
             content, reasoning_content = response
             return content, reasoning_content, self.model_name
 
-    async def generate_response_for_image(self, prompt: str, image_base64: str, image_format: str) -> Tuple:
-        """根据输入的提示和图片生成模型的异步响应"""
+    async def generate_response_for_image(
+        self, prompt: str, image_base64: str, image_format: str, image_bytes: bytes = None
+    ) -> Tuple:
+        """根据输入的提示和图片生成模型的异步响应，已经解码过的图片可以通过image_bytes传入"""
 
         response = await self._execute_request(
-            endpoint="/chat/completions", prompt=prompt, image_base64=image_base64, image_format=image_format
+            endpoint="/chat/completions",
+            prompt=prompt,
+            image_base64=image_base64,
+            image_format=image_format,
+            image_bytes=image_bytes,
         )
         # 根据返回值的长度决定怎么处理
         if len(response) == 3:
@@ -646,6 +730,16 @@ class LLM_request:
             content, reasoning_content = response
             return content, reasoning_content
 
+    async def generate_response_for_images(self, prompt: str, images: List[Tuple[str, str]]) -> Tuple:
+        """把多张图片放在同一个请求中生成响应
+
+        Args:
+            prompt: 提示词
+            images: [(图片base64, 图片格式)]，按顺序附在提示词之后
+        """
+        response = await self._execute_request(endpoint="/chat/completions", prompt=prompt, images=images)
+        return response[0], response[1]
+
     async def generate_response_async(self, prompt: str, **kwargs) -> Union[str, Tuple]:
         """异步方式根据输入的提示生成模型的响应"""
         # 构建请求体
@@ -707,9 +801,47 @@ class LLM_request:
         )
         return embedding
 
+    async def get_embeddings(self, texts: List[str]) -> Optional[List[list]]:
+        """异步方法：在一个请求中获取多段文本的embedding向量
+
+        Args:
+            texts: 需要获取embedding的文本列表，不能包含空文本
+
+        Returns:
+            list: 与texts一一对应的embedding向量列表，如果失败则返回None
+        """
+        if not texts:
+            return []
+
+        def embeddings_handler(result):
+            """处理响应，按index还原输入顺序"""
+            data = result.get("data") or []
+            if len(data) != len(texts):
+                logger.error(f"批量embedding返回了 {len(data)} 个向量，期望 {len(texts)} 个")
+                return None
+            usage = result.get("usage", {})
+            if usage:
+                self._record_usage(
+                    prompt_tokens=usage.get("prompt_tokens", 0),
+                    completion_tokens=usage.get("completion_tokens", 0),
+                    total_tokens=usage.get("total_tokens", 0),
+                    user_id="system",
+                    request_type=self.request_type,
+                    endpoint="/embeddings",
+                )
+            return [item.get("embedding") for item in sorted(data, key=lambda item: item.get("index", 0))]
+
+        return await self._execute_request(
+            endpoint="/embeddings",
+            prompt=texts[0],
+            payload={"model": self.model_name, "input": texts, "encoding_format": "float"},
+            retry_policy={"max_retries": 2, "base_wait": 6},
+            response_handler=embeddings_handler,
+        )
+
 
 def compress_base64_image_by_scale(base64_data: str, target_size: int = 0.8 * 1024 * 1024) -> str:
-    """压缩base64格式的图片到指定大小
+    """压缩base64格式的图片到指定大小（同步执行，在事件循环中请使用image_worker.compress）
     Args:
         base64_data: base64编码的图片数据
         target_size: 目标文件大小（字节），默认0.8MB
@@ -717,68 +849,19 @@ def compress_base64_image_by_scale(base64_data: str, target_size: int = 0.8 * 10
         str: 压缩后的base64图片数据
     """
     try:
-        # 将base64转换为字节数据
         image_data = base64.b64decode(base64_data)
-
         # 如果已经小于目标大小，直接返回原图
-        if len(image_data) <= 2 * 1024 * 1024:
+        if len(image_data) <= COMPRESS_THRESHOLD:
             return base64_data
-
-        # 将字节数据转换为图片对象
-        img = Image.open(io.BytesIO(image_data))
-
-        # 获取原始尺寸
-        original_width, original_height = img.size
-
-        # 计算缩放比例
-        scale = min(1.0, (target_size / len(image_data)) ** 0.5)
-
-        # 计算新的尺寸
-        new_width = int(original_width * scale)
-        new_height = int(original_height * scale)
-
-        # 创建内存缓冲区
-        output_buffer = io.BytesIO()
-
-        # 如果是GIF，处理所有帧
-        if getattr(img, "is_animated", False):
-            frames = []
-            for frame_idx in range(img.n_frames):
-                img.seek(frame_idx)
-                new_frame = img.copy()
-                new_frame = new_frame.resize((new_width // 2, new_height // 2), Image.Resampling.LANCZOS)  # 动图折上折
-                frames.append(new_frame)
-
-            # 保存到缓冲区
-            frames[0].save(
-                output_buffer,
-                format="GIF",
-                save_all=True,
-                append_images=frames[1:],
-                optimize=True,
-                duration=img.info.get("duration", 100),
-                loop=img.info.get("loop", 0),
-            )
-        else:
-            # 处理静态图片
-            resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-            # 保存到缓冲区，保持原始格式
-            if img.format == "PNG" and img.mode in ("RGBA", "LA"):
-                resized_img.save(output_buffer, format="PNG", optimize=True)
-            else:
-                resized_img.save(output_buffer, format="JPEG", quality=95, optimize=True)
-
-        # 获取压缩后的数据并转换为base64
-        compressed_data = output_buffer.getvalue()
-        logger.success(f"压缩图片: {original_width}x{original_height} -> {new_width}x{new_height}")
-        logger.info(f"压缩前大小: {len(image_data) / 1024:.1f}KB, 压缩后大小: {len(compressed_data) / 1024:.1f}KB")
-
-        return base64.b64encode(compressed_data).decode("utf-8")
-
+        return _encode_compressed(image_data, compress_image(image_data, int(target_size), COMPRESS_THRESHOLD))
     except Exception as e:
         logger.error(f"压缩图片失败: {str(e)}")
         import traceback
 
         logger.error(traceback.format_exc())
         return base64_data
+
+
+def _encode_compressed(image_data: bytes, compressed_data: bytes) -> str:
+    logger.info(f"压缩前大小: {len(image_data) / 1024:.1f}KB, 压缩后大小: {len(compressed_data) / 1024:.1f}KB")
+    return base64.b64encode(compressed_data).decode("utf-8")
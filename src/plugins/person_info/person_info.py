@@ -1,18 +1,16 @@
 from src.common.logger import get_module_logger
 from ...common.database import db
+from ..config.config import global_config
 import copy
 import hashlib
-from typing import Any, Callable, Dict
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
 import datetime
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-
-import matplotlib
-
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from pymongo import UpdateOne
 from pathlib import Path
-import pandas as pd
 
 
 """
@@ -26,6 +24,12 @@ PersonInfoManager 类方法功能摘要：
 7. del_all_undefined_field - 清理全集合中未定义的字段
 8. get_specific_value_list - 根据指定条件，返回person_id,value字典
 9. personal_habit_deduction - 定时推断个人习惯
+10. get_many - 批量获取多个person_id的字段值（一次$in查询）
+11. push_message_interval - 记录消息时间戳（$push + $slice，不再整体重写列表）
+12. flush - 把缓存中的修改批量写回数据库
+13. msg_interval_deduction - 批量推断所有用户的msg_interval（NumPy矩阵计算，一次bulk_write写回）
+
+字段值缓存在内存中（msg_interval_list除外），修改先写入缓存，再由后台任务批量写回数据库。
 """
 
 logger = get_module_logger("person_info")
@@ -45,13 +49,204 @@ person_info_default = {
     "msg_interval_list": [],
 }  # 个人信息的各项与默认值在此定义，以下处理会自动创建/补全每一项
 
+# 不进入缓存的字段（体积大且只通过$push追加）
+uncached_fields = {"msg_interval_list"}
+msg_interval_list_max_len = 1000
+
+
+def compute_msg_intervals(msg_interval_lists: List[list]) -> tuple:
+    """批量计算所有用户的msg_interval
+
+    把所有用户的消息时间戳补齐成一个矩阵，一次性完成差分、过滤和分位数计算。
+
+    Args:
+        msg_interval_lists: 每个用户的消息时间戳列表（毫秒）
+
+    Returns:
+        (msg_intervals, valid, intervals): 每个用户的msg_interval（int64数组），
+        该用户是否有足够的有效间隔（bool数组），以及过滤后的间隔矩阵（无效处为NaN，用于画图）
+    """
+    n_users = len(msg_interval_lists)
+    max_len = max((len(x) for x in msg_interval_lists), default=0)
+    timestamps = np.full((n_users, max(max_len, 2)), np.nan)
+    for i, msg_interval_list in enumerate(msg_interval_lists):
+        timestamps[i, : len(msg_interval_list)] = msg_interval_list
+
+    with np.errstate(invalid="ignore"):
+        intervals = np.diff(timestamps, axis=1)
+        intervals[~((intervals >= 500) & (intervals <= 8000))] = np.nan
+    valid = np.count_nonzero(~np.isnan(intervals), axis=1) >= 30
+
+    msg_intervals = np.zeros(n_users, dtype=np.int64)
+    if not valid.any():
+        return msg_intervals, valid, intervals
+
+    valid_intervals = intervals[valid]
+    q25, q75 = np.nanpercentile(valid_intervals, [25, 75], axis=1)
+    iqr = (q75 - q25)[:, None]
+    filtered = np.where(
+        (valid_intervals >= q25[:, None] - 1.5 * iqr) & (valid_intervals <= q75[:, None] + 1.5 * iqr),
+        valid_intervals,
+        np.nan,
+    )
+    msg_intervals[valid] = np.rint(np.nanpercentile(filtered, 80, axis=1)).astype(np.int64)
+    return msg_intervals, valid, intervals
+
+
+def plot_interval_distribution(person_id: str, time_interval: List[float], log_dir: str) -> str:
+    """画出用户消息间隔分布图，在进程池中运行"""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
+    Path(log_dir).mkdir(parents=True, exist_ok=True)
+    plt.figure(figsize=(10, 6))
+    time_series = pd.Series(time_interval)
+    plt.hist(time_series, bins=50, density=True, alpha=0.4, color="pink", label="Histogram")
+    time_series.plot(kind="kde", color="mediumpurple", linewidth=1, label="Density")
+    plt.grid(True, alpha=0.2)
+    plt.xlim(0, 8000)
+    plt.title(f"Message Interval Distribution (User: {person_id[:8]}...)")
+    plt.xlabel("Interval (ms)")
+    plt.ylabel("Density")
+    plt.legend(framealpha=0.9, facecolor="white")
+    img_path = Path(log_dir) / f"interval_distribution_{person_id[:8]}.png"
+    plt.savefig(img_path)
+    plt.close()
+    return str(img_path)
+
 
 class PersonInfoManager:
-    def __init__(self):
+    def __init__(self, flush_interval: float = 5, cache_size: int = 10000, plot_habit_distribution: bool = False):
         if "person_info" not in db.list_collection_names():
             db.create_collection("person_info")
             db.person_info.create_index("person_id", unique=True)
 
+        self.flush_interval = flush_interval  # 写回间隔（秒）
+        self.cache_size = cache_size  # 缓存的最大人数
+        self._cache: OrderedDict[str, dict] = OrderedDict()  # person_id -> 字段值（不存在的文档缓存为默认值）
+        self._dirty: Dict[str, dict] = {}  # person_id -> 待$set的字段
+        self._insert_data: Dict[str, dict] = {}  # person_id -> 文档不存在时用于创建的数据
+        self._pending_intervals: Dict[str, List[int]] = {}  # person_id -> 待$push的消息时间戳
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.plot_habit_distribution = plot_habit_distribution  # 是否输出消息间隔分布图（在进程池中绘制）
+
+    @staticmethod
+    def _copy_value(value):
+        if isinstance(value, (int, float, str, bool, type(None))):
+            return value
+        return copy.deepcopy(value)
+
+    def _cache_document(self, person_id: str, document: Optional[dict]) -> dict:
+        """把数据库文档放入缓存，文档不存在时缓存默认值"""
+        cached = {k: v for k, v in person_info_default.items() if k not in uncached_fields}
+        cached["person_id"] = person_id
+        if document:
+            for key in cached:
+                if key in document:
+                    cached[key] = document[key]
+        # 尚未写回的修改优先
+        cached.update({k: v for k, v in self._dirty.get(person_id, {}).items() if k not in uncached_fields})
+        self._cache[person_id] = cached
+        self._cache.move_to_end(person_id)
+        self._evict_cache()
+        return cached
+
+    def _evict_cache(self):
+        """超出容量时淘汰最久未使用且没有未写回修改的缓存项"""
+        while len(self._cache) > self.cache_size:
+            for person_id in self._cache:
+                if person_id not in self._dirty:
+                    del self._cache[person_id]
+                    break
+            else:
+                return
+
+    def _get_cached(self, person_id: str) -> dict:
+        cached = self._cache.get(person_id)
+        if cached is not None:
+            self._cache.move_to_end(person_id)
+            return cached
+        projection = {field: 0 for field in uncached_fields}
+        document = db.person_info.find_one({"person_id": person_id}, projection)
+        return self._cache_document(person_id, document)
+
+    def _mark_dirty(self, person_id: str, fields: dict, data: dict = None):
+        self._dirty.setdefault(person_id, {}).update(fields)
+        if data:
+            self._insert_data.setdefault(person_id, {}).update(data)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task and not self._flush_task.done():
+            return
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self._delayed_flush())
+        except RuntimeError:
+            logger.debug("没有运行中的事件循环，个人信息修改将在下次flush时写回")
+
+    async def _delayed_flush(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            # 写回期间产生的修改和写回失败保留的修改在下一轮写回，
+            # 此时本任务尚未结束，_schedule_flush不会另起任务
+            if not self._dirty and not self._pending_intervals:
+                return
+
+    def _build_insert_defaults(self, person_id: str, exclude: set) -> dict:
+        """文档不存在时（upsert）需要补全的字段"""
+        defaults = copy.deepcopy(person_info_default)
+        defaults["person_id"] = person_id
+        data = self._insert_data.get(person_id, {})
+        for key in defaults:
+            if key != "person_id" and key in data:
+                defaults[key] = data[key]
+        return {k: v for k, v in defaults.items() if k not in exclude}
+
+    async def flush(self):
+        """把缓存中的修改和待追加的消息时间戳批量写回数据库"""
+        async with self._flush_lock:
+            if not self._dirty and not self._pending_intervals:
+                return
+            dirty, self._dirty = self._dirty, {}
+            intervals, self._pending_intervals = self._pending_intervals, {}
+
+            operations = []
+            for person_id in set(dirty) | set(intervals):
+                fields = dirty.get(person_id, {})
+                update = {}
+                if fields:
+                    update["$set"] = fields
+                exclude = set(fields)
+                if person_id in intervals:
+                    update["$push"] = {
+                        "msg_interval_list": {"$each": intervals[person_id], "$slice": -msg_interval_list_max_len}
+                    }
+                    exclude.add("msg_interval_list")
+                update["$setOnInsert"] = self._build_insert_defaults(person_id, exclude)
+                operations.append(UpdateOne({"person_id": person_id}, update, upsert=True))
+
+            try:
+                await asyncio.to_thread(db.person_info.bulk_write, operations, ordered=False)
+                for person_id in dirty:
+                    self._insert_data.pop(person_id, None)
+                for person_id in intervals:
+                    self._insert_data.pop(person_id, None)
+                logger.trace(f"个人信息写回完成，共{len(operations)}项")
+            except Exception as e:
+                logger.error(f"个人信息写回失败: {str(e)}")
+                # 写回失败时保留修改，等待下次写回（期间产生的新修改优先）
+                for person_id, fields in dirty.items():
+                    self._dirty[person_id] = {**fields, **self._dirty.get(person_id, {})}
+                for person_id, values in intervals.items():
+                    self._pending_intervals[person_id] = values + self._pending_intervals.get(person_id, [])
+                # 由_delayed_flush之外调用时（如关闭时）安排重试
+                self._schedule_flush()
+
     def get_person_id(self, platform: str, user_id: int):
         """获取唯一id"""
         components = [platform, str(user_id)]
@@ -73,21 +268,31 @@ class PersonInfoManager:
                     _person_info_default[key] = data[key]
 
         db.person_info.insert_one(_person_info_default)
+        self._cache_document(person_id, _person_info_default)
 
     async def update_one_field(self, person_id: str, field_name: str, value, Data: dict = None):
-        """更新某一个字段，会补全"""
+        """更新某一个字段，会补全
+
+        修改先写入缓存，由后台任务批量写回；文档不存在时写回会用Data和默认值创建文档
+        """
         if field_name not in person_info_default.keys():
             logger.debug(f"更新'{field_name}'失败，未定义的字段")
             return
 
-        document = db.person_info.find_one({"person_id": person_id})
+        if field_name in uncached_fields:
+            self._cache.pop(person_id, None)
+        elif person_id in self._cache:
+            self._cache[person_id][field_name] = value
+        self._mark_dirty(person_id, {field_name: value}, Data)
 
-        if document:
-            db.person_info.update_one({"person_id": person_id}, {"$set": {field_name: value}})
-        else:
-            Data[field_name] = value
-            logger.debug(f"更新时{person_id}不存在，已新建")
-            await self.create_person_info(person_id, Data)
+    async def push_message_interval(self, person_id: str, timestamp_ms: int, Data: dict = None):
+        """追加一条消息时间戳，写回时使用$push + $slice只保留最近的1000条"""
+        if not person_id:
+            return
+        self._pending_intervals.setdefault(person_id, []).append(timestamp_ms)
+        if Data:
+            self._insert_data.setdefault(person_id, {}).update(Data)
+        self._schedule_flush()
 
     async def del_one_document(self, person_id: str):
         """删除指定 person_id 的文档"""
@@ -95,6 +300,11 @@ class PersonInfoManager:
             logger.debug("删除失败：person_id 不能为空")
             return
 
+        self._cache.pop(person_id, None)
+        self._dirty.pop(person_id, None)
+        self._insert_data.pop(person_id, None)
+        self._pending_intervals.pop(person_id, None)
+
         result = db.person_info.delete_one({"person_id": person_id})
         if result.deleted_count > 0:
             logger.debug(f"删除成功：person_id={person_id}")
@@ -111,14 +321,20 @@ class PersonInfoManager:
             logger.debug(f"get_value获取失败：字段'{field_name}'未定义")
             return None
 
-        document = db.person_info.find_one({"person_id": person_id}, {field_name: 1})
-
-        if document and field_name in document:
-            return document[field_name]
+        if field_name in uncached_fields:
+            if person_id in self._pending_intervals or person_id in self._dirty:
+                await self.flush()
+            document = db.person_info.find_one({"person_id": person_id}, {field_name: 1})
+            if document and field_name in document:
+                return document[field_name]
         else:
-            default_value = copy.deepcopy(person_info_default[field_name])
-            logger.trace(f"获取{person_id}的{field_name}失败，已返回默认值{default_value}")
-            return default_value
+            cached = self._get_cached(person_id)
+            if field_name in cached:
+                return self._copy_value(cached[field_name])
+
+        default_value = copy.deepcopy(person_info_default[field_name])
+        logger.trace(f"获取{person_id}的{field_name}失败，已返回默认值{default_value}")
+        return default_value
 
     async def get_values(self, person_id: str, field_names: list) -> dict:
         """获取指定person_id文档的多个字段值，若不存在该字段，则返回该字段的全局默认值"""
@@ -132,17 +348,38 @@ class PersonInfoManager:
                 logger.debug(f"get_values获取失败：字段'{field}'未定义")
                 return {}
 
-        # 构建查询投影（所有字段都有效才会执行到这里）
-        projection = {field: 1 for field in field_names}
+        result = {}
+        for field in field_names:
+            result[field] = await self.get_value(person_id, field)
 
-        document = db.person_info.find_one({"person_id": person_id}, projection)
+        return result
 
-        result = {}
+    async def get_many(self, person_ids: List[str], field_names: list) -> Dict[str, dict]:
+        """批量获取多个person_id的字段值，缓存未命中的部分用一次$in查询取回
+
+        Returns:
+            {person_id: {field: value}}，字段不存在时为全局默认值
+        """
         for field in field_names:
-            result[field] = copy.deepcopy(
-                document.get(field, person_info_default[field]) if document else person_info_default[field]
-            )
+            if field not in person_info_default or field in uncached_fields:
+                logger.debug(f"get_many获取失败：字段'{field}'未定义或不支持批量获取")
+                return {}
+
+        missing = [pid for pid in dict.fromkeys(person_ids) if pid and pid not in self._cache]
+        if missing:
+            projection = {field: 0 for field in uncached_fields}
+            documents = {
+                doc["person_id"]: doc for doc in db.person_info.find({"person_id": {"$in": missing}}, projection)
+            }
+            for person_id in missing:
+                self._cache_document(person_id, documents.get(person_id))
 
+        result = {}
+        for person_id in person_ids:
+            if not person_id:
+                continue
+            cached = self._get_cached(person_id)
+            result[person_id] = {field: self._copy_value(cached[field]) for field in field_names}
         return result
 
     async def del_all_undefined_field(self):
@@ -151,6 +388,7 @@ class PersonInfoManager:
         defined_fields = set(person_info_default.keys())
 
         try:
+            await self.flush()
             # 遍历集合中的所有文档
             for document in db.person_info.find({}):
                 # 找出文档中未定义的字段
@@ -198,6 +436,7 @@ class PersonInfoManager:
             return {}
 
         try:
+            await self.flush()
             result = {}
             for doc in db.person_info.find({field_name: {"$exists": True}}, {"person_id": 1, field_name: 1, "_id": 0}):
                 try:
@@ -223,56 +462,10 @@ class PersonInfoManager:
                 logger.info(f"个人信息推断启动: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
 
                 # "msg_interval"推断
-                msg_interval_map = False
-                msg_interval_lists = await self.get_specific_value_list(
-                    "msg_interval_list", lambda x: isinstance(x, list) and len(x) >= 100
-                )
-                for person_id, msg_interval_list_ in msg_interval_lists.items():
-                    try:
-                        time_interval = []
-                        for t1, t2 in zip(msg_interval_list_, msg_interval_list_[1:]):
-                            delta = t2 - t1
-                            if delta > 0:
-                                time_interval.append(delta)
-
-                        time_interval = [t for t in time_interval if 500 <= t <= 8000]
-                        if len(time_interval) >= 30:
-                            time_interval.sort()
-
-                            # 画图(log)
-                            msg_interval_map = True
-                            log_dir = Path("logs/person_info")
-                            log_dir.mkdir(parents=True, exist_ok=True)
-                            plt.figure(figsize=(10, 6))
-                            time_series = pd.Series(time_interval)
-                            plt.hist(time_series, bins=50, density=True, alpha=0.4, color="pink", label="Histogram")
-                            time_series.plot(kind="kde", color="mediumpurple", linewidth=1, label="Density")
-                            plt.grid(True, alpha=0.2)
-                            plt.xlim(0, 8000)
-                            plt.title(f"Message Interval Distribution (User: {person_id[:8]}...)")
-                            plt.xlabel("Interval (ms)")
-                            plt.ylabel("Density")
-                            plt.legend(framealpha=0.9, facecolor="white")
-                            img_path = log_dir / f"interval_distribution_{person_id[:8]}.png"
-                            plt.savefig(img_path)
-                            plt.close()
-                            # 画图
-
-                            q25, q75 = np.percentile(time_interval, [25, 75])
-                            iqr = q75 - q25
-                            filtered = [x for x in time_interval if (q25 - 1.5 * iqr) <= x <= (q75 + 1.5 * iqr)]
-
-                            msg_interval = int(round(np.percentile(filtered, 80)))
-                            await self.update_one_field(person_id, "msg_interval", msg_interval)
-                            logger.trace(f"用户{person_id}的msg_interval已经被更新为{msg_interval}")
-                    except Exception as e:
-                        logger.trace(f"用户{person_id}消息间隔计算失败: {type(e).__name__}: {str(e)}")
-                        continue
+                await self.msg_interval_deduction()
 
                 # 其他...
 
-                if msg_interval_map:
-                    logger.trace("已保存分布图到: logs/person_info")
                 current_time = datetime.datetime.now()
                 logger.trace(f"个人信息推断结束: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
                 await asyncio.sleep(86400)
@@ -281,5 +474,66 @@ class PersonInfoManager:
             logger.error(f"个人信息推断运行时出错: {str(e)}")
             logger.exception("详细错误信息：")
 
+    async def msg_interval_deduction(self):
+        """批量推断所有用户的msg_interval，结果一次bulk_write写回"""
+        await self.flush()
+        # 只取消息时间戳不少于100条的用户，过滤在数据库中完成
+        documents = await asyncio.to_thread(
+            lambda: list(
+                db.person_info.find(
+                    {"msg_interval_list.99": {"$exists": True}},
+                    {"person_id": 1, "msg_interval_list": 1, "_id": 0},
+                )
+            )
+        )
+        if not documents:
+            return
+
+        person_ids = [doc["person_id"] for doc in documents]
+        msg_interval_lists = [doc["msg_interval_list"] for doc in documents]
+        try:
+            msg_intervals, valid, intervals = await asyncio.to_thread(compute_msg_intervals, msg_interval_lists)
+        except Exception as e:
+            logger.error(f"消息间隔计算失败: {type(e).__name__}: {str(e)}")
+            return
+
+        operations = []
+        for person_id, msg_interval, is_valid in zip(person_ids, msg_intervals, valid):
+            if not is_valid:
+                continue
+            msg_interval = int(msg_interval)
+            operations.append(UpdateOne({"person_id": person_id}, {"$set": {"msg_interval": msg_interval}}))
+            if person_id in self._cache:
+                self._cache[person_id]["msg_interval"] = msg_interval
+            logger.trace(f"用户{person_id}的msg_interval已经被更新为{msg_interval}")
+
+        if operations:
+            try:
+                await asyncio.to_thread(db.person_info.bulk_write, operations, ordered=False)
+            except Exception as e:
+                logger.error(f"msg_interval写回失败: {str(e)}")
+
+        if self.plot_habit_distribution:
+            await self._plot_msg_interval_distributions(person_ids, valid, intervals)
+
+    async def _plot_msg_interval_distributions(self, person_ids: List[str], valid, intervals):
+        """在进程池中画出各用户的消息间隔分布图"""
+        log_dir = "logs/person_info"
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            futures = []
+            for person_id, is_valid, row in zip(person_ids, valid, intervals):
+                if not is_valid:
+                    continue
+                time_interval = np.sort(row[~np.isnan(row)]).tolist()
+                futures.append(
+                    loop.run_in_executor(executor, plot_interval_distribution, person_id, time_interval, log_dir)
+                )
+            results = await asyncio.gather(*futures, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.trace(f"消息间隔分布图绘制失败: {type(result).__name__}: {str(result)}")
+        logger.trace(f"已保存分布图到: {log_dir}")
+
 
-person_info_manager = PersonInfoManager()
+person_info_manager = PersonInfoManager(plot_habit_distribution=global_config.plot_habit_distribution)
@@ -12,6 +12,10 @@ relationship_config = LogConfig(
 )
 logger = get_module_logger("rel_manager", config=relationship_config)
 
+# 各关系等级（calculate_level_num的结果）对应的态度和回复态度
+RELATIONSHIP_LEVELS = ["厌恶", "冷漠", "一般", "友好", "喜欢", "暧昧"]
+RELATION_PROMPTS = ["厌恶回应", "冷淡回复", "保持理性", "愿意回复", "积极回复", "无条件支持"]
+
 
 class RelationshipManager:
     def __init__(self):
@@ -254,20 +258,22 @@ class RelationshipManager:
     async def build_relationship_info(self, person) -> str:
         person_id = person_info_manager.get_person_id(person[0], person[1])
         relationship_value = await person_info_manager.get_value(person_id, "relationship_value")
-        level_num = self.calculate_level_num(relationship_value)
-        relationship_level = ["厌恶", "冷漠", "一般", "友好", "喜欢", "暧昧"]
-        relation_prompt2_list = [
-            "厌恶回应",
-            "冷淡回复",
-            "保持理性",
-            "愿意回复",
-            "积极回复",
-            "无条件支持",
-        ]
+        return self._format_relationship_info(person, relationship_value)
+
+    async def build_relationship_infos(self, persons: list) -> str:
+        """批量构建多个用户的关系提示词，关系值通过一次批量查询获取"""
+        person_ids = [person_info_manager.get_person_id(person[0], person[1]) for person in persons]
+        values = await person_info_manager.get_many(person_ids, ["relationship_value"])
+        return "".join(
+            self._format_relationship_info(person, values.get(person_id, {}).get("relationship_value", 0))
+            for person, person_id in zip(persons, person_ids)
+        )
 
+    def _format_relationship_info(self, person, relationship_value) -> str:
+        level_num = self.calculate_level_num(relationship_value)
         return (
-            f"你对昵称为'({person[1]}){person[2]}'的用户的态度为{relationship_level[level_num]}，"
-            f"回复态度为{relation_prompt2_list[level_num]}，关系等级为{level_num}。"
+            f"你对昵称为'({person[1]}){person[2]}'的用户的态度为{RELATIONSHIP_LEVELS[level_num]}，"
+            f"回复态度为{RELATION_PROMPTS[level_num]}，关系等级为{level_num}。"
         )
 
     def calculate_level_num(self, relationship_value) -> int:
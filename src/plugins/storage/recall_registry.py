@@ -0,0 +1,97 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from ...common.database import db
+from src.common.logger import get_module_logger
+
+logger = get_module_logger("recall_registry")
+
+
+class RecallRegistry:
+    """撤回消息登记表
+
+    在内存中按聊天流维护撤回消息id集合（带过期时间），发送前的撤回检查为O(1)，不再访问数据库；
+    新的撤回记录由后台任务批量写入recalled_messages集合。
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl  # 撤回记录的有效期（秒），与remove_recalled_message的清理窗口一致
+        self._recalled: Dict[str, Dict[str, float]] = {}  # stream_id -> {message_id: 撤回时间}
+        self._pending: List[dict] = []  # 等待写入数据库的记录
+        self._flush_task: Optional[asyncio.Task] = None
+        self._loaded = False
+
+    def _ensure_loaded(self) -> None:
+        """首次使用时从数据库加载有效期内的撤回记录"""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            for record in db.recalled_messages.find({"time": {"$gte": time.time() - self.ttl}}):
+                self._recalled.setdefault(record["stream_id"], {})[record["message_id"]] = record["time"]
+        except Exception:
+            logger.exception("加载撤回消息失败")
+
+    def add(self, stream_id: str, message_id: str, recall_time: float) -> None:
+        """登记撤回消息，并安排异步写入数据库"""
+        self._ensure_loaded()
+        self._recalled.setdefault(stream_id, {})[message_id] = recall_time
+        self._pending.append({"message_id": message_id, "time": recall_time, "stream_id": stream_id})
+        self._schedule_flush()
+
+    def is_recalled(self, stream_id: str, message_id: Optional[str]) -> bool:
+        """检查消息是否已被撤回"""
+        if message_id is None:
+            return False
+        self._ensure_loaded()
+        stream_recalled = self._recalled.get(stream_id)
+        if not stream_recalled:
+            return False
+        recall_time = stream_recalled.get(message_id)
+        if recall_time is None:
+            return False
+        if recall_time < time.time() - self.ttl:
+            del stream_recalled[message_id]
+            return False
+        return True
+
+    def expire(self, now: Optional[float] = None) -> None:
+        """清理过期的撤回记录"""
+        expire_before = (now or time.time()) - self.ttl
+        for stream_id in list(self._recalled.keys()):
+            stream_recalled = self._recalled[stream_id]
+            for message_id in [k for k, v in stream_recalled.items() if v < expire_before]:
+                del stream_recalled[message_id]
+            if not stream_recalled:
+                del self._recalled[stream_id]
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task and not self._flush_task.done():
+            return
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+        except RuntimeError:
+            # 没有运行中的事件循环时直接同步写入
+            self._write(self._take_pending())
+
+    def _take_pending(self) -> List[dict]:
+        pending, self._pending = self._pending, []
+        return pending
+
+    @staticmethod
+    def _write(records: List[dict]) -> None:
+        if records:
+            db.recalled_messages.insert_many(records, ordered=False)
+
+    async def flush(self) -> None:
+        """把待写入的撤回记录批量写入数据库"""
+        while self._pending:
+            records = self._take_pending()
+            try:
+                await asyncio.to_thread(self._write, records)
+            except Exception:
+                logger.exception("存储撤回消息失败")
+
+
+recall_registry = RecallRegistry()
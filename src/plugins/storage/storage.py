@@ -4,6 +4,8 @@ from typing import Union
 from ...common.database import db
 from ..chat.message import MessageSending, MessageRecv
 from ..chat.chat_stream import ChatStream
+from ..chat.message_stats import message_range_stats
+from .recall_registry import recall_registry
 from src.common.logger import get_module_logger
 
 logger = get_module_logger("message_storage")
@@ -39,29 +41,23 @@ class MessageStorage:
                 "detailed_plain_text": filtered_detailed_plain_text,
                 "memorized_times": message.memorized_times,
             }
+            message_range_stats.record(chat_stream.stream_id, message_data["time"], filtered_processed_plain_text)
             db.messages.insert_one(message_data)
         except Exception:
             logger.exception("存储消息失败")
 
-    async def store_recalled_message(self, message_id: str, time: str, chat_stream: ChatStream) -> None:
-        """存储撤回消息到数据库"""
-        if "recalled_messages" not in db.list_collection_names():
-            db.create_collection("recalled_messages")
-        else:
-            try:
-                message_data = {
-                    "message_id": message_id,
-                    "time": time,
-                    "stream_id": chat_stream.stream_id,
-                }
-                db.recalled_messages.insert_one(message_data)
-            except Exception:
-                logger.exception("存储撤回消息失败")
+    async def store_recalled_message(self, message_id: str, time: float, chat_stream: ChatStream) -> None:
+        """登记撤回消息，由撤回登记表异步写入数据库"""
+        try:
+            recall_registry.add(chat_stream.stream_id, message_id, time)
+        except Exception:
+            logger.exception("存储撤回消息失败")
 
-    async def remove_recalled_message(self, time: str) -> None:
+    async def remove_recalled_message(self, time: float) -> None:
         """删除撤回消息"""
         try:
-            db.recalled_messages.delete_many({"time": {"$lt": time - 300}})
+            recall_registry.expire(time)
+            db.recalled_messages.delete_many({"time": {"$lt": time - recall_registry.ttl}})
         except Exception:
             logger.exception("删除撤回消息失败")
 
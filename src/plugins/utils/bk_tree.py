@@ -0,0 +1,67 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class _Node:
+    __slots__ = ("key", "values", "children")
+
+    def __init__(self, key: int, value: Any):
+        self.key = key
+        self.values = [value]
+        self.children: Dict[int, "_Node"] = {}  # 与本节点的距离 -> 子节点
+
+
+class BKTree:
+    """按汉明距离组织的BK树，用于查找相近的感知哈希
+
+    查询时利用三角不等式，只进入距离在[d - max_distance, d + max_distance]范围内的子树，
+    距离阈值较小时只需要比较很少一部分哈希。键相同的多个值存放在同一个节点上。
+    """
+
+    def __init__(self):
+        self._root: Optional[_Node] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, key: int, value: Any) -> None:
+        self._size += 1
+        if self._root is None:
+            self._root = _Node(key, value)
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(key, node.key)
+            if distance == 0:
+                if value not in node.values:
+                    node.values.append(value)
+                else:
+                    self._size -= 1
+                return
+            child = node.children.get(distance)
+            if child is None:
+                node.children[distance] = _Node(key, value)
+                return
+            node = child
+
+    def search(self, key: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """返回距离不超过max_distance的所有(距离, 值)，按距离升序排列"""
+        results = []
+        if self._root is None or max_distance < 0:
+            return results
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(key, node.key)
+            if distance <= max_distance:
+                results.extend((distance, value) for value in node.values)
+            low, high = distance - max_distance, distance + max_distance
+            for child_distance, child in node.children.items():
+                if low <= child_distance <= high:
+                    stack.append(child)
+        results.sort(key=lambda item: item[0])
+        return results
@@ -1,6 +1,8 @@
-from typing import Dict, Any, Optional, List, Union
+from typing import Dict, Any, Optional, List, Union, Callable, Awaitable, NamedTuple, Tuple
 import re
+import string
 from contextlib import asynccontextmanager
+from functools import lru_cache
 import asyncio
 from src.common.logger import get_module_logger
 # import traceback
@@ -50,6 +52,7 @@ class PromptManager:
         self._counter = 0
         self._context = PromptContext()
         self._lock = asyncio.Lock()
+        self._fragments: Dict[str, Tuple[Any, str]] = {}  # 片段名 -> (key, 内容)
 
     @asynccontextmanager
     async def async_message_scope(self, message_id: str):
@@ -88,11 +91,59 @@ class PromptManager:
         prompt = await self.get_prompt_async(name)
         return prompt.format(**kwargs)
 
+    async def get_fragment(self, name: str, key: Any, build: Callable[[], Awaitable[str]]) -> str:
+        """获取只由key决定的静态片段
+
+        key与上次相同时直接返回上次构建的内容，否则调用build重新构建。
+        key应当包含片段依赖的全部状态（配置项、日程进度等），状态变化时片段自动失效。
+        """
+        cached = self._fragments.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        value = await build()
+        self._fragments[name] = (key, value)
+        return value
+
+    def clear_fragments(self) -> None:
+        """清空所有缓存的片段"""
+        self._fragments.clear()
+
 
 # 全局单例
 global_prompt_manager = PromptManager()
 
 
+class _RenderPlan(NamedTuple):
+    """模板编译后的结果，同一个模板只解析一次"""
+
+    processed: str  # 转义花括号替换为临时标记后的模板
+    args: Tuple[str, ...]  # 模板中的参数名，按首次出现的顺序
+    # (字面文本, 参数名或None)的序列；模板含有格式说明、属性访问等复杂字段时为None，按原方式格式化
+    segments: Optional[Tuple[Tuple[str, Optional[str]], ...]]
+
+
+@lru_cache(maxsize=1024)
+def _compile_template(template: str) -> _RenderPlan:
+    processed = Prompt._process_escaped_braces(template)
+
+    template_args = []
+    for expr in re.findall(r"\{(.*?)\}", processed):
+        if expr and expr not in template_args:
+            template_args.append(expr)
+
+    segments = []
+    try:
+        for literal, field, format_spec, conversion in string.Formatter().parse(processed):
+            if field is not None and (format_spec or conversion or not field.isidentifier()):
+                segments = None
+                break
+            segments.append((Prompt._restore_escaped_braces(literal), field))
+    except ValueError:
+        # 模板语法错误，格式化时按原方式报错
+        segments = None
+    return _RenderPlan(processed, tuple(template_args), tuple(segments) if segments is not None else None)
+
+
 class Prompt(str):
     # 临时标记，作为类常量
     _TEMP_LEFT_BRACE = "__ESCAPED_LEFT_BRACE__"
@@ -114,15 +165,8 @@ class Prompt(str):
             args = list(args)
         should_register = kwargs.pop("_should_register", True)
 
-        # 预处理模板中的转义花括号
-        processed_fstr = cls._process_escaped_braces(fstr)
-
-        # 解析模板
-        template_args = []
-        result = re.findall(r"\{(.*?)\}", processed_fstr)
-        for expr in result:
-            if expr and expr not in template_args:
-                template_args.append(expr)
+        # 解析模板（结果按模板缓存）
+        template_args = list(_compile_template(fstr).args)
 
         # 如果提供了初始参数，立即格式化
         if kwargs or args:
@@ -160,14 +204,12 @@ class Prompt(str):
 
     @classmethod
     def _format_template(cls, template: str, args: List[Any] = None, kwargs: Dict[str, Any] = None) -> str:
-        # 预处理模板中的转义花括号
-        processed_template = cls._process_escaped_braces(template)
-
-        template_args = []
-        result = re.findall(r"\{(.*?)\}", processed_template)
-        for expr in result:
-            if expr and expr not in template_args:
-                template_args.append(expr)
+        plan = _compile_template(template)
+        if kwargs and not args and plan.segments is not None:
+            return cls._render(template, plan.segments, kwargs)
+
+        processed_template = plan.processed
+        template_args = plan.args
         formatted_args = {}
         formatted_kwargs = {}
 
@@ -212,8 +254,26 @@ class Prompt(str):
                 f"格式化模板失败: {template}, args={formatted_args}, kwargs={formatted_kwargs} {str(e)}"
             ) from e
 
+    @classmethod
+    def _render(cls, template: str, segments: Tuple[Tuple[str, Optional[str]], ...], kwargs: Dict[str, Any]) -> str:
+        """按编译好的片段拼接结果，与_format_template只传关键字参数时的结果相同"""
+        parts = []
+        for literal, field in segments:
+            parts.append(literal)
+            if field is None:
+                continue
+            if field not in kwargs:
+                raise ValueError(f"格式化模板失败: {template}, kwargs={kwargs} 缺少参数 {field!r}")
+            value = kwargs[field]
+            if isinstance(value, Prompt):
+                value = value.format(**{k: v for k, v in kwargs.items() if k != field})
+            parts.append(value if type(value) is str else format(value))
+        return "".join(parts)
+
     def format(self, *args, **kwargs) -> "str":
         """支持位置参数和关键字参数的格式化，使用"""
+        if kwargs and not args and not self._args:
+            return self._format_template(self.template, kwargs=kwargs)
         ret = type(self)(
             self.template,
             self.name,
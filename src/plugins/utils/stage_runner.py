@@ -0,0 +1,94 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from src.common.logger import get_module_logger
+
+from .timer_calculater import Timer
+
+logger = get_module_logger("stage_runner")
+
+
+@dataclass(frozen=True)
+class Stage:
+    """一个异步阶段
+
+    func是协程函数，以依赖阶段的结果作为同名关键字参数调用。
+    超时或出错时以fallback作为该阶段的结果，依赖它的阶段照常执行。
+    """
+
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    deps: Tuple[str, ...] = ()
+    timeout: Optional[float] = None
+    fallback: Any = None
+
+
+def _check_graph(stages: Dict[str, Stage]) -> None:
+    """检查依赖是否都存在、是否有环"""
+    for stage in stages.values():
+        for dep in stage.deps:
+            if dep not in stages:
+                raise ValueError(f"阶段 {stage.name} 依赖不存在的阶段 {dep}")
+
+    visiting, done = set(), set()
+
+    def visit(name: str) -> None:
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"阶段之间存在循环依赖: {name}")
+        visiting.add(name)
+        for dep in stages[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+
+    for name in stages:
+        visit(name)
+
+
+async def run_stages(
+    stages: Iterable[Stage], timings: Optional[Dict[str, float]] = None, concurrency: int = 8
+) -> Dict[str, Any]:
+    """按依赖关系并发执行各阶段，返回 阶段名 -> 结果
+
+    没有依赖关系的阶段同时开始，总耗时取决于最长的依赖链而不是所有阶段之和。
+    同时运行的阶段数不超过concurrency；阶段在依赖完成后才占用名额，不会因依赖而死锁。
+
+    Args:
+        stages: 要执行的阶段，名字不能重复
+        timings: 传入时用Timer记录每个阶段的耗时（秒），包括超时和出错的阶段
+        concurrency: 最多同时运行的阶段数
+    """
+    graph: Dict[str, Stage] = {}
+    for stage in stages:
+        if stage.name in graph:
+            raise ValueError(f"阶段名重复: {stage.name}")
+        graph[stage.name] = stage
+    _check_graph(graph)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(stage: Stage) -> Any:
+        inputs = {dep: await tasks[dep] for dep in stage.deps}
+        async with semaphore:
+            try:
+                with Timer(stage.name, timings):
+                    return await asyncio.wait_for(stage.func(**inputs), stage.timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"阶段 {stage.name} 超过 {stage.timeout} 秒未完成，使用默认值")
+            except Exception as e:
+                logger.error(f"阶段 {stage.name} 执行失败，使用默认值: {str(e)}")
+            return stage.fallback
+
+    for stage in graph.values():
+        tasks[stage.name] = asyncio.create_task(run(stage))
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        # 调用方被取消时一并取消还没完成的阶段
+        for task in tasks.values():
+            task.cancel()
+    return {name: task.result() for name, task in tasks.items()}
@@ -0,0 +1,82 @@
+import asyncio
+import math
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+
+from src.common.logger import get_module_logger
+
+logger = get_module_logger("timer_wheel")
+
+
+class TimerWheel:
+    """哈希时间轮
+
+    用一个后台任务代替大量各自sleep的定时任务：定时项按到期刻度散列到槽中，
+    每个刻度推进一次，把本次到期的所有项一起交给on_expire批量处理。
+    没有定时项时后台任务自动退出，下次schedule时再启动。
+    """
+
+    def __init__(
+        self,
+        on_expire: Callable[[List[Any]], Awaitable[None]],
+        tick: float = 0.1,
+        slots: int = 512,
+    ):
+        self.on_expire = on_expire
+        self.tick = tick  # 每个刻度的时长（秒）
+        self.slots = slots
+        self._wheel: List[List[tuple]] = [[] for _ in range(slots)]  # 每个槽内为 (到期刻度, 定时项)
+        self._base_time = time.monotonic()
+        self._current_tick = 0
+        self._count = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _now_tick(self) -> int:
+        return int((time.monotonic() - self._base_time) / self.tick)
+
+    def schedule(self, delay: float, item: Any) -> None:
+        """在delay秒后触发item"""
+        if self._count == 0 and (self._task is None or self._task.done()):
+            # 时间轮为空，直接把指针拨到当前刻度
+            self._current_tick = self._now_tick()
+        expire_tick = max(
+            self._current_tick + 1,
+            math.ceil((time.monotonic() + delay - self._base_time) / self.tick),
+        )
+        self._wheel[expire_tick % self.slots].append((expire_tick, item))
+        self._count += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _advance(self, target_tick: int) -> List[Any]:
+        """推进指针到target_tick，返回期间到期的定时项"""
+        expired = []
+        while self._current_tick < target_tick:
+            self._current_tick += 1
+            index = self._current_tick % self.slots
+            bucket = self._wheel[index]
+            if not bucket:
+                continue
+            keep = []
+            for expire_tick, item in bucket:
+                if expire_tick <= self._current_tick:
+                    expired.append(item)
+                else:
+                    keep.append((expire_tick, item))
+            self._wheel[index] = keep
+        self._count -= len(expired)
+        return expired
+
+    async def _run(self):
+        while self._count > 0:
+            await asyncio.sleep(self.tick)
+            expired = self._advance(self._now_tick())
+            if not expired:
+                continue
+            try:
+                await self.on_expire(expired)
+            except Exception:
+                logger.exception("时间轮回调执行失败")
@@ -1,6 +1,8 @@
+import asyncio
 import os
 import sys
-import requests
+import time
+from typing import Dict, Iterator, List
 from dotenv import load_dotenv
 import hashlib
 from datetime import datetime
@@ -14,6 +16,10 @@ sys.path.append(root_path)
 
 # 现在可以导入src模块
 from src.common.database import db  # noqa E402
+from src.common.embedding_codec import compact_embeddings, encode_embedding  # noqa E402
+from src.common.knowledge_index import KnowledgeIndex  # noqa E402
+from src.plugins.config.config import global_config  # noqa E402
+from src.plugins.models.utils_model import LLM_request  # noqa E402
 
 # 加载根目录下的env.edv文件
 env_path = os.path.join(root_path, ".env")
@@ -23,12 +29,20 @@ load_dotenv(env_path)
 
 
 class KnowledgeLibrary:
-    def __init__(self):
+    def __init__(self, batch_size: int = 32, concurrency: int = 4):
+        """
+        Args:
+            batch_size: 每个embedding请求包含的文本块数
+            concurrency: 同时进行的embedding请求数
+        """
         self.raw_info_dir = "data/raw_info"
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        # 使用机器人配置的embedding模型，保证导入的向量和检索时的查询向量来自同一个模型
+        self.embedding_llm = LLM_request(model=global_config.embedding, request_type="knowledge_import")
+        # 只在内存中维护索引，避免和正在运行的机器人同时写入同一份索引文件
+        self.index = KnowledgeIndex(index_dir=None, sync_interval=0)
         self._ensure_dirs()
-        self.api_key = os.getenv("SILICONFLOW_KEY")
-        if not self.api_key:
-            raise ValueError("SILICONFLOW_API_KEY 环境变量未设置")
         self.console = Console()
 
     def _ensure_dirs(self):
@@ -67,20 +81,36 @@ class KnowledgeLibrary:
 
         return chunks
 
+    def iter_chunks(self, file_path: str, max_length: int = 512) -> Iterator[str]:
+        """逐行读取文件并依次产出文本块，分割结果与split_content相同，但不需要把整个文件读入内存"""
+        pending = ""  # 当前段落中还没有产出的部分
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line == "\n":
+                    # 空行，段落结束
+                    pending = pending.rstrip()
+                    if pending:
+                        yield from (pending[i : i + max_length] for i in range(0, len(pending), max_length))
+                    pending = ""
+                    continue
+                pending += line if pending else line.lstrip()
+                # 去掉段尾空白后仍然超过最大长度时，前max_length个字符一定是一个完整的块
+                while len(pending.rstrip()) > max_length:
+                    yield pending[:max_length]
+                    pending = pending[max_length:]
+        pending = pending.rstrip()
+        if pending:
+            yield from (pending[i : i + max_length] for i in range(0, len(pending), max_length))
+
     def get_embedding(self, text: str) -> list:
         """获取文本的embedding向量"""
-        url = "https://api.siliconflow.cn/v1/embeddings"
-        payload = {"model": "BAAI/bge-m3", "input": text, "encoding_format": "float"}
-        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
-
-        response = requests.post(url, json=payload, headers=headers)
-        if response.status_code != 200:
-            print(f"获取embedding失败: {response.text}")
-            return None
-
-        return response.json()["data"][0]["embedding"]
+        return asyncio.run(self.embedding_llm.get_embedding(text))
 
     def process_files(self, knowledge_length: int = 512):
+        """处理raw_info目录下的所有txt文件"""
+        asyncio.run(self.process_files_async(knowledge_length))
+
+    async def process_files_async(self, knowledge_length: int = 512):
         """处理raw_info目录下的所有txt文件"""
         txt_files = [f for f in os.listdir(self.raw_info_dir) if f.endswith(".txt")]
 
@@ -89,54 +119,62 @@ class KnowledgeLibrary:
             self.console.print("[yellow]请将需要处理的文本文件放入该目录后再运行程序[/yellow]")
             return
 
-        total_stats = {"processed_files": 0, "total_chunks": 0, "failed_files": [], "skipped_files": []}
+        total_stats = {
+            "processed_files": 0,
+            "total_chunks": 0,
+            "elapsed": 0.0,
+            "failed_files": [],
+            "skipped_files": [],
+        }
 
         self.console.print(f"\n[bold blue]开始处理知识库文件 - 共{len(txt_files)}个文件[/bold blue]")
 
         for filename in tqdm(txt_files, desc="处理文件进度"):
             file_path = os.path.join(self.raw_info_dir, filename)
-            result = self.process_single_file(file_path, knowledge_length)
+            result = await self.process_single_file(file_path, knowledge_length)
             self._update_stats(total_stats, result, filename)
+            if result["chunks_processed"]:
+                rate = result["chunks_processed"] / max(result["elapsed"], 1e-6)
+                tqdm.write(f"{filename}: 导入 {result['chunks_processed']} 个文本块，{rate:.1f} 块/秒")
 
         self._display_processing_results(total_stats)
 
-    def process_single_file(self, file_path: str, knowledge_length: int = 512):
-        """处理单个文件"""
-        result = {"status": "success", "chunks_processed": 0, "error": None}
+    async def process_single_file(self, file_path: str, knowledge_length: int = 512):
+        """处理单个文件，中断后再次处理同一文件时从上次完成的文本块继续"""
+        result = {"status": "success", "chunks_processed": 0, "elapsed": 0.0, "error": None}
 
         try:
             current_hash = self.calculate_file_hash(file_path)
-            processed_record = db.processed_files.find_one({"file_path": file_path})
-
-            if processed_record:
-                if processed_record.get("hash") == current_hash:
-                    if knowledge_length in processed_record.get("split_by", []):
-                        result["status"] = "skipped"
-                        return result
-
-            content = self.read_file(file_path)
-            chunks = self.split_content(content, knowledge_length)
-
-            for chunk in tqdm(chunks, desc=f"处理 {os.path.basename(file_path)} 的文本块", leave=False):
-                embedding = self.get_embedding(chunk)
-                if embedding:
-                    knowledge = {
-                        "content": chunk,
-                        "embedding": embedding,
-                        "source_file": file_path,
-                        "split_length": knowledge_length,
-                        "created_at": datetime.now(),
-                    }
-                    db.knowledges.insert_one(knowledge)
-                    result["chunks_processed"] += 1
-
-            split_by = processed_record.get("split_by", []) if processed_record else []
+            processed_record = db.processed_files.find_one({"file_path": file_path}) or {}
+
+            if processed_record.get("hash") == current_hash:
+                if knowledge_length in processed_record.get("split_by", []):
+                    result["status"] = "skipped"
+                    return result
+
+            start_chunk = self._resume_point(file_path, processed_record, current_hash, knowledge_length)
+            if start_chunk:
+                self.console.print(
+                    f"[yellow]{os.path.basename(file_path)} 从第 {start_chunk} 个文本块继续导入[/yellow]"
+                )
+
+            start_time = time.time()
+            next_chunk, error = await self._ingest_chunks(file_path, current_hash, knowledge_length, start_chunk)
+            result["chunks_processed"] = next_chunk - start_chunk
+            result["elapsed"] = time.time() - start_time
+            if error:
+                raise RuntimeError(f"{error}，下次运行时从第 {next_chunk} 个文本块继续")
+
+            split_by = processed_record.get("split_by", []) if processed_record.get("hash") == current_hash else []
             if knowledge_length not in split_by:
                 split_by.append(knowledge_length)
 
-            db.knowledges.processed_files.update_one(
+            db.processed_files.update_one(
                 {"file_path": file_path},
-                {"$set": {"hash": current_hash, "last_processed": datetime.now(), "split_by": split_by}},
+                {
+                    "$set": {"hash": current_hash, "last_processed": datetime.now(), "split_by": split_by},
+                    "$unset": {"progress": ""},
+                },
                 upsert=True,
             )
 
@@ -146,11 +184,117 @@ class KnowledgeLibrary:
 
         return result
 
+    def _resume_point(self, file_path: str, processed_record: dict, file_hash: str, knowledge_length: int) -> int:
+        """返回本次导入的起始文本块，并记录导入进度"""
+        progress = processed_record.get("progress") or {}
+        start_chunk = 0
+        if progress.get("hash") == file_hash and progress.get("split_length") == knowledge_length:
+            start_chunk = progress.get("next_chunk", 0)
+            # 中断前乱序完成的批次已经写入数据库，但不在进度之内，删掉后重新导入
+            db.knowledges.delete_many(
+                {
+                    "source_file": file_path,
+                    "file_hash": file_hash,
+                    "split_length": knowledge_length,
+                    "chunk_index": {"$gte": start_chunk},
+                }
+            )
+        db.processed_files.update_one(
+            {"file_path": file_path},
+            {"$set": {"progress": {"hash": file_hash, "split_length": knowledge_length, "next_chunk": start_chunk}}},
+            upsert=True,
+        )
+        return start_chunk
+
+    async def _ingest_chunks(self, file_path: str, file_hash: str, knowledge_length: int, start_chunk: int):
+        """流式读取文件，分批获取embedding并写入数据库
+
+        concurrency个工作协程从有界队列中取批次，文件读取不会领先写入太多。
+        批次可能乱序完成，进度只推进到连续完成的最后一个文本块，每次推进都写入数据库。
+        某个批次失败后停止读取新的批次。
+
+        Returns:
+            (连续完成到的文本块下标, 错误信息)，全部成功时错误信息为None
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        completed: Dict[int, int] = {}  # 已完成但还不连续的批次：起始下标 -> 块数
+        next_chunk = start_chunk
+        errors: List[str] = []
+        progress_bar = tqdm(
+            desc=f"处理 {os.path.basename(file_path)} 的文本块", unit="块", initial=start_chunk, leave=False
+        )
+
+        async def worker():
+            nonlocal next_chunk
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                first, texts = item
+                if errors:
+                    # 已经有批次失败，队列中剩下的批次留到下次续传
+                    continue
+                try:
+                    embeddings = await self.embedding_llm.get_embeddings(texts)
+                    if not embeddings or not all(embeddings):
+                        raise RuntimeError(f"第 {first} 个文本块开始的批次获取embedding失败")
+                    now = datetime.now()
+                    knowledges = [
+                        {
+                            "content": chunk,
+                            "embedding": encode_embedding(embedding),
+                            "source_file": file_path,
+                            "file_hash": file_hash,
+                            "split_length": knowledge_length,
+                            "chunk_index": first + offset,
+                            "created_at": now,
+                        }
+                        for offset, (chunk, embedding) in enumerate(zip(texts, embeddings))
+                    ]
+                    await asyncio.to_thread(db.knowledges.insert_many, knowledges, ordered=False)
+                except Exception as e:
+                    errors.append(str(e))
+                    continue
+
+                progress_bar.update(len(texts))
+                completed[first] = len(texts)
+                while next_chunk in completed:
+                    next_chunk += completed.pop(next_chunk)
+                # $max保证并发写入的进度不会倒退
+                await asyncio.to_thread(
+                    db.processed_files.update_one,
+                    {"file_path": file_path},
+                    {"$max": {"progress.next_chunk": next_chunk}},
+                )
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            first, batch = start_chunk, []
+            for index, chunk in enumerate(self.iter_chunks(file_path, knowledge_length)):
+                if index < start_chunk:
+                    continue
+                if errors:
+                    break
+                batch.append(chunk)
+                if len(batch) >= self.batch_size:
+                    await queue.put((first, batch))
+                    first, batch = first + len(batch), []
+            if batch and not errors:
+                await queue.put((first, batch))
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            progress_bar.close()
+
+        return next_chunk, (errors[0] if errors else None)
+
     def _update_stats(self, total_stats, result, filename):
         """更新总体统计信息"""
+        total_stats["total_chunks"] += result["chunks_processed"]
+        total_stats["elapsed"] += result["elapsed"]
         if result["status"] == "success":
             total_stats["processed_files"] += 1
-            total_stats["total_chunks"] += result["chunks_processed"]
         elif result["status"] == "failed":
             total_stats["failed_files"].append((filename, result["error"]))
         elif result["status"] == "skipped":
@@ -166,6 +310,9 @@ class KnowledgeLibrary:
 
         table.add_row("成功处理文件数", str(stats["processed_files"]))
         table.add_row("处理的知识块总数", str(stats["total_chunks"]))
+        table.add_row("导入耗时", f"{stats['elapsed']:.1f}秒")
+        if stats["elapsed"] > 0:
+            table.add_row("吞吐量", f"{stats['total_chunks'] / stats['elapsed']:.1f} 块/秒")
         table.add_row("跳过的文件数", str(len(stats["skipped_files"])))
         table.add_row("失败的文件数", str(len(stats["failed_files"])))
 
@@ -195,55 +342,9 @@ class KnowledgeLibrary:
         if not query_embedding:
             return []
 
-        # 使用余弦相似度计算
-        pipeline = [
-            {
-                "$addFields": {
-                    "dotProduct": {
-                        "$reduce": {
-                            "input": {"$range": [0, {"$size": "$embedding"}]},
-                            "initialValue": 0,
-                            "in": {
-                                "$add": [
-                                    "$$value",
-                                    {
-                                        "$multiply": [
-                                            {"$arrayElemAt": ["$embedding", "$$this"]},
-                                            {"$arrayElemAt": [query_embedding, "$$this"]},
-                                        ]
-                                    },
-                                ]
-                            },
-                        }
-                    },
-                    "magnitude1": {
-                        "$sqrt": {
-                            "$reduce": {
-                                "input": "$embedding",
-                                "initialValue": 0,
-                                "in": {"$add": ["$$value", {"$multiply": ["$$this", "$$this"]}]},
-                            }
-                        }
-                    },
-                    "magnitude2": {
-                        "$sqrt": {
-                            "$reduce": {
-                                "input": query_embedding,
-                                "initialValue": 0,
-                                "in": {"$add": ["$$value", {"$multiply": ["$$this", "$$this"]}]},
-                            }
-                        }
-                    },
-                }
-            },
-            {"$addFields": {"similarity": {"$divide": ["$dotProduct", {"$multiply": ["$magnitude1", "$magnitude2"]}]}}},
-            {"$sort": {"similarity": -1}},
-            {"$limit": limit},
-            {"$project": {"content": 1, "similarity": 1, "file_path": 1}},
-        ]
-
-        results = list(db.knowledges.aggregate(pipeline))
-        return results
+        # 检索只读取索引快照，先把新导入的知识同步进来
+        self.index.sync()
+        return self.index.search_documents(query_embedding, limit=limit, projection={"content": 1, "file_path": 1})
 
 
 # 创建单例实例
@@ -257,6 +358,7 @@ if __name__ == "__main__":
         console.print("\n请选择要执行的操作：")
         console.print("[1] 麦麦开始学习")
         console.print("[2] 麦麦全部忘光光（仅知识）")
+        console.print("[3] 压缩已有知识的嵌入向量")
         console.print("[q] 退出程序")
 
         choice = input("\n请输入选项: ").strip()
@@ -268,8 +370,13 @@ if __name__ == "__main__":
             confirm = input("确定要删除所有知识吗？这个操作不可撤销！(y/n): ").strip().lower()
             if confirm == "y":
                 db.knowledges.delete_many({})
+                db.processed_files.delete_many({})
                 console.print("[green]已清空所有知识！[/green]")
             continue
+        elif choice == "3":
+            converted = compact_embeddings(db.knowledges)
+            console.print(f"[green]已改写 {converted} 个嵌入向量[/green]")
+            continue
         elif choice == "1":
             if not os.path.exists(knowledge_library.raw_info_dir):
                 console.print(f"[yellow]创建目录：{knowledge_library.raw_info_dir}[/yellow]")